@@ -1,4 +1,4 @@
-import os, copy
+import os, copy, sys
 
 from bashlint import yacc, tokenizer, state, bast, subst, flags, errors, heredoc
 
@@ -538,36 +538,51 @@ def p_error(p):
         raise errors.ParsingError('unexpected token %r' % p.value,
                                   p.lexer.source, p.lexpos)
 
-yaccparser = yacc.yacc(tabmodule='bashlint.parsetab',
-              outputdir=os.path.dirname(__file__),
-              debug=False)
+# binary cache of the LALR tables, yacc rejects it and regenerates the tables
+# if the table version or the grammar signature do not match
+picklefile = os.path.join(os.path.dirname(__file__), 'parsetab.pickle')
+
+_yaccparser = None
+
+def get_yaccparser():
+    '''build the parser on first use, so that importing bashlint does not pay
+    for loading the parsing tables'''
+    global _yaccparser
+    if _yaccparser is None:
+        yaccparser = yacc.yacc(module=sys.modules[__name__],
+                               picklefile=picklefile,
+                               debug=False)
+        fix_yaccparser(yaccparser)
+        _yaccparser = yaccparser
+    return _yaccparser
 
 # some hack to fix yacc's reduction on command substitutions:
 # which state to fix is derived from static transition tables
 # as states are changeable among python versions and architectures
 # the only state that is considered fixed is the initial state: 0
-def get_correction_states():
+def get_correction_states(yaccparser):
     reduce = yaccparser.goto[0]['simple_list'] #~10
     state2 = yaccparser.action[reduce]['NEWLINE'] #63
     state1 = yaccparser.goto[reduce]['simple_list_terminator'] #~10
     return state1, state2
 
-def get_correction_rightparen_states():
+def get_correction_rightparen_states(yaccparser):
     state1 = yaccparser.goto[0]['pipeline_command']
     state2 = yaccparser.goto[0]['simple_list1'] #11
     state_temp = yaccparser.action[state2]['SEMICOLON'] #65
     state3 = yaccparser.goto[state_temp]['simple_list1']
     return state1, state2, state3
 
-for tt in tokenizer.tokentype:
-    states = get_correction_states()
-    yaccparser.action[states[0]][tt.name] = -1
-    yaccparser.action[states[1]][tt.name] = -141
+def fix_yaccparser(yaccparser):
+    for tt in tokenizer.tokentype:
+        states = get_correction_states(yaccparser)
+        yaccparser.action[states[0]][tt.name] = -1
+        yaccparser.action[states[1]][tt.name] = -141
 
-states = get_correction_rightparen_states()
-yaccparser.action[states[0]]['RIGHT_PAREN'] = -155
-yaccparser.action[states[1]]['RIGHT_PAREN'] = -148
-yaccparser.action[states[2]]['RIGHT_PAREN'] = -154
+    states = get_correction_rightparen_states(yaccparser)
+    yaccparser.action[states[0]]['RIGHT_PAREN'] = -155
+    yaccparser.action[states[1]]['RIGHT_PAREN'] = -148
+    yaccparser.action[states[2]]['RIGHT_PAREN'] = -154
 
 def parsesingle(s, strictmode=True, expansionlimit=None, convertpos=False):
     '''like parse, but only consumes a single top level node, e.g. parsing
@@ -672,7 +687,7 @@ class _parser(object):
         # yacc.yacc returns a parser object that is not reentrant, it has
         # some mutable state. we make a shallow copy of it so no
         # state spills over to the next call to parse on it
-        theparser = copy.copy(yaccparser)
+        theparser = copy.copy(get_yaccparser())
         tree = theparser.parse(lexer=self.tok, context=self)
 
         return tree
@@ -7,16 +7,129 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
+import collections
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shelve
 import sys
+import time
 
 if sys.version_info > (3, 0):
-    from six.moves import xrange
+    from six.moves import cPickle as pickle
+else:
+    import cPickle as pickle
 
 from bashlint import bash, lint, nast
 
 flag_suffix = '<FLAG_SUFFIX>'
 
 
+# --- Parse cache --- #
+
+class ParseCache(object):
+    """
+    Bounded LRU cache of parsing results, optionally backed by an on-disk shelf.
+
+    Entries are keyed by the content of the surface-normalized command plus the
+    parsing options, hence two commands which only differ in the surface forms
+    removed by "correct_errors_and_normalize_surface" share the same entry.
+    ASTs are stored in their pickled form so that every lookup returns a fresh
+    copy which the caller is free to modify.
+    """
+    def __init__(self, capacity=20000, shelf_path=None):
+        """
+        :param capacity: Maximum number of entries kept in memory. The cache is
+            disabled if set to 0.
+        :param shelf_path: If set, entries are also persisted to the shelf
+            file at this path.
+        """
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.shelf = shelve.open(shelf_path) if shelf_path else None
+        self.hits = 0
+        self.shelf_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute_fun):
+        """
+        Return the cached value of key, calling compute_fun() on a miss.
+        """
+        if self.capacity <= 0:
+            return compute_fun()
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+        if self.shelf is not None:
+            shelf_key = self.shelf_key(key)
+            if shelf_key in self.shelf:
+                self.shelf_hits += 1
+                value = self.shelf[shelf_key]
+                self.insert(key, value)
+                return value
+        self.misses += 1
+        value = compute_fun()
+        self.insert(key, value)
+        if self.shelf is not None:
+            self.shelf[shelf_key] = value
+        return value
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def shelf_key(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.shelf_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def close(self):
+        if self.shelf is not None:
+            self.shelf.close()
+            self.shelf = None
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'shelf_hits': self.shelf_hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+parse_cache = ParseCache()
+
+
+def set_parse_cache(capacity=20000, shelf_path=None):
+    """
+    Replace the parse cache shared by "bash_parser", "bash_tokenizer" and
+    "cmd2template".
+    """
+    global parse_cache
+    parse_cache.close()
+    parse_cache = ParseCache(capacity, shelf_path)
+    return parse_cache
+
+
+def parse_cache_key(cmd, *options):
+    cmd = lint.correct_errors_and_normalize_surface(cmd.replace('\n', ' ').strip())
+    return (cmd,) + options
+
+
 def correct_errors_and_normalize_surface(cm):
     return lint.correct_errors_and_normalize_surface(cm)
 
@@ -49,17 +162,31 @@ def bash_tokenizer(cmd, recover_quotation=True, loose_constraints=False,
     """
     Tokenize a bash command.
     """
-    tree = lint.normalize_ast(cmd, recover_quotation, verbose=verbose)
-    return ast2tokens(tree, loose_constraints, ignore_flag_order,
-                      arg_type_only, with_flag_head=with_flag_head,
-                      with_prefix=with_prefix, with_flag_argtype=with_flag_argtype)
+    def tokenize():
+        # share the cached AST between tokenizations with different options
+        tree = lint.normalize_ast(cmd, recover_quotation, verbose=verbose) \
+            if verbose else bash_parser(cmd, recover_quotation)
+        return tuple(ast2tokens(tree, loose_constraints, ignore_flag_order,
+            arg_type_only, with_flag_head=with_flag_head,
+            with_prefix=with_prefix, with_flag_argtype=with_flag_argtype))
+
+    if verbose:
+        return list(tokenize())
+    key = parse_cache_key(cmd, 'tokens', recover_quotation, loose_constraints,
+        ignore_flag_order, arg_type_only, with_flag_head, with_flag_argtype,
+        with_prefix)
+    return list(parse_cache.get(key, tokenize))
 
 
 def bash_parser(cmd, recover_quotation=True, verbose=False):
     """
     Parse bash command into AST.
     """
-    return lint.normalize_ast(cmd, recover_quotation, verbose=verbose)
+    if verbose:
+        return lint.normalize_ast(cmd, recover_quotation, verbose=verbose)
+    key = parse_cache_key(cmd, 'ast', recover_quotation)
+    return pickle.loads(parse_cache.get(key, lambda: pickle.dumps(
+        lint.normalize_ast(cmd, recover_quotation), pickle.HIGHEST_PROTOCOL)))
 
 
 def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
@@ -86,47 +213,55 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
     """
     if not node:
         return []
+    node = nast.get_root(node)
 
     lc = loose_constraints
 
-    def to_tokens_fun(node):
-        tokens = []
+    # The tree is traversed depth-first with an explicit stack of nodes and
+    # pending tokens. Tokens preceding the children of a node are written to
+    # the output list directly; the children and the tokens following them
+    # are pushed onto the stack in reverse order.
+    tokens = []
+    stack = [node]
+
+    def push(items):
+        stack.extend(reversed(items))
+
+    def expand(node):
         if node.is_root():
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc:
-                for child in node.children:
-                    tokens += to_tokens_fun(child)
+                push(node.children)
             else:
-                tokens = to_tokens_fun(node.children[0])
+                stack.append(node.children[0])
         elif node.kind == "pipeline":
             assert(loose_constraints or node.get_num_of_children() > 1)
             if lc and node.get_num_of_children() < 1:
                 tokens.append("|")
             elif lc and node.get_num_of_children() == 1:
                 # treat "singleton-pipe" as atomic command
-                tokens += to_tokens_fun(node.children[0])
+                stack.append(node.children[0])
             else:
+                items = []
                 for child in node.children[:-1]:
-                    tokens += to_tokens_fun(child)
-                    tokens.append("|")
-                tokens += to_tokens_fun(node.children[-1])
+                    items.append(child)
+                    items.append("|")
+                items.append(node.children[-1])
+                push(items)
         elif node.kind == "commandsubstitution":
             assert(loose_constraints or node.get_num_of_children() == 1)
+            tokens.append("$(")
             if lc and node.get_num_of_children() < 1:
-                tokens += ["$(", ")"]
-            else:
-                tokens.append("$(")
-                tokens += to_tokens_fun(node.children[0])
                 tokens.append(")")
+            else:
+                push([node.children[0], ")"])
         elif node.kind == "processsubstitution":
             assert(loose_constraints or node.get_num_of_children() == 1)
+            tokens.append(node.value + "(")
             if lc and node.get_num_of_children() < 1:
-                tokens.append(node.value + "(")
                 tokens.append(")")
             else:
-                tokens.append(node.value + "(")
-                tokens += to_tokens_fun(node.children[0])
-                tokens.append(")")
+                push([node.children[0], ")"])
         elif node.is_utility():
             token = node.value
             if with_prefix:
@@ -134,8 +269,7 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
             tokens.append(token)
             children = sorted(node.children, key=lambda x:x.value) \
                 if ignore_flag_order else node.children
-            for child in children:
-                tokens += to_tokens_fun(child)
+            push(children)
         elif node.is_option():
             assert(loose_constraints or node.parent)
             if '::' in node.value and (node.value.startswith('-exec') or 
@@ -161,22 +295,23 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
                             suffix += 'UTILITY'
                 token = token + flag_suffix + suffix
             tokens.append(token)
-            for child in node.children:
-                tokens += to_tokens_fun(child)
             if '::' in node.value and (node.value.startswith('-exec') or
                                        node.value.startswith('-ok')):
                 if op == ';':
                     op = "\\;"
-                tokens.append(op)
+                stack.append(op)
+            push(node.children)
         elif node.kind == 'operator':
             tokens.append(node.value)
         elif node.kind == "binarylogicop":
             assert(loose_constraints or node.get_num_of_children() == 0)
             if lc and node.get_num_of_children() > 0:
+                items = []
                 for child in node.children[:-1]:
-                    tokens += to_tokens_fun(child)
-                    tokens.append(node.value)
-                tokens += to_tokens_fun(node.children[-1])
+                    items.append(child)
+                    items.append(node.value)
+                items.append(node.children[-1])
+                push(items)
             else:
                 tokens.append(node.value)
         elif node.kind == "unarylogicop":
@@ -184,29 +319,24 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
             if lc and node.get_num_of_children() > 0:
                 if node.associate == nast.UnaryLogicOpNode.RIGHT:
                     tokens.append(node.value)
-                    tokens += to_tokens_fun(node.children[0])
+                    stack.append(node.children[0])
                 else:
-                    tokens += to_tokens_fun(node.children[0])
-                    tokens.append(node.value)
+                    push([node.children[0], node.value])
             else:
                 tokens.append(node.value)
         elif node.kind == "bracket":
             assert(loose_constraints or node.get_num_of_children() >= 1)
             if lc and node.get_num_of_children() < 2:
-                for child in node.children:
-                    tokens += to_tokens_fun(child)
+                push(node.children)
             else:
                 tokens.append("\\(")
-                for i in xrange(len(node.children)-1):
-                    tokens += to_tokens_fun(node.children[i])
-                tokens += to_tokens_fun(node.children[-1])
-                tokens.append("\\)")
+                stack.append("\\)")
+                push(node.children)
         elif node.kind == "nt":
             assert(loose_constraints or node.get_num_of_children() > 0)
             tokens.append("(")
-            for child in node.children:
-                tokens += to_tokens_fun(child)
-            tokens.append(")")
+            stack.append(")")
+            push(node.children)
         elif node.is_argument() or node.kind in ["t"]:
             assert(loose_constraints or node.get_num_of_children() == 0)
             if arg_type_only and node.is_open_vocab():
@@ -234,12 +364,16 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
                 token = token + "-{:02d}".format(node.index)
 
             tokens.append(token)
-            if lc:
-                for child in node.children:
-                    tokens += to_tokens_fun(child)
-        return tokens
+            if lc and node.children:
+                push(node.children)
 
-    return to_tokens_fun(node)
+    while stack:
+        item = stack.pop()
+        if isinstance(item, nast.Node):
+            expand(item)
+        else:
+            tokens.append(item)
+    return tokens
 
 
 def ast2command(node, loose_constraints=False, ignore_flag_order=False):
@@ -265,9 +399,16 @@ def cmd2template(cmd, recover_quotation=True, arg_type_only=True,
     Convert a bash command to a template that contains only reserved words
     and argument types flags are alphabetically ordered.
     """
-    tree = lint.normalize_ast(cmd, recover_quotation, verbose=verbose)
-    return ast2template(tree, loose_constraints=loose_constraints, 
-                        arg_type_only=arg_type_only)
+    def templatize():
+        tree = lint.normalize_ast(cmd, recover_quotation, verbose=verbose)
+        return ast2template(tree, loose_constraints=loose_constraints,
+                            arg_type_only=arg_type_only)
+
+    if verbose:
+        return templatize()
+    key = parse_cache_key(cmd, 'template', recover_quotation, arg_type_only,
+                          loose_constraints)
+    return parse_cache.get(key, templatize)
 
 
 def pretty_print(node, depth=0):
@@ -291,6 +432,7 @@ def ast2list(node, order='dfs', _list=None, ignore_flag_order=False,
     """
     Linearize the AST.
     """
+    node = nast.get_root(node)
     if order == 'dfs':
         if node.is_argument() and node.is_open_vocab() and arg_type_only:
             token = node.arg_type
@@ -379,6 +521,190 @@ def batch_parse(input_file):
             pretty_print(ast)
             i += 1
 
+# --- Streaming corpus normalization --- #
+
+def normalize_record(line_no, cmd, loose_constraints=False):
+    """
+    Normalize a bash command and collect its tokens, template and utilities.
+
+    :return: a JSON-serializable dict; "error" is set (and the other fields
+        are None) if the command cannot be parsed.
+    """
+    record = {'line': line_no, 'cmd': cmd, 'tokens': None, 'template': None,
+              'utilities': None, 'error': None}
+    try:
+        ast = lint.normalize_ast(cmd)
+        if ast is None:
+            record['error'] = 'parse error'
+        else:
+            record['tokens'] = ast2tokens(
+                ast, loose_constraints=loose_constraints)
+            record['template'] = ast2template(
+                ast, loose_constraints=loose_constraints)
+            record['utilities'] = sorted(get_utilities(ast))
+    except Exception as e:
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+    return record
+
+
+def normalize_chunk(chunk):
+    """
+    :param chunk: (loose_constraints, [(line_no, cmd), ...])
+    :return: (list of JSON lines, one per command, number of parse errors)
+    """
+    loose_constraints, lines = chunk
+    records = [normalize_record(line_no, cmd, loose_constraints)
+               for line_no, cmd in lines]
+    return [json.dumps(record) for record in records], \
+        sum(1 for record in records if record['error'] is not None)
+
+
+def read_chunks(in_f, chunk_size, start_line=0, loose_constraints=False):
+    """
+    Read commands from in_f in chunks of chunk_size lines, skipping the first
+    start_line lines. Empty lines are skipped but still counted.
+    """
+    lines = []
+    for line_no, line in enumerate(in_f):
+        if line_no < start_line:
+            continue
+        cmd = line.rstrip('\r\n')
+        if cmd.strip():
+            lines.append((line_no, cmd))
+        if len(lines) >= chunk_size:
+            yield loose_constraints, lines
+            lines = []
+    if lines:
+        yield loose_constraints, lines
+
+
+def get_resume_line(output_file):
+    """
+    Find the input line following the last complete record of an existing
+    output file. A partially written last record is truncated.
+    """
+    if not os.path.exists(output_file):
+        return 0
+    resume_line, valid_size = 0, 0
+    with open(output_file, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                resume_line = json.loads(line.decode('utf-8'))['line'] + 1
+            except ValueError:
+                break
+            valid_size += len(line)
+    with open(output_file, 'ab') as f:
+        f.truncate(valid_size)
+    return resume_line
+
+
+def stream_normalize(input_file, output_file, num_workers=1, chunk_size=1000,
+                     start_line=0, resume=False, loose_constraints=False,
+                     report_interval=10.0):
+    """
+    Normalize a file of bash commands (one per line) and write one JSON record
+    per command (see normalize_record) in input order.
+
+    Chunks of chunk_size lines are processed by a pool of num_workers
+    processes; at most 2 * num_workers chunks are in flight at any time so
+    memory use does not grow with the input size.
+
+    :param input_file: input path, "-" for stdin.
+    :param output_file: output path, "-" for stdout.
+    :param start_line: number of input lines to skip.
+    :param resume: if set, continue after the last complete record of
+        output_file instead of overwriting it.
+    :param report_interval: seconds between throughput reports on stderr.
+    """
+    if resume and output_file != '-':
+        start_line = max(start_line, get_resume_line(output_file))
+        out_mode = 'a'
+    else:
+        out_mode = 'w'
+    in_f = sys.stdin if input_file == '-' else \
+        io.open(input_file, encoding='utf-8', errors='replace')
+    out_f = sys.stdout if output_file == '-' else \
+        io.open(output_file, out_mode, encoding='utf-8')
+
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    pending = collections.deque()
+    num_lines, num_errors = 0, 0
+    start_time = last_report_time = time.time()
+
+    def write_chunk(result):
+        json_lines, chunk_errors = result
+        for json_line in json_lines:
+            out_f.write(u'{}\n'.format(json_line))
+        out_f.flush()
+        return len(json_lines), chunk_errors
+
+    def report(final=False):
+        elapsed = time.time() - start_time
+        print('{} {} commands ({} parse errors) in {:.1f}s, {:.1f} commands/s'
+              .format('normalized' if final else 'normalizing', num_lines,
+                      num_errors, elapsed, num_lines / max(elapsed, 1e-6)),
+              file=sys.stderr)
+
+    try:
+        for chunk in read_chunks(in_f, chunk_size, start_line,
+                                 loose_constraints):
+            if pool is None:
+                pending.append(normalize_chunk(chunk))
+            else:
+                pending.append(pool.apply_async(normalize_chunk, (chunk,)))
+            while pending and (pool is None or len(pending) >= 2 * num_workers):
+                result = pending.popleft()
+                chunk_lines, chunk_errors = write_chunk(
+                    result if pool is None else result.get())
+                num_lines += chunk_lines
+                num_errors += chunk_errors
+            if time.time() - last_report_time >= report_interval:
+                report()
+                last_report_time = time.time()
+        while pending:
+            chunk_lines, chunk_errors = write_chunk(pending.popleft().get())
+            num_lines += chunk_lines
+            num_errors += chunk_errors
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if in_f is not sys.stdin:
+            in_f.close()
+        if out_f is not sys.stdout:
+            out_f.close()
+    report(final=True)
+
+
+def stream_normalize_main(argv):
+    arg_parser = argparse.ArgumentParser(
+        description='Normalize bash commands (one per line) into JSON lines '
+                    'of tokens, templates, utilities and parse errors.')
+    arg_parser.add_argument('input_file', nargs='?', default='-',
+                            help='input file (default: stdin)')
+    arg_parser.add_argument('-o', '--output_file', default='-',
+                            help='output file (default: stdout)')
+    arg_parser.add_argument('-j', '--num_workers', type=int, default=1,
+                            help='number of worker processes')
+    arg_parser.add_argument('--chunk_size', type=int, default=1000,
+                            help='number of commands per work unit')
+    arg_parser.add_argument('--start_line', type=int, default=0,
+                            help='number of input lines to skip')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='continue after the last record of the output file')
+    arg_parser.add_argument('--loose_constraints', action='store_true',
+                            help='do not check flag and argument coherence')
+    arg_parser.add_argument('--report_interval', type=float, default=10.0,
+                            help='seconds between throughput reports')
+    args = arg_parser.parse_args(argv)
+    stream_normalize(args.input_file, args.output_file,
+                     num_workers=args.num_workers, chunk_size=args.chunk_size,
+                     start_line=args.start_line, resume=args.resume,
+                     loose_constraints=args.loose_constraints,
+                     report_interval=args.report_interval)
+
+
 def test_bash_parser():
     while True:
         try:
@@ -408,4 +734,7 @@ def test_bash_parser():
 if __name__ == "__main__":
     # input_file = sys.argv[1]
     # batch_parse(input_file)
-    test_bash_parser()
+    if len(sys.argv) > 1:
+        stream_normalize_main(sys.argv[1:])
+    else:
+        test_bash_parser()
@@ -10,9 +10,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
 import os, sys
 if sys.version_info > (3, 0):
+    from six.moves import cPickle as pickle
     from six.moves import xrange
+else:
+    import cPickle as pickle
 
 UTIL_S = 0
 COMPOUND_FLAG_S = 1
@@ -64,7 +68,6 @@ class UtilityState(BashGrammarState):
         self.compound_flag = CompoundFlagState(self)
         self.positional_arguments = []
         self.eof = EOFState()
-        self.argument_only = False
 
     def add_flag(self, flag):
         self.compound_flag.add_flag(flag)
@@ -73,13 +76,18 @@ class UtilityState(BashGrammarState):
         self.positional_arguments.append(arg)
         arg.parent = self
 
-    def next_states(self):
-        if self.argument_only:
+    def next_states(self, filled=frozenset(), argument_only=False):
+        """
+        :param filled: Set of argument states that have already been consumed.
+        :param argument_only: If set, no more flags are accepted (e.g. after
+            "--").
+        """
+        if argument_only:
             next_states = []
         else:
             next_states = [self.compound_flag]
         for arg_state in self.positional_arguments:
-            if not arg_state.filled or (arg_state.is_list
+            if not arg_state in filled or (arg_state.is_list
                     and arg_state.list_separator == ' '):
                 next_states.append(arg_state)
         next_states.append(self.eof)
@@ -150,7 +158,6 @@ class ArgumentState(BashGrammarState):
             the argument.
         :member no_space: No space between the argument and the flag it is
             attached to.
-        :member filled: If set, at least
         :member parent: Parent state.
         :member rsb: Right sibling state.
         """
@@ -162,7 +169,6 @@ class ArgumentState(BashGrammarState):
         self.list_separator = list_separator
         self.regex_format = regex_format
         self.no_space = no_space
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -184,7 +190,6 @@ class ArgCommandState(BashGrammarState):
     def __init__(self):
         super(ArgCommandState, self).__init__(ARG_COMMAND_S)
         self.no_space = False
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -197,7 +202,6 @@ class ExecCommandState(BashGrammarState):
         super(ExecCommandState, self).__init__(EXEC_COMMAND_S)
         self.stop_tokens = stop_tokens
         self.no_space = False
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -208,7 +212,6 @@ class ExecCommandState(BashGrammarState):
 class CommandState(BashGrammarState):
     def __init__(self):
         super(CommandState, self).__init__(COMMAND_S)
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -226,6 +229,14 @@ class BashGrammar(object):
         self.name2type = {}
         self.grammar = {}
         self.next_states = None     # pointer on the current position in the grammar tree
+        # The utility grammar is shared by all parses and never modified during
+        # parsing. The mutable bits of a parse are recorded in this overlay.
+        self.filled = set()         # argument states that have been consumed
+        self.argument_only = set()  # utility states which stopped taking flags
+
+    def utility_next_states(self, utility_state):
+        return utility_state.next_states(
+            self.filled, utility_state in self.argument_only)
 
     def allow_eof(self):
         for state in self.next_states:
@@ -241,7 +252,7 @@ class BashGrammar(object):
     def consume(self, token):
         if token in self.grammar:
             utility_state = self.grammar[token]
-            self.next_states = utility_state.next_states()
+            self.next_states = self.utility_next_states(utility_state)
             return True
         else:
             return False
@@ -271,7 +282,7 @@ class BashGrammar(object):
                             raise ValueError('Unexpected flag argument "{}"'.format(token))
                 else:
                     if flag_token == '--':
-                        state.parent.argument_only = True
+                        self.argument_only.add(state.parent)
                     else:
                         raise ValueError('Unrecognized long flag "{}"'.format(flag_token))
             elif token in state.flag_index:
@@ -330,23 +341,23 @@ class BashGrammar(object):
                         # Case 5: the token does not match any flag state
                         return None
         elif state_type == COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == ARG_COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == EXEC_COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == OPERATOR_S:
             for i, next_state in enumerate(self.next_states):
                 if next_state.is_compound_flag():
                     del(self.next_states[i])
         elif state.type == ARG_S:
-            state.filled = True
+            self.filled.add(state)
             if state.rsb:
                 # continue interpreting the next argument of the same parent state
                 self.next_states = [state.rsb]
                 return '__SAME_PARENT__'
             else:
-                self.next_states = state.get_utility().next_states()
+                self.next_states = self.utility_next_states(state.get_utility())
                 return '__PARENT_CHANGE__'
 
     def make_grammar(self, input_file):
@@ -681,5 +692,51 @@ class BashGrammar(object):
         return flag
 
 
-bg = BashGrammar()
-bg.make_grammar(os.path.join(os.path.dirname(__file__), 'grammar', 'grammar100.txt'))
+# Bump this whenever the classes of the grammar states change, so that grammars
+# cached by an older version are rebuilt.
+GRAMMAR_CACHE_VERSION = 1
+
+grammar_file = os.path.join(os.path.dirname(__file__), 'grammar', 'grammar100.txt')
+grammar_cache_file = os.path.join(os.path.dirname(__file__), 'grammar', 'grammar100.pickle')
+
+_bg = None
+
+
+def get_bash_grammar():
+    """
+    Return the utility grammar shared by all parses.
+
+    The grammar is compiled on first use and cached in binary form next to the
+    grammar file. The cache is rejected if it was built by a different cache
+    version or from a different grammar file.
+    """
+    global _bg
+    if _bg is None:
+        with open(grammar_file, 'rb') as f:
+            grammar_hash = hashlib.sha1(f.read()).hexdigest()
+        _bg = load_grammar_cache(grammar_hash)
+        if _bg is None:
+            _bg = BashGrammar()
+            _bg.make_grammar(grammar_file)
+            save_grammar_cache(_bg, grammar_hash)
+    return _bg
+
+
+def load_grammar_cache(grammar_hash):
+    try:
+        with open(grammar_cache_file, 'rb') as f:
+            version, cached_hash = pickle.load(f)
+            if version != GRAMMAR_CACHE_VERSION or cached_hash != grammar_hash:
+                return None
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_grammar_cache(bash_grammar, grammar_hash):
+    try:
+        with open(grammar_cache_file, 'wb') as f:
+            pickle.dump((GRAMMAR_CACHE_VERSION, grammar_hash), f, 2)
+            pickle.dump(bash_grammar, f, 2)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        print('Unable to cache bashlint grammar: {}'.format(e))
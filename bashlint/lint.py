@@ -22,7 +22,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import copy
 import os
 import re
 import sys
@@ -260,8 +259,12 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
         return norm_node
 
     def normalize_command(node, current=None):
+        # the utility grammar is shared, parsing states are tracked by
+        # bash_grammar on the side
+        bg = get_bash_grammar()
         bash_grammar = BashGrammar()
         bash_grammar.name2type = bg.name2type
+        bash_grammar.grammar = bg.grammar
 
         if not node or not node.parts:
             return
@@ -282,7 +285,7 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
                 current.add_child(head)
 
             # If utility grammar is not known, parse into a simple two-level tree
-            if not bg.consume(token):
+            if not bash_grammar.consume(token):
                 raise errors.LintParsingError(
                     "Warning: grammar not found - utility {}".format(token), num_tokens, 0)
                 for bast_node in input[1:]:
@@ -301,8 +304,6 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
                 return
 
             current, i = head, 1
-            bash_grammar.grammar = {head.value: copy.deepcopy(bg.grammar[head.value])}
-            bash_grammar.consume(head.value)
 
             while i < len(input):
                 bast_node = input[i]
@@ -760,112 +761,145 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
 def serialize_ast(node, loose_constraints=False, ignore_flag_order=False):
     if not node:
         return ''
+    node = get_root(node)
 
     lc = loose_constraints
     ifo = ignore_flag_order
 
-    def to_command_fun(node):
-        str = ''
+    # The tree is traversed depth-first with an explicit stack of nodes,
+    # pending strings and strip markers, and the command is written to a
+    # single list of pieces. Strings preceding the children of a node are
+    # written directly; the children and the strings following them are
+    # pushed onto the stack in reverse order. The output of a utility, a flag
+    # or a binary logic operator is stripped once it is complete: such a node
+    # pushes the position where its output starts (an int) before its
+    # children.
+    pieces = []
+    stack = [node]
+
+    def push(items):
+        stack.extend(reversed(items))
+
+    def push_children(children, separator):
+        items = []
+        for child in children:
+            items.append(child)
+            items.append(separator)
+        push(items)
+
+    def strip(start):
+        """
+        Strip the whitespaces around the output written since start.
+        """
+        for i in xrange(start, len(pieces)):
+            pieces[i] = pieces[i].lstrip()
+            if pieces[i]:
+                break
+        while len(pieces) > start:
+            pieces[-1] = pieces[-1].rstrip()
+            if pieces[-1]:
+                break
+            pieces.pop()
+
+    def expand(node):
         if node.is_root():
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc:
-                for child in node.children:
-                    str += to_command_fun(child)
+                push(node.children)
             else:
-                str += to_command_fun(node.get_left_child())
+                stack.append(node.get_left_child())
         elif node.kind == 'pipeline':
             assert(loose_constraints or node.get_num_of_children() > 1)
             if lc and node.get_num_of_children() < 1:
-                str += ''
+                pass
             elif lc and node.get_num_of_children() == 1:
-                str += to_command_fun(node.get_left_child())
+                stack.append(node.get_left_child())
             else:
-                for child in node.children[:-1]:
-                    str += to_command_fun(child)
-                    str += ' | '
-                str += to_command_fun(node.get_right_child())
+                stack.append(node.get_right_child())
+                push_children(node.children[:-1], ' | ')
         elif node.kind == "commandsubstitution":
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc and node.get_num_of_children() < 1:
-                str += ''
+                pass
             else:
-                str += '$('
-                str += to_command_fun(node.get_left_child())
-                str += ')'
+                pieces.append('$(')
+                push([node.get_left_child(), ')'])
         elif node.kind == 'processsubstitution':
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc and node.get_num_of_children() < 1:
-                str += ''
+                pass
             else:
-                str += '{}('.format(node.value)
-                str += to_command_fun(node.get_left_child())
-                str += ')'
+                pieces.append('{}('.format(node.value))
+                push([node.get_left_child(), ')'])
         elif node.is_utility():
-            str += node.value + ' '
+            stack.append(len(pieces))
+            pieces.append(node.value + ' ')
             children = sorted(node.children, key=lambda x:x.value) \
                 if ifo else node.children
-            for child in children:
-                str += to_command_fun(child) + ' '
-            str = str.strip()
+            push_children(children, ' ')
         elif node.is_option():
             assert(loose_constraints or node.parent)
+            stack.append(len(pieces))
             if '::' in node.value:
                 value, op = node.value.split('::')
-                str += value + ' '
+                pieces.append(value + ' ')
+                if op == ';':
+                    op = "\\;"
+                stack.append(op + ' ')
             else:
                 arg_connector = '=' if (node.is_long_option() and
                                         node.children) else ' '
-                str += node.value + arg_connector
-            for child in node.children:
-                str += to_command_fun(child) + ' '
-            if '::' in node.value:
-                if op == ';':
-                    op = "\\;"
-                str += op + ' '
-            str = str.strip()
+                pieces.append(node.value + arg_connector)
+            push_children(node.children, ' ')
         elif node.kind == 'operator':
-            str += '--'
+            pieces.append('--')
         elif node.kind == "binarylogicop":
             assert(loose_constraints or node.get_num_of_children() == 0)
             if lc and node.get_num_of_children() > 0:
+                stack.append(len(pieces))
+                stack.append(node.children[-1])
+                items = []
                 for child in node.children[:-1]:
-                    str += to_command_fun(child) + ' '
-                    str += node.value + ' '
-                str += to_command_fun(node.children[-1])
-                str = str.strip()
+                    items.append(child)
+                    items.append(' ')
+                    items.append(node.value + ' ')
+                push(items)
             else:
-                str += node.value
+                pieces.append(node.value)
         elif node.kind == "unarylogicop":
             assert(loose_constraints or node.get_num_of_children() == 0)
             if lc and node.get_num_of_children() > 0:
                 if node.associate == UnaryLogicOpNode.RIGHT:
-                    str += '{} {}'.format(
-                        node.value, to_command_fun(node.get_left_child()))
+                    pieces.append(node.value + ' ')
+                    stack.append(node.get_left_child())
                 else:
-                    str += '{} {}'.format(
-                        to_command_fun(node.get_left_child()), node.value)
+                    push([node.get_left_child(), ' ' + node.value])
             else:
-                str += node.value
+                pieces.append(node.value)
         elif node.kind == "bracket":
             assert(loose_constraints or node.get_num_of_children() >= 1)
             if lc and node.get_num_of_children() < 2:
-                for child in node.children:
-                    str += to_command_fun(child)
+                push(node.children)
             else:
-                str += "\\( "
-                for i in xrange(len(node.children)):
-                    str += to_command_fun(node.children[i]) + ' '
-                str += "\\)"
+                pieces.append("\\( ")
+                stack.append("\\)")
+                push_children(node.children, ' ')
         elif node.is_argument():
             assert(loose_constraints or node.get_num_of_children() == 0)
-            str += node.value
-            if lc:
-                for child in node.children:
-                    str += to_command_fun(child)
-        return str
-
-    return to_command_fun(node)
+            pieces.append(node.value)
+            if lc and node.children:
+                push(node.children)
+
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Node):
+            expand(item)
+        elif isinstance(item, int):
+            strip(item)
+        else:
+            pieces.append(item)
+    return ''.join(pieces)
 
 
 def get_utility_statistics(utility):
-    return len(bg.grammar[utility].compound_flag.flag_index)
+    return len(get_bash_grammar().grammar[utility].compound_flag.flag_index)
@@ -2,8 +2,12 @@
 Node Classes for the Normalized Bash AST.
 """
 
+import array
 import collections
 
+import six
+from six.moves import intern
+
 from bashlint import bash
 
 _H_NO_EXPAND = '__SP__H_NO_EXPAND'
@@ -22,11 +26,20 @@ def make_sibling(lsb, rsb):
     if rsb:
         rsb.lsb = lsb
 
+def intern_str(s):
+    """
+    Intern kind strings and common node values so that the nodes of all ASTs
+    share a single copy of them.
+    """
+    return intern(s) if type(s) is str else s
+
 class Node(object):
     num_child = -1          # number of children taken by node
                             # -1 indicates "any number of"
     children_types = []     # list of compatible types of children
 
+    __slots__ = ('parent', 'lsb', 'rsb', 'kind', 'value', 'children')
+
     def __init__(self, parent=None, lsb=None, kind="", value=""):
         """
         :member parent: pointer to parent node
@@ -49,15 +62,14 @@ class Node(object):
         self.parent = parent
         self.lsb = lsb
         self.rsb = None
-        self.kind = kind
+        self.kind = intern_str(kind)
         self.value = value
         self.children = []
 
     def add_child(self, child, index=None):
-        lsb = self.get_right_child()
+        if self.children:
+            self.children[-1].rsb = child
         self.children.append(child)
-        if lsb:
-            lsb.rsb = child
 
     def get_children(self):
         return self.children
@@ -159,8 +171,11 @@ class Node(object):
         return self.parent.parent
 
 class UtilityNode(Node):
+    __slots__ = ('arg_dict',)
+
     def __init__(self, value='', parent=None, lsb=None):
-        super(UtilityNode, self).__init__(parent, lsb, "utility", value)
+        super(UtilityNode, self).__init__(
+            parent, lsb, "utility", intern_str(value))
         self.arg_dict = {'': collections.defaultdict(int)}
 
     def add_child(self, child, index=None):
@@ -183,8 +198,10 @@ class UtilityNode(Node):
                 return child
 
 class FlagNode(Node):
+    __slots__ = ()
+
     def __init__(self, value='', parent=None, lsb=None):
-        super(FlagNode, self).__init__(parent, lsb, "flag", value)
+        super(FlagNode, self).__init__(parent, lsb, "flag", intern_str(value))
 
     def add_child(self, child, index=None):
         super(FlagNode, self).add_child(child)
@@ -206,11 +223,12 @@ class FlagNode(Node):
 
 class ArgumentNode(Node):
     num_child = 0
+    __slots__ = ('arg_type', 'index', 'list_separator', 'list_members')
 
     def __init__(self, value='', arg_type='', parent=None, lsb=None,
                  list_members=None, list_separator=None):
         super(ArgumentNode, self).__init__(parent, lsb, "argument", value)
-        self.arg_type = arg_type
+        self.arg_type = intern_str(arg_type)
         self.index = 1
         self.list_separator = list_separator
         self.list_members = list_members
@@ -251,6 +269,7 @@ class ArgumentNode(Node):
 
 class OperatorNode(Node):
     num_child = 0
+    __slots__ = ()
 
     def __init__(self, value='', parent=None, lsb=None):
         super(OperatorNode, self).__init__(
@@ -261,9 +280,11 @@ class UnaryLogicOpNode(Node):
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
     LEFT = 0
     RIGHT = 1
+    __slots__ = ('associate',)
 
     def __init__(self, value='', parent=None, lsb=None):
-        super(UnaryLogicOpNode, self).__init__(parent, lsb, 'unarylogicop', value)
+        super(UnaryLogicOpNode, self).__init__(
+            parent, lsb, 'unarylogicop', intern_str(value))
         if value in bash.right_associate_unary_logic_operators:
             self.associate = UnaryLogicOpNode.RIGHT
         elif value in bash.left_associate_unary_logic_operators:
@@ -274,25 +295,30 @@ class UnaryLogicOpNode(Node):
 class BinaryLogicOpNode(Node):
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
+    __slots__ = ()
 
     def __init__(self, value='', parent=None, lsb=None):
-        super(BinaryLogicOpNode, self).__init__(parent, lsb, 'binarylogicop', value)
+        super(BinaryLogicOpNode, self).__init__(
+            parent, lsb, 'binarylogicop', intern_str(value))
 
 class BracketNode(Node):
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
+    __slots__ = ()
 
     def __init__(self, parent=None, lsb=None):
         super(BracketNode, self).__init__(parent, lsb, 'bracket', '')
 
 class RedirectNode(Node):
     num_child = 2
+    __slots__ = ()
 
     def __init__(self, value='', parent=None, lsb=None):
         super(RedirectNode, self).__init__(parent, lsb, 'redirect', value)
 
 class PipelineNode(Node):
     children_types = [set(['utility'])]
+    __slots__ = ()
 
     def __init__(self, parent=None, lsb=None):
         super(PipelineNode, self).__init__(parent, lsb, 'pipeline')
@@ -300,19 +326,262 @@ class PipelineNode(Node):
 class CommandSubstitutionNode(Node):
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
+    __slots__ = ()
 
     def __init__(self, parent=None, lsb=None):
         super(CommandSubstitutionNode, self).__init__(parent, lsb)
-        self.kind = "commandsubstitution"
+        self.kind = intern_str("commandsubstitution")
 
 class ProcessSubstitutionNode(Node):
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
+    __slots__ = ()
 
     def __init__(self, value, parent=None, lsb=None):
         super(ProcessSubstitutionNode, self).__init__(parent, lsb)
-        self.kind = "processsubstitution"
+        self.kind = intern_str("processsubstitution")
         if value in ["<", ">"]:
             self.value = value
         else:
             raise ValueError("Value of a processsubstitution has to be '<' or '>'.")
+
+
+# --- Frozen (array-backed) trees --- #
+
+KINDS = ('root', 'pipeline', 'utility', 'flag', 'argument', 'operator',
+         'unarylogicop', 'binarylogicop', 'bracket', 'redirect',
+         'commandsubstitution', 'processsubstitution', 'nt', 't', '')
+KIND_CODES = dict((kind, code) for code, kind in enumerate(KINDS))
+
+class FrozenTree(object):
+    """
+    Immutable, array-backed form of a normalized bash AST.
+
+    Node i of the tree (in pre-order, the root is node 0) is described by
+    entry i of the parallel arrays below. Nodes are accessed through
+    lightweight FrozenNode views, which support the read-only interface of
+    Node, so functions such as data_tools.ast2tokens, lint.serialize_ast and
+    the tree distance functions work on frozen trees unchanged.
+    """
+    __slots__ = ('kinds', 'values', 'parents', 'first_children',
+                 'next_siblings', 'arg_types', 'indices', 'to_indices',
+                 'extras')
+
+    def __init__(self, root):
+        self.kinds = array.array('B')
+        self.values = []
+        self.parents = array.array('i')
+        self.first_children = array.array('i')
+        self.next_siblings = array.array('i')
+        self.arg_types = []
+        self.indices = array.array('i')
+        # 1/0: whether an argument is indexed (ArgumentNode.to_index),
+        # -1: not an argument or the index cannot be computed
+        self.to_indices = array.array('b')
+        # node id -> dictionary of the other (rarely set) node attributes
+        self.extras = {}
+
+        last_child = {}
+        stack = [(root, -1)]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = len(self.values)
+            if node.kind not in KIND_CODES:
+                raise ValueError('Unrecognized node kind: {}'.format(node.kind))
+            self.kinds.append(KIND_CODES[node.kind])
+            self.values.append(intern_str(node.value))
+            self.parents.append(parent_id)
+            self.first_children.append(-1)
+            self.next_siblings.append(-1)
+            # children are numbered in order, so the last numbered child of
+            # the parent is the left sibling
+            if parent_id in last_child:
+                self.next_siblings[last_child[parent_id]] = node_id
+            elif parent_id >= 0:
+                self.first_children[parent_id] = node_id
+            last_child[parent_id] = node_id
+            if isinstance(node, ArgumentNode):
+                self.arg_types.append(node.arg_type)
+                self.indices.append(node.index)
+                extras = {}
+                try:
+                    self.to_indices.append(int(bool(node.to_index())))
+                except (AttributeError, KeyError, ValueError) as e:
+                    self.to_indices.append(-1)
+                    extras['to_index_error'] = e
+                if node.list_members is not None or \
+                        node.list_separator is not None:
+                    extras['list_members'] = node.list_members
+                    extras['list_separator'] = node.list_separator
+                if extras:
+                    self.extras[node_id] = extras
+            else:
+                self.arg_types.append(None)
+                self.indices.append(0)
+                self.to_indices.append(-1)
+                if isinstance(node, UnaryLogicOpNode):
+                    self.extras[node_id] = {'associate': node.associate}
+            # push the children in reverse order so that they are numbered
+            # in pre-order
+            for child in reversed(node.children):
+                stack.append((child, node_id))
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def root(self):
+        return FrozenNode(self, 0)
+
+class FrozenNode(Node):
+    """
+    Read-only view of node `id` of a FrozenTree.
+
+    Views are created on access and compare equal if they refer to the same
+    node of the same tree.
+    """
+    __slots__ = ('tree', 'id')
+
+    def __init__(self, tree, id):
+        self.tree = tree
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenNode) and self.tree is other.tree \
+            and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.tree), self.id))
+
+    def _node(self, node_id):
+        return FrozenNode(self.tree, node_id) if node_id >= 0 else None
+
+    def _extra(self, name):
+        return self.tree.extras.get(self.id, {}).get(name)
+
+    @property
+    def kind(self):
+        return KINDS[self.tree.kinds[self.id]]
+
+    @property
+    def value(self):
+        return self.tree.values[self.id]
+
+    @property
+    def parent(self):
+        return self._node(self.tree.parents[self.id])
+
+    @property
+    def rsb(self):
+        return self._node(self.tree.next_siblings[self.id])
+
+    @property
+    def lsb(self):
+        parent_id = self.tree.parents[self.id]
+        if parent_id < 0:
+            return None
+        lsb_id = -1
+        child_id = self.tree.first_children[parent_id]
+        while child_id != self.id:
+            lsb_id = child_id
+            child_id = self.tree.next_siblings[child_id]
+        return self._node(lsb_id)
+
+    @property
+    def children(self):
+        children = []
+        child_id = self.tree.first_children[self.id]
+        while child_id >= 0:
+            children.append(FrozenNode(self.tree, child_id))
+            child_id = self.tree.next_siblings[child_id]
+        return children
+
+    def get_num_of_children(self):
+        num_children = 0
+        child_id = self.tree.first_children[self.id]
+        while child_id >= 0:
+            num_children += 1
+            child_id = self.tree.next_siblings[child_id]
+        return num_children
+
+    def has_children(self):
+        return self.tree.first_children[self.id] >= 0
+
+    def get_left_child(self):
+        return self._node(self.tree.first_children[self.id])
+
+    # --- ArgumentNode interface --- #
+
+    @property
+    def arg_type(self):
+        return self.tree.arg_types[self.id]
+
+    @property
+    def index(self):
+        return self.tree.indices[self.id]
+
+    @property
+    def list_members(self):
+        return self._extra('list_members')
+
+    @property
+    def list_separator(self):
+        return self._extra('list_separator')
+
+    def is_bracket(self):
+        return self.value == "(" or self.value == ")"
+
+    def is_reserved(self):
+        if self.is_argument():
+            return self.value in bash.reserved_tokens
+        return super(FrozenNode, self).is_reserved()
+
+    def is_open_vocab(self):
+        if not self.is_argument():
+            return False
+        return six.get_unbound_function(ArgumentNode.is_open_vocab)(self)
+
+    def to_index(self):
+        to_index = self.tree.to_indices[self.id]
+        if to_index < 0:
+            # raise the error of the original node
+            raise self._extra('to_index_error') or \
+                ValueError('Argument index is not defined.')
+        return to_index == 1
+
+    # --- UtilityNode, FlagNode and UnaryLogicOpNode interface --- #
+
+    @property
+    def associate(self):
+        return self._extra('associate')
+
+    def get_flags(self):
+        return six.get_unbound_function(UtilityNode.get_flags)(self)
+
+    def get_subcommand(self):
+        return six.get_unbound_function(UtilityNode.get_subcommand)(self)
+
+    def get_argument(self):
+        return six.get_unbound_function(FlagNode.get_argument)(self)
+
+    def is_long_option(self):
+        return self.value.startswith('--')
+
+def freeze(node):
+    """
+    Convert a normalized bash AST into a FrozenTree.
+    """
+    if node is None or isinstance(node, FrozenTree):
+        return node
+    if isinstance(node, FrozenNode):
+        return node.tree
+    return FrozenTree(node)
+
+def get_root(tree):
+    """
+    Return the root node of an AST given either as a Node or a FrozenTree.
+    """
+    return tree.root if isinstance(tree, FrozenTree) else tree
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that the iterative ast2tokens and serialize_ast produce the same output
+as the original recursive implementations (kept below as references) on all
+commands of data/bash/all.cm, and that frozen trees (nast.FrozenTree) behave
+exactly like the trees they are frozen from.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import itertools
+import os
+
+from six.moves import xrange
+
+from bashlint import bash, data_tools, lint, nast
+from bashlint.data_tools import flag_suffix
+from bashlint.nast import UnaryLogicOpNode
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'bash')
+
+ast2tokens_options = ['loose_constraints', 'ignore_flag_order',
+                      'arg_type_only', 'keep_common_args', 'with_arg_type',
+                      'with_flag_head', 'with_flag_argtype', 'with_prefix',
+                      'indexing_args']
+
+
+# --- Reference implementations --- #
+
+def recursive_ast2tokens(node, loose_constraints=False,
+                         ignore_flag_order=False,
+                         arg_type_only=False, keep_common_args=False,
+                         with_arg_type=False, with_flag_head=False,
+                         with_flag_argtype=False, with_prefix=False,
+                         indexing_args=False):
+    """
+    Convert a bash ast into a list of tokens.
+
+    :param loose_constraints: If set, do not check semantic coherence between
+        flags and arguments.
+    :param ignore_flag_order: If set, output flags in alphabetical order.
+    :param arg_type_only: If set, output argument semantic types instead of the
+        actual value.
+    :param: keep_common_args: If set, keep common arguments such as "/", "."
+        and do not replace them with semantic types. Effective only when
+        arg_type_only is set.
+    :param with_arg_type: If set, append argument type to argument token.
+    :param with_flag_head: If set, add utility prefix to flag token.
+    :param with_flag_argtype: If set, append argument type suffix to flag token.
+    :param with_prefix: If set, add node kind prefix to token.
+    :param indexing_args: If set, append order index to argument token.
+    """
+    if not node:
+        return []
+    node = nast.get_root(node)
+
+    lc = loose_constraints
+
+    def to_tokens_fun(node):
+        tokens = []
+        if node.is_root():
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc:
+                for child in node.children:
+                    tokens += to_tokens_fun(child)
+            else:
+                tokens = to_tokens_fun(node.children[0])
+        elif node.kind == "pipeline":
+            assert(loose_constraints or node.get_num_of_children() > 1)
+            if lc and node.get_num_of_children() < 1:
+                tokens.append("|")
+            elif lc and node.get_num_of_children() == 1:
+                # treat "singleton-pipe" as atomic command
+                tokens += to_tokens_fun(node.children[0])
+            else:
+                for child in node.children[:-1]:
+                    tokens += to_tokens_fun(child)
+                    tokens.append("|")
+                tokens += to_tokens_fun(node.children[-1])
+        elif node.kind == "commandsubstitution":
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc and node.get_num_of_children() < 1:
+                tokens += ["$(", ")"]
+            else:
+                tokens.append("$(")
+                tokens += to_tokens_fun(node.children[0])
+                tokens.append(")")
+        elif node.kind == "processsubstitution":
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc and node.get_num_of_children() < 1:
+                tokens.append(node.value + "(")
+                tokens.append(")")
+            else:
+                tokens.append(node.value + "(")
+                tokens += to_tokens_fun(node.children[0])
+                tokens.append(")")
+        elif node.is_utility():
+            token = node.value
+            if with_prefix:
+                token = node.prefix + token
+            tokens.append(token)
+            children = sorted(node.children, key=lambda x:x.value) \
+                if ignore_flag_order else node.children
+            for child in children:
+                tokens += to_tokens_fun(child)
+        elif node.is_option():
+            assert(loose_constraints or node.parent)
+            if '::' in node.value and (node.value.startswith('-exec') or 
+                                       node.value.startswith('-ok')):
+                value, op = node.value.split('::')
+                token = value
+            else:
+                token = node.value
+            if with_flag_head:
+                if node.parent:
+                    token = node.utility.value + "@@" + token
+                else:
+                    token = token
+            if with_prefix:
+                token = node.prefix + token
+            if with_flag_argtype:
+                suffix = ''
+                if node.children:
+                    for child in node.children:
+                        if child.is_argument():
+                            suffix += child.arg_type
+                        elif child.is_utility():
+                            suffix += 'UTILITY'
+                token = token + flag_suffix + suffix
+            tokens.append(token)
+            for child in node.children:
+                tokens += to_tokens_fun(child)
+            if '::' in node.value and (node.value.startswith('-exec') or
+                                       node.value.startswith('-ok')):
+                if op == ';':
+                    op = "\\;"
+                tokens.append(op)
+        elif node.kind == 'operator':
+            tokens.append(node.value)
+        elif node.kind == "binarylogicop":
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            if lc and node.get_num_of_children() > 0:
+                for child in node.children[:-1]:
+                    tokens += to_tokens_fun(child)
+                    tokens.append(node.value)
+                tokens += to_tokens_fun(node.children[-1])
+            else:
+                tokens.append(node.value)
+        elif node.kind == "unarylogicop":
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            if lc and node.get_num_of_children() > 0:
+                if node.associate == nast.UnaryLogicOpNode.RIGHT:
+                    tokens.append(node.value)
+                    tokens += to_tokens_fun(node.children[0])
+                else:
+                    tokens += to_tokens_fun(node.children[0])
+                    tokens.append(node.value)
+            else:
+                tokens.append(node.value)
+        elif node.kind == "bracket":
+            assert(loose_constraints or node.get_num_of_children() >= 1)
+            if lc and node.get_num_of_children() < 2:
+                for child in node.children:
+                    tokens += to_tokens_fun(child)
+            else:
+                tokens.append("\\(")
+                for i in xrange(len(node.children)-1):
+                    tokens += to_tokens_fun(node.children[i])
+                tokens += to_tokens_fun(node.children[-1])
+                tokens.append("\\)")
+        elif node.kind == "nt":
+            assert(loose_constraints or node.get_num_of_children() > 0)
+            tokens.append("(")
+            for child in node.children:
+                tokens += to_tokens_fun(child)
+            tokens.append(")")
+        elif node.is_argument() or node.kind in ["t"]:
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            if arg_type_only and node.is_open_vocab():
+                if keep_common_args:
+                    # keep frequently-occurred arguments in the vocabulary
+                    # TODO: define the criteria for "common args"
+                    token = node.value
+                else:
+                    if node.arg_type in bash.quantity_argument_types:
+                        if node.value.startswith('+'):
+                            token = '+{}'.format(node.arg_type)
+                        elif node.value.startswith('-'):
+                            token = '-{}'.format(node.arg_type)
+                        else:
+                            token = node.arg_type
+                    else:
+                        token = node.arg_type
+            else:
+                token = node.value
+            if with_prefix:
+                token = node.prefix + token
+            if with_arg_type:
+                token = token + "_" + node.arg_type
+            if indexing_args and node.to_index():
+                token = token + "-{:02d}".format(node.index)
+
+            tokens.append(token)
+            if lc:
+                for child in node.children:
+                    tokens += to_tokens_fun(child)
+        return tokens
+
+    return to_tokens_fun(node)
+
+
+
+def recursive_serialize_ast(node, loose_constraints=False, ignore_flag_order=False):
+    if not node:
+        return ''
+    node = nast.get_root(node)
+
+    lc = loose_constraints
+    ifo = ignore_flag_order
+
+    def to_command_fun(node):
+        str = ''
+        if node.is_root():
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc:
+                for child in node.children:
+                    str += to_command_fun(child)
+            else:
+                str += to_command_fun(node.get_left_child())
+        elif node.kind == 'pipeline':
+            assert(loose_constraints or node.get_num_of_children() > 1)
+            if lc and node.get_num_of_children() < 1:
+                str += ''
+            elif lc and node.get_num_of_children() == 1:
+                str += to_command_fun(node.get_left_child())
+            else:
+                for child in node.children[:-1]:
+                    str += to_command_fun(child)
+                    str += ' | '
+                str += to_command_fun(node.get_right_child())
+        elif node.kind == "commandsubstitution":
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc and node.get_num_of_children() < 1:
+                str += ''
+            else:
+                str += '$('
+                str += to_command_fun(node.get_left_child())
+                str += ')'
+        elif node.kind == 'processsubstitution':
+            assert(loose_constraints or node.get_num_of_children() == 1)
+            if lc and node.get_num_of_children() < 1:
+                str += ''
+            else:
+                str += '{}('.format(node.value)
+                str += to_command_fun(node.get_left_child())
+                str += ')'
+        elif node.is_utility():
+            str += node.value + ' '
+            children = sorted(node.children, key=lambda x:x.value) \
+                if ifo else node.children
+            for child in children:
+                str += to_command_fun(child) + ' '
+            str = str.strip()
+        elif node.is_option():
+            assert(loose_constraints or node.parent)
+            if '::' in node.value:
+                value, op = node.value.split('::')
+                str += value + ' '
+            else:
+                arg_connector = '=' if (node.is_long_option() and
+                                        node.children) else ' '
+                str += node.value + arg_connector
+            for child in node.children:
+                str += to_command_fun(child) + ' '
+            if '::' in node.value:
+                if op == ';':
+                    op = "\\;"
+                str += op + ' '
+            str = str.strip()
+        elif node.kind == 'operator':
+            str += '--'
+        elif node.kind == "binarylogicop":
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            if lc and node.get_num_of_children() > 0:
+                for child in node.children[:-1]:
+                    str += to_command_fun(child) + ' '
+                    str += node.value + ' '
+                str += to_command_fun(node.children[-1])
+                str = str.strip()
+            else:
+                str += node.value
+        elif node.kind == "unarylogicop":
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            if lc and node.get_num_of_children() > 0:
+                if node.associate == UnaryLogicOpNode.RIGHT:
+                    str += '{} {}'.format(
+                        node.value, to_command_fun(node.get_left_child()))
+                else:
+                    str += '{} {}'.format(
+                        to_command_fun(node.get_left_child()), node.value)
+            else:
+                str += node.value
+        elif node.kind == "bracket":
+            assert(loose_constraints or node.get_num_of_children() >= 1)
+            if lc and node.get_num_of_children() < 2:
+                for child in node.children:
+                    str += to_command_fun(child)
+            else:
+                str += "\\( "
+                for i in xrange(len(node.children)):
+                    str += to_command_fun(node.children[i]) + ' '
+                str += "\\)"
+        elif node.is_argument():
+            assert(loose_constraints or node.get_num_of_children() == 0)
+            str += node.value
+            if lc:
+                for child in node.children:
+                    str += to_command_fun(child)
+        return str
+
+    return to_command_fun(node)
+
+
+# --- Tests --- #
+
+def run(fun, *args, **kwargs):
+    try:
+        return fun(*args, **kwargs)
+    except Exception as e:
+        return type(e)
+
+def load_asts():
+    asts = []
+    with io.open(os.path.join(data_dir, 'all.cm'), encoding='utf-8') as f:
+        for line in f:
+            ast = data_tools.bash_parser(line.strip())
+            if ast is not None:
+                asts.append(ast)
+    return asts
+
+asts = load_asts()
+
+def ast2tokens_option_sets():
+    """
+    All combinations of up to two options, plus all options set.
+    """
+    option_sets = [{}, dict((option, True) for option in ast2tokens_options)]
+    for num_options in [1, 2]:
+        for options in itertools.combinations(ast2tokens_options, num_options):
+            option_sets.append(dict((option, True) for option in options))
+    return option_sets
+
+def test_ast2tokens():
+    option_sets = ast2tokens_option_sets()
+    for ast in asts:
+        for options in option_sets:
+            assert run(data_tools.ast2tokens, ast, **options) == \
+                   run(recursive_ast2tokens, ast, **options)
+
+def test_serialize_ast():
+    for ast in asts:
+        for loose_constraints, ignore_flag_order in \
+                itertools.product([False, True], repeat=2):
+            assert run(lint.serialize_ast, ast, loose_constraints,
+                       ignore_flag_order) == \
+                   run(recursive_serialize_ast, ast, loose_constraints,
+                       ignore_flag_order)
+
+def test_frozen_tree():
+    """
+    Frozen trees give the same output as the trees they are frozen from.
+    """
+    option_sets = ast2tokens_option_sets()
+    ast2list_option_sets = [
+        dict(zip(['ignore_flag_order', 'arg_type_only', 'keep_common_args',
+                  'with_flag_head', 'with_prefix'], values))
+        for values in itertools.product([False, True], repeat=5)]
+    for ast in asts:
+        frozen_tree = nast.freeze(ast)
+        for options in option_sets:
+            assert run(data_tools.ast2tokens, frozen_tree, **options) == \
+                   run(data_tools.ast2tokens, ast, **options)
+        for options in ast2list_option_sets:
+            assert run(data_tools.ast2list, frozen_tree, _list=[],
+                       **options) == \
+                   run(data_tools.ast2list, ast, _list=[], **options)
+        for loose_constraints, ignore_flag_order in \
+                itertools.product([False, True], repeat=2):
+            assert run(lint.serialize_ast, frozen_tree, loose_constraints,
+                       ignore_flag_order) == \
+                   run(lint.serialize_ast, ast, loose_constraints,
+                       ignore_flag_order)
+        assert run(data_tools.ast2tokens, frozen_tree, arg_type_only=True) == \
+               run(recursive_ast2tokens, ast, arg_type_only=True)
+        assert run(lint.serialize_ast, frozen_tree) == \
+               run(recursive_serialize_ast, ast)
+
+def test_frozen_tree_dist():
+    """
+    Tree edit distances between frozen trees are the same as between the
+    trees they are frozen from.
+    """
+    from eval import tree_dist
+    for ast1, ast2 in zip(asts, asts[1:]):
+        frozen_tree1, frozen_tree2 = nast.freeze(ast1), nast.freeze(ast2)
+        for dist_fun in [tree_dist.str_dist, tree_dist.temp_dist]:
+            assert dist_fun(frozen_tree1, frozen_tree2) == \
+                   dist_fun(ast1, ast2)
+        assert tree_dist.labeled_tree_dist(
+                   tree_dist.LabeledTree(frozen_tree1),
+                   tree_dist.LabeledTree(frozen_tree2),
+                   tree_dist.str_local_dist) == \
+               tree_dist.str_dist(ast1, ast2)
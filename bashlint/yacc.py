@@ -86,7 +86,7 @@ yaccdevel   = 0                # Set to True if developing yacc.  This turns off
 
 resultlimit = 40               # Size limit of results when running in debug mode.
 
-pickle_protocol = 0            # Protocol to use when writing pickle files
+pickle_protocol = 2            # Protocol to use when writing pickle files
 
 import re, types, sys, os.path
 
@@ -2704,7 +2704,13 @@ del _lr_goto_items
             import cPickle as pickle
         except ImportError:
             import pickle
-        outf = open(filename,"wb")
+        try:
+            outf = open(filename,"wb")
+        except IOError:
+            e = sys.exc_info()[1]
+            sys.stderr.write("Unable to create '%s'\n" % filename)
+            sys.stderr.write(str(e)+"\n")
+            return
         pickle.dump(__tabversion__,outf,pickle_protocol)
         pickle.dump(self.lr_method,outf,pickle_protocol)
         pickle.dump(signature,outf,pickle_protocol)
@@ -8,12 +8,14 @@ from __future__ import print_function
 
 import collections
 import functools
+import hashlib
+import multiprocessing
 import os
-import pickle
+import shutil
 import sys
+import uuid
 
 import numpy as np
-import scipy.sparse as ssp
 import tensorflow as tf
 
 if sys.version_info > (3, 0):
@@ -93,6 +95,8 @@ CHAR_INIT_VOCAB = [
 ]
 
 data_splits = ['train', 'dev', 'test']
+CORPUS_FORMAT_VERSION = 1
+data_channels = ['char', 'partial.token', 'token', 'normalized.token']
 TOKEN_SEPARATOR = '<TOKEN_SEPARATOR>'
 
 
@@ -112,7 +116,8 @@ class DataPoint(object):
         self.tg_ids = None
         self.csc_ids = None         # CopyNet training source ids
         self.ctg_ids = None         # CopyNet training target ids
-        self.alignments = None
+        self.alignments = None      # (source indices, target indices) of the
+                                    # aligned token pairs
         self.sc_fillers = None      # TODO: this field is no longer used
 
 
@@ -149,102 +154,52 @@ def read_data(FLAGS, split, source, target, use_buckets=True, buckets=None,
               add_start_token=False, add_end_token=False):
     vocab = load_vocabulary(FLAGS)
 
-    def get_data_file_path(data_dir, split, lang, channel):
-        return os.path.join(data_dir, '{}.{}.{}'.format(split, lang, channel))
-
-    def get_source_ids(s):
-        source_ids = []
-        for token in s.split(TOKEN_SEPARATOR):
-            if token in vocab.sc_vocab:
-                source_ids.append(vocab.sc_vocab[token])
-            else:
-                source_ids.append(UNK_ID)
-        return source_ids
-
-    def get_target_input_ids(s):
-        target_ids = []
-        for token in s.split(TOKEN_SEPARATOR):
-            if token in vocab.tg_vocab:
-                target_ids.append(vocab.tg_vocab[token])
-            else:
-                target_ids.append(UNK_ID)
-        if add_start_token:
-            target_ids.insert(0, ROOT_ID)
-        if add_end_token:
-            target_ids.append(EOS_ID)
-        return target_ids
-
     data_dir = FLAGS.data_dir
     sc_path = get_data_file_path(data_dir, split, source, 'filtered')
     tg_path = get_data_file_path(data_dir, split, target, 'filtered')
-    token_ext = 'normalized.{}'.format(FLAGS.channel) \
-        if FLAGS.normalized else FLAGS.channel
-    sc_token_path = get_data_file_path(data_dir, split, source, token_ext)
-    tg_token_path = get_data_file_path(data_dir, split, target, token_ext)
     print("source file: {}".format(sc_path))
     print("target file: {}".format(tg_path))
-    print("source tokenized sequence file: {}".format(sc_token_path))
-    print("target tokenized sequence file: {}".format(tg_token_path))
 
+    corpus = load_compiled_corpus(FLAGS, split, source, target, vocab,
+        add_start_token=add_start_token, add_end_token=add_end_token)
+    alignments = np.load(os.path.join(
+        data_dir, '{}.{}.align.npz'.format(split, FLAGS.channel)))
+    align_offsets = alignments['offsets']
+    align_source_inds = alignments['source_inds']
+    align_target_inds = alignments['target_inds']
+
+    with open(sc_path) as f:
+        sc_txts = [sc_txt.strip() for sc_txt in f.readlines()]
+    with open(tg_path) as f:
+        tg_txts = [tg_txt.strip() for tg_txt in f.readlines()]
+    num_data = len(sc_txts)
+    # data points are views of the compiled corpus arrays
+    sc_ids, sc_offsets = corpus['sc_ids'], corpus['sc_offsets']
+    tg_ids, tg_offsets = corpus['tg_ids'], corpus['tg_offsets']
+    use_copynet = 'csc_ids' in corpus
+    if use_copynet:
+        csc_ids, ctg_ids = corpus['csc_ids'], corpus['ctg_ids']
+        ctg_offsets = corpus['ctg_offsets']
     dataset = []
-    num_data = 0
-    max_sc_length = 0
-    max_tg_length = 0
-    sc_file = open(sc_path)
-    tg_file = open(tg_path)
-    sc_token_file = open(sc_token_path)
-    tg_token_file = open(tg_token_path)
-    with open(os.path.join(data_dir, '{}.{}.align'.format(split, FLAGS.channel)),
-              'rb') as f:
-        alignments = pickle.load(f)
-    for i, sc_txt in enumerate(sc_file.readlines()):
+    for i in xrange(num_data):
         data_point = DataPoint()
-        data_point.sc_txt = sc_txt.strip()
-        data_point.tg_txt = tg_file.readline().strip()
-        data_point.sc_ids = \
-            get_source_ids(sc_token_file.readline().strip())
-        if len(data_point.sc_ids) > max_sc_length:
-            max_sc_length = len(data_point.sc_ids)
-        data_point.tg_ids = \
-            get_target_input_ids(tg_token_file.readline().strip())
-        data_point.alignments = alignments[i]
-        if len(data_point.tg_ids) > max_tg_length:
-            max_tg_length = len(data_point.tg_ids)
+        data_point.sc_txt = sc_txts[i]
+        data_point.tg_txt = tg_txts[i]
+        data_point.sc_ids = sc_ids[sc_offsets[i]:sc_offsets[i+1]]
+        data_point.tg_ids = tg_ids[tg_offsets[i]:tg_offsets[i+1]]
+        if use_copynet:
+            data_point.csc_ids = csc_ids[sc_offsets[i]:sc_offsets[i+1]]
+            data_point.ctg_ids = ctg_ids[ctg_offsets[i]:ctg_offsets[i+1]]
+        align_start, align_end = align_offsets[i], align_offsets[i+1]
+        data_point.alignments = (align_source_inds[align_start:align_end],
+                                 align_target_inds[align_start:align_end])
         dataset.append(data_point)
-        num_data += 1
-    sc_file.close()
-    tg_file.close()
-    sc_token_file.close()
-    tg_token_file.close()
+    max_sc_length = int(np.max(np.diff(sc_offsets))) if num_data > 0 else 0
+    max_tg_length = int(np.max(np.diff(tg_offsets))) if num_data > 0 else 0
 
     print('{} data points read.'.format(num_data))
     print('max_source_length = {}'.format(max_sc_length))
     print('max_target_length = {}'.format(max_tg_length))
-
-    if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
-        copy_token_ext = 'copy.{}'.format(token_ext)
-        sc_copy_token_path = get_data_file_path(data_dir, split, source,
-                                                copy_token_ext)
-        tg_copy_token_path = get_data_file_path(data_dir, split, target,
-                                                copy_token_ext)
-        sc_token_file = open(sc_token_path)
-        tg_token_file = open(tg_token_path)
-        sc_copy_token_file = open(sc_copy_token_path)
-        tg_copy_token_file = open(tg_copy_token_path)
-        for i, data_point in enumerate(dataset):
-            sc_tokens = sc_token_file.readline().strip().split(TOKEN_SEPARATOR)
-            tg_tokens = tg_token_file.readline().strip().split(TOKEN_SEPARATOR)
-            sc_copy_tokens = \
-                sc_copy_token_file.readline().strip().split(TOKEN_SEPARATOR)
-            tg_copy_tokens = \
-                tg_copy_token_file.readline().strip().split(TOKEN_SEPARATOR)
-            data_point.csc_ids, data_point.ctg_ids = \
-                compute_copy_indices(sc_tokens, tg_tokens,
-                    sc_copy_tokens, tg_copy_tokens, vocab.tg_vocab, token_ext)
-        sc_token_file.close()
-        tg_token_file.close()
-        sc_copy_token_file.close()
-        tg_copy_token_file.close()
     
     data_size = len(dataset)
 
@@ -315,6 +270,180 @@ def read_data(FLAGS, split, source, target, use_buckets=True, buckets=None,
     return D
 
 
+def get_data_file_path(data_dir, split, lang, channel):
+    return os.path.join(data_dir, '{}.{}.{}'.format(split, lang, channel))
+
+
+def load_compiled_corpus(FLAGS, split, source, target, vocab,
+                         add_start_token=False, add_end_token=False,
+                         retry=True):
+    """
+    Load the token ids of a dataset split from its compiled form. The split is
+    compiled first if no up-to-date compiled form exists.
+
+    A compiled corpus stores the ids of all data points in flat int32 arrays
+    with int64 offset arrays, e.g. the source ids of the i-th data point are
+    sc_ids[sc_offsets[i]:sc_offsets[i+1]]. The CopyNet source ids "csc_ids"
+    share the source offsets. Every array is saved as a .npy file and
+    memory-mapped at load time.
+
+    A compiled corpus is keyed by a signature of the options used to compile
+    it and a signature of its input files (token sequences and vocabularies),
+    so it is recompiled whenever the data, the vocabulary or the options
+    change. After a successful recompilation, the compiled forms of the same
+    split compiled with the same options from outdated input files are
+    removed; compiled forms of other options are kept, so that configurations
+    sharing a data directory do not remove each other's corpora.
+
+    :param retry: If set, recompile the split once if its compiled form is
+        removed by another process while it is being loaded.
+    """
+    data_dir = FLAGS.data_dir
+    token_ext = 'normalized.{}'.format(FLAGS.channel) \
+        if FLAGS.normalized else FLAGS.channel
+    use_copynet = FLAGS.use_copy and FLAGS.copy_fun == 'copynet'
+    sc_token_path = get_data_file_path(data_dir, split, source, token_ext)
+    tg_token_path = get_data_file_path(data_dir, split, target, token_ext)
+    copy_token_ext = 'copy.{}'.format(token_ext)
+    sc_copy_token_path = get_data_file_path(data_dir, split, source,
+                                            copy_token_ext)
+    tg_copy_token_path = get_data_file_path(data_dir, split, target,
+                                            copy_token_ext)
+    vocab_ext = 'vocab.{}'.format(token_ext)
+    input_paths = [
+        sc_token_path,
+        tg_token_path,
+        os.path.join(data_dir, '{}.{}'.format(source, vocab_ext)),
+        os.path.join(data_dir, '{}.{}'.format(target, vocab_ext))
+    ]
+    if use_copynet:
+        input_paths += [sc_copy_token_path, tg_copy_token_path]
+    array_names = ['sc_ids', 'sc_offsets', 'tg_ids', 'tg_offsets']
+    if use_copynet:
+        array_names += ['csc_ids', 'ctg_ids', 'ctg_offsets']
+
+    option_signature = [CORPUS_FORMAT_VERSION, len(vocab.sc_vocab),
+                        len(vocab.tg_vocab), add_start_token, add_end_token,
+                        use_copynet]
+    option_signature = hashlib.sha1(
+        repr(option_signature).encode('utf-8')).hexdigest()
+    signature = []
+    for path in input_paths:
+        stat = os.stat(path)
+        signature += [path, stat.st_size, stat.st_mtime]
+    signature = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+    compiled_dir = os.path.join(data_dir, 'compiled')
+    corpus_prefix = '{}.{}-{}.{}.{}.'.format(
+        split, source, target, token_ext, option_signature[:8])
+    corpus_dir = os.path.join(compiled_dir, corpus_prefix + signature[:16])
+
+    if not os.path.exists(corpus_dir):
+        print("compiling token ids into {}".format(corpus_dir))
+        corpus = compile_corpus(sc_token_path, tg_token_path, vocab, token_ext,
+            add_start_token=add_start_token, add_end_token=add_end_token,
+            sc_copy_token_path=sc_copy_token_path if use_copynet else None,
+            tg_copy_token_path=tg_copy_token_path if use_copynet else None)
+        # write into a uniquely named temporary directory first so that an
+        # interrupted compilation is never mistaken for a complete one
+        tmp_corpus_dir = '{}.{}.{}.tmp'.format(
+            corpus_dir, os.getpid(), uuid.uuid4().hex)
+        os.makedirs(tmp_corpus_dir)
+        for name in array_names:
+            np.save(os.path.join(tmp_corpus_dir, name + '.npy'), corpus[name])
+        try:
+            os.rename(tmp_corpus_dir, corpus_dir)
+        except OSError:
+            # another process compiled the same corpus concurrently; its
+            # copy is identical, so use it and discard ours
+            if not os.path.exists(corpus_dir):
+                raise
+            shutil.rmtree(tmp_corpus_dir, ignore_errors=True)
+        else:
+            remove_stale_compiled_corpora(compiled_dir, corpus_prefix,
+                                          corpus_dir)
+
+    try:
+        return dict([(name, np.load(os.path.join(corpus_dir, name + '.npy'),
+                                    mmap_mode='r')) for name in array_names])
+    except (IOError, OSError):
+        # the compiled corpus was removed by a process which recompiled the
+        # split from newer input files
+        if not retry:
+            raise
+        return load_compiled_corpus(FLAGS, split, source, target, vocab,
+            add_start_token=add_start_token, add_end_token=add_end_token,
+            retry=False)
+
+
+def remove_stale_compiled_corpora(compiled_dir, corpus_prefix, corpus_dir):
+    """
+    Delete the compiled forms of a dataset split which were compiled with the
+    same options (corpus_prefix) from other input files, so that
+    recompilations do not accumulate on disk. Temporary directories of
+    compilations in progress are left untouched.
+    """
+    for name in os.listdir(compiled_dir):
+        path = os.path.join(compiled_dir, name)
+        if name.startswith(corpus_prefix) and not name.endswith('.tmp') \
+                and path != corpus_dir and os.path.isdir(path):
+            print("removing stale compiled corpus {}".format(path))
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def compile_corpus(sc_token_path, tg_token_path, vocab, token_ext,
+                   add_start_token=False, add_end_token=False,
+                   sc_copy_token_path=None, tg_copy_token_path=None):
+    """
+    Map the token sequences of a dataset split to flat id arrays.
+
+    :param sc_copy_token_path: If set, also compute the CopyNet indices using
+        the source and target copy tokens.
+    """
+    def read_token_sequences(path):
+        with open(path) as f:
+            return [line.strip().split(TOKEN_SEPARATOR) for line in f.readlines()]
+
+    def flatten(sequences):
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(seq) for seq in sequences])
+        ids = np.fromiter((x for seq in sequences for x in seq),
+                          dtype=np.int32, count=offsets[-1])
+        return ids, offsets
+
+    sc_tokens_list = read_token_sequences(sc_token_path)
+    tg_tokens_list = read_token_sequences(tg_token_path)
+    sc_id_seqs = [tokens_to_ids(sc_tokens, vocab.sc_vocab)
+                  for sc_tokens in sc_tokens_list]
+    tg_id_seqs = []
+    for tg_tokens in tg_tokens_list:
+        tg_ids = tokens_to_ids(tg_tokens, vocab.tg_vocab)
+        if add_start_token:
+            tg_ids.insert(0, ROOT_ID)
+        if add_end_token:
+            tg_ids.append(EOS_ID)
+        tg_id_seqs.append(tg_ids)
+
+    corpus = {}
+    corpus['sc_ids'], corpus['sc_offsets'] = flatten(sc_id_seqs)
+    corpus['tg_ids'], corpus['tg_offsets'] = flatten(tg_id_seqs)
+
+    if sc_copy_token_path:
+        sc_copy_tokens_list = read_token_sequences(sc_copy_token_path)
+        tg_copy_tokens_list = read_token_sequences(tg_copy_token_path)
+        csc_id_seqs, ctg_id_seqs = [], []
+        for i in xrange(len(sc_tokens_list)):
+            csc_ids, ctg_ids = compute_copy_indices(
+                sc_tokens_list[i], tg_tokens_list[i], sc_copy_tokens_list[i],
+                tg_copy_tokens_list[i], vocab.tg_vocab, token_ext)
+            csc_id_seqs.append(csc_ids)
+            ctg_id_seqs.append(ctg_ids)
+        corpus['csc_ids'], csc_offsets = flatten(csc_id_seqs)
+        assert(np.array_equal(csc_offsets, corpus['sc_offsets']))
+        corpus['ctg_ids'], corpus['ctg_offsets'] = flatten(ctg_id_seqs)
+
+    return corpus
+
+
 def load_vocabulary(FLAGS):
     data_dir = FLAGS.data_dir
     source, target = ('nl', 'cm') if not FLAGS.explain else ('cm', 'nl')
@@ -443,14 +572,22 @@ def prepare_data(FLAGS):
     channel = FLAGS.channel if FLAGS.channel else ''
     if channel and FLAGS.normalized:
         channel = 'normalized.{}'.format(channel)
-    prepare_dataset_split(data_dir, 'train', channel=channel)
-    prepare_dataset_split(data_dir, 'dev', channel=channel)
-    prepare_dataset_split(data_dir, 'test', channel=channel)
+    num_workers = FLAGS.num_workers
+    prepare_dataset_split(data_dir, 'train', channel=channel,
+                          num_workers=num_workers)
+    prepare_dataset_split(data_dir, 'dev', channel=channel,
+                          num_workers=num_workers)
+    prepare_dataset_split(data_dir, 'test', channel=channel,
+                          num_workers=num_workers)
 
 
-def prepare_dataset_split(data_dir, split, channel=''):
+def prepare_dataset_split(data_dir, split, channel='', num_workers=1):
     """
     Process a specific dataset split.
+
+    :param channel: the feature channel to process, all channels are
+        processed if not specified.
+    :param num_workers: number of processes used to tokenize the data.
     """
     def read_parallel_data(nl_path, cm_path):
         with open(nl_path) as f:
@@ -464,30 +601,79 @@ def prepare_dataset_split(data_dir, split, channel=''):
     cm_path = os.path.join(data_dir, split + '.cm.filtered')
     nl_list, cm_list = read_parallel_data(nl_path, cm_path)
 
-    # character based processing
-    if not channel or channel == 'char':
-        prepare_channel(data_dir, nl_list, cm_list, split, channel='char',
-                        parallel_data_to_tokens=parallel_data_to_characters)
-    # partial-token based processing
-    if not channel or channel == 'partial.token':
-        prepare_channel(data_dir, nl_list, cm_list, split, channel='partial.token',
-                        parallel_data_to_tokens=parallel_data_to_partial_tokens)
-    # token based processing
-    if not channel or channel == 'token':
-        prepare_channel(data_dir, nl_list, cm_list, split, channel='token',
-                        parallel_data_to_tokens=parallel_data_to_tokens)
-    # normalized token based processing
-    if not channel or channel == 'normalized.token':
-        prepare_channel(data_dir, nl_list, cm_list, split, channel='normalized.token',
-                        parallel_data_to_tokens=parallel_data_to_normalized_tokens)
-
-
-def prepare_channel(data_dir, nl_list, cm_list, split, channel,
-                    parallel_data_to_tokens):
+    channels = [c for c in data_channels if not channel or channel == c]
+    if num_workers > 1:
+        features = parallel_tokenize_data(nl_list, cm_list, channels,
+                                          num_workers)
+    else:
+        features = tokenize_data(nl_list, cm_list, channels)
+    for c in channels:
+        nl_tokens, cm_tokens, nl_copy_tokens = features[c]
+        prepare_channel(data_dir, split, c, nl_tokens, cm_tokens,
+                        nl_copy_tokens)
+
+
+def tokenize_data(nl_list, cm_list, channels):
+    """
+    Tokenize parallel data for each of the feature channels.
+
+    :return: dictionary which maps a channel to the tuple (nl_tokens,
+        cm_tokens, nl_copy_tokens).
+    """
+    features = {}
+    for channel in channels:
+        nl_tokens, cm_tokens = \
+            channel_tokenizers[channel](nl_list, cm_list)
+        # For copying
+        if channel == 'char':
+            nl_copy_tokens = nl_tokens
+        elif channel == 'partial.token':
+            nl_copy_tokens = [nl_to_partial_tokens(nl, tokenizer.basic_tokenizer,
+                to_lower_case=False, lemmatization=False) for nl in nl_list]
+        else:
+            nl_copy_tokens = [nl_to_tokens(nl, tokenizer.basic_tokenizer,
+                to_lower_case=False, lemmatization=False) for nl in nl_list]
+        features[channel] = (nl_tokens, cm_tokens, nl_copy_tokens)
+    return features
+
+
+def tokenize_data_shard(shard):
+    nl_list, cm_list, channels = shard
+    return tokenize_data(nl_list, cm_list, channels)
+
+
+def parallel_tokenize_data(nl_list, cm_list, channels, num_workers):
+    """
+    Tokenize parallel data with a pool of processes.
+
+    The data is split into contiguous shards, each of which is tokenized for
+    all channels by the same worker, so that a command is parsed only once.
+    The shards are merged back in their original order.
+    """
+    num_shards = num_workers * 4
+    shard_size = max(int(np.ceil(len(nl_list) / num_shards)), 1)
+    shards = [(nl_list[i:i+shard_size], cm_list[i:i+shard_size], channels)
+              for i in xrange(0, len(nl_list), shard_size)]
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        shard_features = pool.map(tokenize_data_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+    features = {}
+    for channel in channels:
+        nl_tokens, cm_tokens, nl_copy_tokens = [], [], []
+        for shard_feature in shard_features:
+            nl_tokens.extend(shard_feature[channel][0])
+            cm_tokens.extend(shard_feature[channel][1])
+            nl_copy_tokens.extend(shard_feature[channel][2])
+        features[channel] = (nl_tokens, cm_tokens, nl_copy_tokens)
+    return features
+
+
+def prepare_channel(data_dir, split, channel, nl_tokens, cm_tokens,
+                    nl_copy_tokens):
     print("    channel - {}".format(channel))
-    # Tokenize data
-    nl_tokens, cm_tokens = \
-        parallel_data_to_tokens(nl_list, cm_list)
     save_channel_features_to_file(data_dir, split, channel, nl_tokens, cm_tokens,
                                   feature_separator=TOKEN_SEPARATOR)
     # Create or load vocabulary
@@ -502,22 +688,12 @@ def prepare_channel(data_dir, nl_list, cm_list, split, channel,
     save_channel_features_to_file(data_dir, split, 'ids.{}'.format(channel),
                                   nl_ids, cm_ids, feature_separator=' ')
     # For copying
-    if channel == 'char':
-        nl_copy_tokens, cm_copy_tokens = nl_tokens, cm_tokens
-    else:
-        if channel == 'partial.token':
-            nl_copy_tokens = [nl_to_partial_tokens(nl, tokenizer.basic_tokenizer,
-                to_lower_case=False, lemmatization=False) for nl in nl_list]
-        else:
-            nl_copy_tokens = [nl_to_tokens(nl, tokenizer.basic_tokenizer,
-                to_lower_case=False, lemmatization=False) for nl in nl_list]
-        cm_copy_tokens = cm_tokens
     save_channel_features_to_file(data_dir, split, 'copy.{}'.format(channel),
-        nl_copy_tokens, cm_copy_tokens, feature_separator=TOKEN_SEPARATOR)
-    alignments = compute_alignments(data_dir, nl_tokens, cm_tokens, split, channel)
-    with open(os.path.join(data_dir, '{}.{}.align'.format(split, channel)),
-              'wb') as o_f:
-        pickle.dump(alignments, o_f)
+        nl_copy_tokens, cm_tokens, feature_separator=TOKEN_SEPARATOR)
+    offsets, source_inds, target_inds = \
+        compute_alignments(data_dir, nl_tokens, cm_tokens, split, channel)
+    np.savez(os.path.join(data_dir, '{}.{}.align.npz'.format(split, channel)),
+             offsets=offsets, source_inds=source_inds, target_inds=target_inds)
 
 
 def save_channel_features_to_file(data_dir, split, channel, nl_features,
@@ -566,6 +742,14 @@ def parallel_data_to_normalized_tokens(nl_list, cm_list):
     return nl_data, cm_data
 
 
+channel_tokenizers = {
+    'char': parallel_data_to_characters,
+    'partial.token': parallel_data_to_partial_tokens,
+    'token': parallel_data_to_tokens,
+    'normalized.token': parallel_data_to_normalized_tokens
+}
+
+
 def string_to_characters(s):
     assert(isinstance(s, str))
     chars = []
@@ -763,32 +947,52 @@ def compute_copy_indices(sc_tokens, tg_tokens, sc_copy_tokens, tg_copy_tokens,
 
 
 def compute_alignments(data_dir, nl_list, cm_list, split, channel):
-    alignments = []
+    """
+    Compute the alignments of a parallel dataset.
+
+    :return: the alignments of all data points in coordinate format, i.e.
+        (offsets, source_inds, target_inds), where the aligned pairs of the
+        i-th data point are source_inds[offsets[i]:offsets[i+1]] and
+        target_inds[offsets[i]:offsets[i+1]].
+    """
+    offsets = [0]
+    source_inds, target_inds = [], []
     output_path = os.path.join(data_dir, '{}.{}.align.readable'.format(split, channel))
     with open(output_path, 'w') as o_f:
         for nl_tokens, cm_tokens in zip(nl_list, cm_list):
-            alignments.append(compute_pair_alignment(nl_tokens, cm_tokens, o_f))
-    return alignments
+            s_inds, t_inds = compute_pair_alignment(nl_tokens, cm_tokens, o_f)
+            source_inds.extend(s_inds)
+            target_inds.extend(t_inds)
+            offsets.append(len(source_inds))
+    return np.array(offsets, dtype=np.int64), \
+           np.array(source_inds, dtype=np.int32), \
+           np.array(target_inds, dtype=np.int32)
 
 
 def compute_pair_alignment(nl_tokens, cm_tokens, out_file):
     """
     Compute the alignments between two parallel sequences.
+
+    :return: source and target indices of the aligned token pairs, in
+        row-major order.
     """
     init_vocab = set(TOKEN_INIT_VOCAB + CHAR_INIT_VOCAB)
-    m = len(nl_tokens)
-    n = len(cm_tokens)
 
-    A = np.zeros([m, n], dtype=np.int32)
+    cm_token_positions = collections.defaultdict(list)
+    for j, y in enumerate(cm_tokens):
+        cm_token_positions[y].append(j)
 
+    source_inds, target_inds = [], []
     for i, x in enumerate(nl_tokens):
-        for j, y in enumerate(cm_tokens):
-            if not x in init_vocab and x == y:
-                A[i, j] = 1
-                out_file.write('{}-{} '.format(i, j))
-    out_file.write('\n')
+        if x in init_vocab or not x in cm_token_positions:
+            continue
+        for j in cm_token_positions[x]:
+            source_inds.append(i)
+            target_inds.append(j)
+    out_file.write(''.join(['{}-{} '.format(i, j)
+                            for i, j in zip(source_inds, target_inds)]) + '\n')
 
-    return ssp.lil_matrix(A)
+    return source_inds, target_inds
 
 
 def create_vocabulary(vocab_path, dataset, min_word_frequency=1,
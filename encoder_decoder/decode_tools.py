@@ -14,12 +14,17 @@ import matplotlib.pyplot as plt
 
 import numpy as np
 
+import collections
+import copy
 import datetime, time
 import re
 import shutil
+import uuid
 
 from bashlint import bash, data_tools
-from encoder_decoder import data_utils, slot_filling
+from encoder_decoder import data_utils, graph_utils, slot_filling
+from encoder_decoder import template_cache as template_cache_module
+from encoder_decoder.template_cache import CachedTemplate, TemplateCache
 from eval import tree_dist
 from nlp_tools import constants, format_args, tokenizer
 
@@ -36,15 +41,12 @@ def demo(sess, model, FLAGS):
     sentence = sys.stdin.readline()
 
     vocabs = data_utils.load_vocabulary(FLAGS)
+    slot_filling_classifier = get_slot_filling_classifer(FLAGS) \
+        if FLAGS.fill_argument_slots else None
 
     while sentence:
-        if FLAGS.fill_argument_slots:
-            slot_filling_classifier = get_slot_filling_classifer(FLAGS)
-            batch_outputs, sequence_logits = translate_fun(sentence, sess, model,
-                vocabs, FLAGS, slot_filling_classifier=slot_filling_classifier)
-        else:
-            batch_outputs, sequence_logits = translate_fun(sentence, sess, model,
-                vocabs, FLAGS)
+        batch_outputs, sequence_logits = translate_fun(sentence, sess, model,
+            vocabs, FLAGS, slot_filling_classifier=slot_filling_classifier)
         if FLAGS.token_decoding_algorithm == 'greedy':
             tree, pred_cmd, outputs = batch_outputs[0]
             score = sequence_logits[0]
@@ -69,55 +71,173 @@ def demo(sess, model, FLAGS):
 
 def translate_fun(data_point, sess, model, vocabs, FLAGS,
                   slot_filling_classifier=None):
-    tg_ids = [data_utils.ROOT_ID]
-    decoder_features = [[tg_ids]]
-    if type(data_point) is str:
-        source_str = data_point
-        encoder_features = query_to_encoder_features(data_point, vocabs, FLAGS)
-    else:
-        source_str = data_point[0].sc_txt
-        encoder_features = [[data_point[0].sc_ids]]
+    return translate_batch([data_point], sess, model, vocabs, FLAGS,
+        slot_filling_classifier=slot_filling_classifier)[0]
+
+
+def translate_batch(data_points, sess, model, vocabs, FLAGS,
+                    slot_filling_classifier=None, query_features=None):
+    """
+    Decode a list of examples in a single step of the model.
+
+    Natural language queries found in the template cache (if
+    FLAGS.template_cache_size > 0) are not decoded: the cached command
+    templates are filled with the slot fillers of the query.
+
+    :param data_points: list of examples, each is either a natural language
+        query string or a group of data points sharing the same source.
+        The list must not be longer than model.batch_size.
+    :param query_features: if set, the encoder features of each query
+        string (see query_to_encoder_features), so that the queries are not
+        tokenized again.
+    :return: list of (decoded_outputs, sequence_logits) tuples, one per
+        example, in the input order.
+    """
+    cache = get_template_cache(FLAGS)
+    if cache is None:
+        return decode_batch(data_points, sess, model, vocabs, FLAGS,
+                            slot_filling_classifier=slot_filling_classifier,
+                            query_features=query_features)
+
+    batch_results = [None] * len(data_points)
+    cache_keys = [None] * len(data_points)
+    uncached_ids = []
+    for i, data_point in enumerate(data_points):
+        if type(data_point) is str:
+            cache_keys[i] = get_template_cache_key(data_point, FLAGS)
+            entry = cache.get(cache_keys[i])
+            if entry is not None:
+                batch_results[i] = fill_cached_templates(
+                    entry, data_point, FLAGS, slot_filling_classifier)
+                continue
+        uncached_ids.append(i)
+
+    if uncached_ids:
+        templates = []
+        uncached_results = decode_batch(
+            [data_points[i] for i in uncached_ids], sess, model, vocabs,
+            FLAGS, slot_filling_classifier=slot_filling_classifier,
+            templates=templates,
+            query_features=[query_features[i] for i in uncached_ids]
+                if query_features else None)
+        for i, result, (example_templates, example_outputs) in \
+                zip(uncached_ids, uncached_results, templates):
+            batch_results[i] = result
+            if cache_keys[i] is not None:
+                cache.put(cache_keys[i], get_template_cache_entry(
+                    example_templates, example_outputs, FLAGS))
+    return batch_results
+
+
+def decode_batch(data_points, sess, model, vocabs, FLAGS,
+                 slot_filling_classifier=None, templates=None,
+                 query_features=None):
+    """
+    Decode a list of examples in a single step of the model (see
+    translate_batch).
+
+    :param templates: if a list is given, a pair (command templates of the
+        example (see decode), model outputs of the example) is appended to it
+        for each example.
+    :param query_features: see translate_batch.
+    """
+    assert(len(data_points) <= model.batch_size)
+
+    encoder_features = [[]]
+    if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
+        encoder_features.append([])
+    copy_tokens = []
+    sc_fillers = []
+    for k, data_point in enumerate(data_points):
+        if type(data_point) is str:
+            source_str = data_point
+            if query_features and query_features[k] is not None:
+                features = query_features[k]
+            else:
+                features = query_to_encoder_features(data_point, vocabs, FLAGS)
+        else:
+            source_str = data_point[0].sc_txt
+            features = [[data_point[0].sc_ids]]
+            if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
+                features.append([data_point[0].csc_ids])
+        for i in xrange(len(encoder_features)):
+            encoder_features[i].extend(features[i])
         if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
-            encoder_features.append([data_point[0].csc_ids])
+            # tokenize the source string with minimal changes on the token form
+            copy_tokens.append(query_to_copy_tokens(source_str, FLAGS))
+        if FLAGS.normalized:
+            _, entities = tokenizer.ner_tokenizer(source_str)
+            sc_fillers.append(entities[0])
 
+    tg_ids = [data_utils.ROOT_ID]
+    decoder_features = [[tg_ids] * model.batch_size]
     if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
         # append dummy copynet target features (
         # used only for computing training objectives)
         ctg_ids = [data_utils.ROOT_ID]
-        decoder_features.append([ctg_ids])
-        # tokenize the source string with minimal changes on the token form
-        copy_tokens = [query_to_copy_tokens(source_str, FLAGS)]
-    else:
-        copy_tokens = None
-    if FLAGS.normalized:
-        _, entities = tokenizer.ner_tokenizer(source_str)
-        sc_fillers = [entities[0]]
-    else:
-        sc_fillers = None
+        decoder_features.append([ctg_ids] * model.batch_size)
+
+    # Which bucket does the batch belong to?
+    bucket_id = max([get_bucket_id(model, sc_ids)
+                     for sc_ids in encoder_features[0]])
+
+    # Fill the rest of the batch with copies of the last example.
+    num_examples = len(data_points)
+    for channel in encoder_features:
+        channel.extend([channel[-1]] * (model.batch_size - num_examples))
 
-    # Which bucket does it belong to?
-    bucket_ids = [b for b in xrange(len(model.buckets))
-                  if model.buckets[b][0] > len(encoder_features[0][0])]
-    bucket_id = min(bucket_ids) if bucket_ids else (len(model.buckets) - 1)
-    
-    # Get a 1-element batch to feed the sentence to the model.
     formatted_example = model.format_batch(
         encoder_features, decoder_features, bucket_id=bucket_id)
 
     # Compute neural network decoding output
     model_outputs = model.step(sess, formatted_example, bucket_id,
                                forward_only=True)
-    sequence_logits = model_outputs.sequence_logits
 
-    decoded_outputs = decode(model_outputs, FLAGS, vocabs, sc_fillers=sc_fillers,
-                             slot_filling_classifier=slot_filling_classifier,
-                             copy_tokens=copy_tokens)
+    batch_results = []
+    for batch_id in xrange(num_examples):
+        example_outputs = slice_model_outputs(model_outputs, batch_id, FLAGS)
+        example_templates = [] if templates is not None else None
+        decoded_outputs = decode(example_outputs, FLAGS, vocabs,
+            sc_fillers=sc_fillers[batch_id:batch_id+1] if FLAGS.normalized else None,
+            slot_filling_classifier=slot_filling_classifier,
+            copy_tokens=copy_tokens[batch_id:batch_id+1] if copy_tokens else None,
+            templates=example_templates)
+        if templates is not None:
+            templates.append((example_templates[0], example_outputs))
+        batch_results.append((decoded_outputs, example_outputs.sequence_logits))
+    return batch_results
+
+
+def get_bucket_id(model, sc_ids):
+    """
+    Return the smallest bucket that fits the source sequence.
+    """
+    bucket_ids = [b for b in xrange(len(model.buckets))
+                  if model.buckets[b][0] > len(sc_ids)]
+    return min(bucket_ids) if bucket_ids else (len(model.buckets) - 1)
 
-    return decoded_outputs, sequence_logits
+
+def slice_model_outputs(model_outputs, batch_id, FLAGS):
+    """
+    Extract the outputs of a single example from the outputs of a batch.
+    """
+    O = copy.copy(model_outputs)
+    O.output_symbols = model_outputs.output_symbols[batch_id:batch_id+1]
+    O.sequence_logits = model_outputs.sequence_logits[batch_id:batch_id+1]
+    if model_outputs.encoder_hidden_states is not None:
+        O.encoder_hidden_states = \
+            model_outputs.encoder_hidden_states[batch_id:batch_id+1]
+    if model_outputs.decoder_hidden_states is not None:
+        # beam search returns beam_size decoder states per example
+        beam_size = FLAGS.beam_size \
+            if FLAGS.token_decoding_algorithm == 'beam_search' else 1
+        O.decoder_hidden_states = model_outputs.decoder_hidden_states[
+            batch_id*beam_size:(batch_id+1)*beam_size]
+    return O
 
 
 def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
-           slot_filling_classifier=None, copy_tokens=None):
+           slot_filling_classifier=None, copy_tokens=None, templates=None):
     """
     Transform the neural network output into readable strings and apply output
     filtering (if any).
@@ -127,6 +247,11 @@ def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
     :param vocabs:
     :param sc_fillers:
     :param slot_filling_classifier:
+    :param templates: if a list is given, the grammatical command templates
+        of each example are appended to it as a list of
+        (beam_id, template_tokens, tg_slots, template_ast, template) tuples,
+        so that they can be filled again with other slot fillers (see
+        fill_template).
     :return batch_outputs: nested list of (target_ast, target) tuples
         - target_ast is a python tree object for target languages that we know
           how to parse and a dummy string for those we don't
@@ -164,6 +289,8 @@ def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
             return token
 
         top_k_predictions = output_symbols[batch_id]
+        if templates is not None:
+            templates.append([])
         if FLAGS.token_decoding_algorithm == 'beam_search':
             assert(len(top_k_predictions) == FLAGS.beam_size)
             beam_outputs = []
@@ -246,27 +373,22 @@ def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
             else:
                 target_ast = '__DUMMY_TREE__'
 
-            # Step 3: check if the predicted command templates have enough
-            # slots to hold the fillers (to rule out templates that are
-            # trivially unqualified)
-            output_example = False
-            if FLAGS.explain or not FLAGS.dataset.startswith('bash') \
-                    or not FLAGS.normalized:
-                output_example = True
+            if templates is not None:
+                templates[-1].append(
+                    (beam_id, list(output_tokens), tg_slots, target_ast, target))
+
+            # Step 3: match the fillers to the argument slots
+            if FLAGS.fill_argument_slots:
+                example_encoder_outputs = encoder_outputs[batch_id]
+                example_decoder_outputs = \
+                    decoder_outputs[batch_id*FLAGS.beam_size+beam_id]
             else:
-                # Step 3: match the fillers to the argument slots
-                batch_sc_fillers = sc_fillers[batch_id]
-                if len(tg_slots) >= len(batch_sc_fillers):
-                    if FLAGS.fill_argument_slots:
-                        target_ast, target, _ = slot_filling.stable_slot_filling(
-                            output_tokens, batch_sc_fillers, tg_slots, None,
-                            encoder_outputs[batch_id],
-                            decoder_outputs[batch_id*FLAGS.beam_size+beam_id],
-                            slot_filling_classifier, verbose=False)
-                    else:
-                        output_example = True
-                    if not output_example and (target_ast is not None):
-                        output_example = True
+                example_encoder_outputs, example_decoder_outputs = None, None
+            output_example, target_ast, target = fill_template(
+                output_tokens, tg_slots, target_ast, target, FLAGS,
+                sc_fillers[batch_id] if sc_fillers is not None else None,
+                example_encoder_outputs, example_decoder_outputs,
+                slot_filling_classifier)
 
             if output_example:
                 if FLAGS.token_decoding_algorithm == 'greedy':
@@ -286,6 +408,45 @@ def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
     return batch_outputs
 
 
+def fill_template(template_tokens, tg_slots, target_ast, target, FLAGS,
+                  sc_fillers=None, encoder_outputs=None, decoder_outputs=None,
+                  slot_filling_classifier=None):
+    """
+    Check if a predicted command template has enough slots to hold the fillers
+    of the source (to rule out templates that are trivially unqualified) and
+    fill the slots if FLAGS.fill_argument_slots is set.
+
+    :param template_tokens: list of tokens in the command template (the
+        filled slots are overwritten)
+    :param tg_slots: the argument slots in the command template, indexed by
+        token id
+    :param sc_fillers: the slot fillers extracted from the source sequence,
+        indexed by token id
+    :param encoder_outputs: [encoder_length, dim] sequence of encoder hidden
+        states of the source
+    :param decoder_outputs: [decoder_length, dim] sequence of decoder hidden
+        states of the template
+    :return: (output_example, target_ast, target), output_example is False if
+        the template is rejected.
+    """
+    output_example = False
+    if FLAGS.explain or not FLAGS.dataset.startswith('bash') \
+            or not FLAGS.normalized:
+        output_example = True
+    else:
+        if len(tg_slots) >= len(sc_fillers):
+            if FLAGS.fill_argument_slots:
+                target_ast, target, _ = slot_filling.stable_slot_filling(
+                    template_tokens, sc_fillers, tg_slots, None,
+                    encoder_outputs, decoder_outputs,
+                    slot_filling_classifier, verbose=False)
+            else:
+                output_example = True
+            if not output_example and (target_ast is not None):
+                output_example = True
+    return output_example, target_ast, target
+
+
 def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
     """
     Compute top-k predictions on the dev/test dataset and write the predictions
@@ -314,6 +475,28 @@ def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
     eval_file = open(eval_file_path, 'w')
     eval_file.write('example_id, description, ground_truth, prediction, ' +
                     'correct template, correct command\n')
+
+    # Decode the examples in batches of examples from the same bucket; the
+    # results are written out in the original example order.
+    bucket_groups = collections.defaultdict(list)
+    for example_id in xrange(len(grouped_dataset)):
+        _, data_group = grouped_dataset[example_id]
+        bucket_id = get_bucket_id(model, data_group[0].sc_ids)
+        bucket_groups[bucket_id].append(example_id)
+    slot_filling_classifier = get_slot_filling_classifer(FLAGS) \
+        if FLAGS.fill_argument_slots else None
+    translations = {}
+    for bucket_id in sorted(bucket_groups):
+        example_ids = bucket_groups[bucket_id]
+        for i in xrange(0, len(example_ids), model.batch_size):
+            batch_example_ids = example_ids[i:i+model.batch_size]
+            data_groups = [grouped_dataset[example_id][1]
+                           for example_id in batch_example_ids]
+            batch_results = translate_batch(data_groups, sess, model, vocabs,
+                FLAGS, slot_filling_classifier=slot_filling_classifier)
+            for example_id, result in zip(batch_example_ids, batch_results):
+                translations[example_id] = result
+
     for example_id in xrange(len(grouped_dataset)):
         key, data_group = grouped_dataset[example_id]
 
@@ -333,13 +516,7 @@ def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
             for j in xrange(len(data_group)):
                 print('GT Target {}: {}'.format(j+1, data_group[j].tg_txt))
 
-        if FLAGS.fill_argument_slots:
-            slot_filling_classifier = get_slot_filling_classifer(FLAGS)
-            batch_outputs, sequence_logits = translate_fun(data_group, sess, model,
-                vocabs, FLAGS, slot_filling_classifier=slot_filling_classifier)
-        else:
-            batch_outputs, sequence_logits = translate_fun(data_group, sess, model,
-                vocabs, FLAGS)
+        batch_outputs, sequence_logits = translations[example_id]
         if FLAGS.tg_char:
             batch_outputs, batch_char_outputs = batch_outputs
 
@@ -405,34 +582,196 @@ def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
         'predictions.{}.latest.csv'.format(model.decode_sig)))
 
 
+# The slot filling classifier is loaded once per process and reused until the
+# model directory changes.
+slot_filling_classifier = None
+slot_filling_classifier_dir = None
+
+
 def get_slot_filling_classifer(FLAGS):
-    # create slot filling classifier
+    global slot_filling_classifier, slot_filling_classifier_dir
+    if slot_filling_classifier is None or \
+            slot_filling_classifier_dir != FLAGS.model_dir:
+        slot_filling_classifier = load_slot_filling_classifier(FLAGS)
+        slot_filling_classifier_dir = FLAGS.model_dir
+    return slot_filling_classifier
+
+
+def load_slot_filling_classifier(FLAGS):
+    """
+    Create the slot filling classifier from the training mappings saved in the
+    model directory.
+
+    Members of an .npz archive cannot be memory-mapped, so the mapping
+    matrices are extracted once into .npy files next to the archive and
+    memory-mapped from there.
+    """
     mapping_param_dir = os.path.join(FLAGS.model_dir, 'train.mappings.X.Y.npz')
-    npz = np.load(mapping_param_dir)
-    train_X = npz['arr_0']
-    train_Y = npz['arr_1']
-    slot_filling_classifier = slot_filling.KNearestNeighborModel(FLAGS.num_nn_slot_filling, train_X, train_Y)
+    train_X_path = os.path.join(FLAGS.model_dir, 'train.mappings.X.npy')
+    train_Y_path = os.path.join(FLAGS.model_dir, 'train.mappings.Y.npy')
+    npz_mtime = os.path.getmtime(mapping_param_dir)
+    if not all(os.path.exists(path) and os.path.getmtime(path) >= npz_mtime
+               for path in [train_X_path, train_Y_path]):
+        npz = np.load(mapping_param_dir)
+        for name, path in [('arr_0', train_X_path), ('arr_1', train_Y_path)]:
+            # unique temporary name, another process may be extracting the
+            # same mappings
+            tmp_path = '{}.{}.{}.tmp.npy'.format(
+                path[:-len('.npy')], os.getpid(), uuid.uuid4().hex)
+            np.save(tmp_path, npz[name])
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # the other process extracted the identical matrix first
+                if not os.path.exists(path):
+                    raise
+                os.remove(tmp_path)
+        npz.close()
+    train_X = np.load(train_X_path, mmap_mode='r')
+    train_Y = np.load(train_Y_path, mmap_mode='r')
+    nn_index = slot_filling.load_nn_index(mapping_param_dir, train_X,
+        kind=FLAGS.slot_filling_index, dtype=FLAGS.slot_filling_index_dtype,
+        num_bits=FLAGS.slot_filling_lsh_bits,
+        num_tables=FLAGS.slot_filling_lsh_tables)
+    slot_filling_classifier = slot_filling.KNearestNeighborModel(
+        FLAGS.num_nn_slot_filling, train_X, train_Y, index=nn_index)
     print('Slot filling classifier parameters loaded.')
     return slot_filling_classifier
 
 
+# The template cache is created once per process and reused until the model
+# directory changes.
+template_cache = None
+template_cache_dir = None
+
+
+def get_template_cache(FLAGS):
+    """
+    :return: the template cache of the model, None if FLAGS.template_cache_size
+        is not positive.
+    """
+    global template_cache, template_cache_dir
+    if FLAGS.template_cache_size <= 0:
+        return None
+    if template_cache is None or template_cache_dir != FLAGS.model_dir:
+        template_cache = TemplateCache(FLAGS.template_cache_size,
+                                       FLAGS.template_cache_ttl)
+        template_cache_dir = FLAGS.model_dir
+        if FLAGS.template_cache_warmup:
+            template_cache_module.warm_up(
+                template_cache, FLAGS.template_cache_warmup,
+                lambda sentence: get_template_cache_key(sentence, FLAGS),
+                FLAGS.normalized)
+    return template_cache
+
+
+def get_template_cache_key(sentence, FLAGS):
+    """
+    Queries which are encoded into the same token sequence by the same model
+    share a cache entry. The copied source tokens are part of the key of
+    CopyNet models since they appear in the predictions.
+    """
+    key = graph_utils.get_decode_signature(FLAGS) + \
+          (tuple(query_to_tokens(sentence, FLAGS)),)
+    if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
+        key += (tuple(query_to_copy_tokens(sentence, FLAGS)),)
+    return key
+
+
+def get_template_cache_entry(example_templates, example_outputs, FLAGS):
+    """
+    :param example_templates: command templates of an example (see decode).
+    :param example_outputs: model outputs of the example.
+    """
+    if FLAGS.token_decoding_algorithm == 'beam_search':
+        scores = example_outputs.sequence_logits[0]
+    else:
+        scores = example_outputs.sequence_logits
+    encoder_outputs, decoder_outputs = None, None
+    if FLAGS.fill_argument_slots:
+        encoder_outputs = example_outputs.encoder_hidden_states[0]
+        decoder_outputs = example_outputs.decoder_hidden_states
+    templates = [CachedTemplate(template_tokens, tg_slots, template_ast,
+                     template, float(scores[beam_id]),
+                     decoder_outputs[beam_id] if decoder_outputs is not None
+                     else None)
+                 for beam_id, template_tokens, tg_slots, template_ast, template
+                 in example_templates]
+    return templates, encoder_outputs
+
+
+def fill_cached_templates(entry, sentence, FLAGS, slot_filling_classifier=None):
+    """
+    Fill the cached command templates of a query with its slot fillers.
+
+    Templates decoded in this process are filled as in decode. Templates
+    loaded from a predictions file have no hidden states and are filled with
+    slot_filling.heuristic_slot_filling.
+
+    :return: (decoded_outputs, sequence_logits) in the format of
+        translate_batch; the scores of templates loaded from a predictions
+        file are None.
+    """
+    templates, encoder_outputs = entry
+    sc_fillers, ner_by_category = None, None
+    if FLAGS.normalized:
+        _, entities = tokenizer.ner_tokenizer(sentence)
+        sc_fillers, _, ner_by_category = entities
+
+    outputs, scores = [], []
+    for template in templates:
+        if template.decoder_outputs is None and FLAGS.fill_argument_slots \
+                and FLAGS.normalized and FLAGS.dataset.startswith('bash') \
+                and not FLAGS.explain:
+            target_ast = copy.deepcopy(template.template_ast)
+            output_example = len(template.tg_slots) >= len(sc_fillers) and \
+                slot_filling.heuristic_slot_filling(target_ast, ner_by_category)
+            target = data_tools.ast2command(target_ast, loose_constraints=True) \
+                if output_example else None
+        else:
+            output_example, target_ast, target = fill_template(
+                list(template.template_tokens), template.tg_slots,
+                template.template_ast, template.template, FLAGS, sc_fillers,
+                encoder_outputs, template.decoder_outputs,
+                slot_filling_classifier)
+        if output_example:
+            outputs.append((target_ast, target))
+            scores.append(template.score)
+        # The threshold is used to increase decoding speed
+        if len(outputs) == 20:
+            break
+
+    if FLAGS.token_decoding_algorithm == 'beam_search':
+        return ([outputs] if outputs else []), [scores]
+    else:
+        return outputs, scores
+
+
 # --- Compute query features
-def query_to_encoder_features(sentence, vocabs, FLAGS):
+def query_to_tokens(sentence, FLAGS):
     """
-    Convert a natural language query into feature vectors used by the encoder.
+    Convert a natural language query into the token sequence read by the
+    encoder.
     """
     if FLAGS.channel == 'char':
         tokens = data_utils.nl_to_characters(sentence)
-        init_vocab = data_utils.CHAR_INIT_VOCAB
     elif FLAGS.channel == 'partial.token':
         tokens = data_utils.nl_to_partial_tokens(sentence, tokenizer.basic_tokenizer)
-        init_vocab = data_utils.TOKEN_INIT_VOCAB
     else:
         if FLAGS.normalized:
             tokens = data_utils.nl_to_tokens(sentence, tokenizer.ner_tokenizer)
         else:
             tokens = data_utils.nl_to_tokens(sentence, tokenizer.basic_tokenizer)
-        init_vocab = data_utils.TOKEN_INIT_VOCAB
+    return tokens
+
+
+def query_to_encoder_features(sentence, vocabs, FLAGS):
+    """
+    Convert a natural language query into feature vectors used by the encoder.
+    """
+    tokens = query_to_tokens(sentence, FLAGS)
+    init_vocab = data_utils.CHAR_INIT_VOCAB if FLAGS.channel == 'char' \
+        else data_utils.TOKEN_INIT_VOCAB
     sc_ids = data_utils.tokens_to_ids(tokens, vocabs.sc_vocab)
     encoder_features = [[sc_ids]]
     if FLAGS.use_copy and FLAGS.copy_fun == 'copynet':
@@ -34,8 +34,6 @@ class Decoder(graph_utils.NNModel):
             2. "beam_search"
         """
         super(Decoder, self).__init__(hyperparameters)
-        if self.forward_only:
-            self.hyperparams['batch_size'] = 1
 
         self.scope = scope
         self.dim = dim
@@ -103,6 +101,24 @@ class CopyCellWrapper(tf.nn.rnn_cell.RNNCell):
         self.encoder_copy_inputs = \
             tf.concat(axis=1, values=[tf.expand_dims(x, 1) for x in encoder_copy_inputs])
 
+        # The copying probability of each source position is added to the
+        # extended vocabulary entry of its copy input. The entries of
+        # different examples are kept apart by offsetting them by
+        # (extended vocabulary size x example index), so that the mixture of
+        # a batch is a single segment sum over the source positions.
+        # Copy inputs outside of the extended vocabulary are sent to an extra
+        # last segment which is discarded (they are dropped, as by one_hot).
+        self.copy_vocab_size = self.tg_vocab_size + self.encoder_size
+        batch_size = tf.shape(self.encoder_copy_inputs)[0]
+        self.num_copy_segments = batch_size * self.copy_vocab_size + 1
+        in_vocab = tf.logical_and(self.encoder_copy_inputs >= 0,
+            self.encoder_copy_inputs < self.copy_vocab_size)
+        self.copy_segment_ids = tf.reshape(tf.where(in_vocab,
+            self.encoder_copy_inputs + tf.expand_dims(
+                tf.range(batch_size) * self.copy_vocab_size, 1),
+            tf.fill(tf.shape(self.encoder_copy_inputs),
+                    self.num_copy_segments - 1)), [-1])
+
         print("CopyCellWrapper added!")
 
     def __call__(self, input_embedding, state, scope=None):
@@ -119,11 +135,13 @@ class CopyCellWrapper(tf.nn.rnn_cell.RNNCell):
         prob = tf.nn.softmax(tf.concat([gen_logit, copy_logit], axis=1))
         gen_prob = tf.slice(prob, [0, 0], [-1, self.tg_vocab_size])
         copy_prob = tf.slice(prob, [0, self.tg_vocab_size], [-1, -1])
-        copy_vocab_prob = tf.squeeze(tf.matmul(tf.expand_dims(copy_prob, 1),
-            tf.one_hot(self.encoder_copy_inputs, depth=self.tg_vocab_size+copy_prob.get_shape()[1].value)), 1)
+        # [batch_size x (tg_vocab_size + max_source_length)]
+        copy_vocab_prob = tf.reshape(tf.unsorted_segment_sum(
+            tf.reshape(copy_prob, [-1]), self.copy_segment_ids,
+            self.num_copy_segments)[:-1], [-1, self.copy_vocab_size])
 
         # mixture probability
-        mix_prob = tf.concat([gen_prob, tf.zeros(tf.shape(copy_prob))], 1) + \
+        mix_prob = tf.pad(gen_prob, [[0, 0], [0, self.encoder_size]]) + \
                    copy_vocab_prob
 
         return mix_prob, state, alignments, attns
@@ -159,11 +177,14 @@ class AttentionCellWrapper(tf.nn.rnn_cell.RNNCell):
             attention_states = tf.nn.dropout(
                 attention_states, attention_input_keep)
         attn_length = attention_states.get_shape()[1].value
+        if attn_length is None:
+            # the source length is only known at run time when the encoder is
+            # unrolled dynamically
+            attn_length = tf.shape(attention_states)[1]
         attn_dim = attention_states.get_shape()[2].value
 
         self.cell = cell
         self.encoder_attn_masks = encoder_attn_masks
-        self.vocab_indices = tf.diag(tf.ones(tg_vocab_size))
         self.num_heads = num_heads
         self.dim = dim
         self.num_layers = num_layers
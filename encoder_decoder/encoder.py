@@ -154,6 +154,19 @@ class RNNEncoder(Encoder):
             return rnn.RNNModel(self.cell, input_embeddings,
                 num_cell_layers=self.num_layers, dtype=tf.float32)
 
+    def define_dynamic_graph(self, encoder_inputs, sequence_length):
+        """
+        :param encoder_inputs: [batch_size, T] batch-major token indices of
+            the right-padded source sequences.
+        :param sequence_length: [batch_size] length of the source sequences.
+        :return: ([batch_size, T, output_dim] hidden states, final state)
+        """
+        input_embeddings = tf.nn.embedding_lookup(
+            self.token_embeddings(), encoder_inputs)
+        with tf.variable_scope("encoder_rnn"):
+            return rnn.DynamicRNNModel(self.cell, input_embeddings,
+                sequence_length, dtype=tf.float32)
+
     def encoder_cell(self):
         """RNN cell for the encoder."""
         with tf.variable_scope("encoder_cell") as scope:
@@ -188,6 +201,20 @@ class BiRNNEncoder(Encoder):
             return rnn.BiRNNModel(self.fw_cell, self.bw_cell, input_embeddings,
                 num_cell_layers=self.num_layers, dtype=tf.float32)
 
+    def define_dynamic_graph(self, encoder_inputs, sequence_length):
+        """
+        :param encoder_inputs: [batch_size, T] batch-major token indices of
+            the right-padded source sequences.
+        :param sequence_length: [batch_size] length of the source sequences.
+        :return: ([batch_size, T, output_dim] hidden states, final state)
+        """
+        input_embeddings = tf.nn.embedding_lookup(
+            self.token_embeddings(), encoder_inputs)
+        with tf.variable_scope("encoder_rnn"):
+            return rnn.DynamicBiRNNModel(self.fw_cell, self.bw_cell,
+                input_embeddings, sequence_length,
+                num_cell_layers=self.num_layers, dtype=tf.float32)
+
     def forward_cell(self):
         """RNN cell for the forward RNN."""
         with tf.variable_scope("forward_cell") as scope:
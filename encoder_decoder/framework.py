@@ -8,9 +8,15 @@ import sys
 if sys.version_info > (3, 0):
     from six.moves import xrange
 
+import json
 import numpy as np
 
 import tensorflow as tf
+from tensorflow.python.util import nest
+try:
+    from tensorflow.tools.graph_transforms import TransformGraph
+except ImportError:
+    TransformGraph = None
 
 from encoder_decoder import data_utils, graph_utils
 from encoder_decoder.seq2seq import rnn_decoder
@@ -75,6 +81,10 @@ class EncoderDecoderModel(graph_utils.NNModel):
     def define_graph(self):
         self.debug_vars = []
 
+        if self.dynamic_length:
+            self.define_dynamic_graph()
+            return
+
         # Feeds for inputs.
         self.encoder_inputs = []        # encoder inputs.
         self.encoder_attn_masks = []    # mask out PAD symbols in the encoder
@@ -191,6 +201,61 @@ class EncoderDecoderModel(graph_utils.NNModel):
             if self.use_copy:
                 self.pointers = encode_decode_outputs['pointers']
 
+        self.define_updates()
+
+        self.saver = tf.train.Saver(tf.global_variables())
+
+
+    def define_dynamic_graph(self):
+        """
+        Batch-major graph whose encoder and decoder are unrolled with while
+        loops over the time steps of the batch. A single graph serves all
+        buckets, and the inputs are fed as [batch_size, T] matrices where T
+        is the length of the longest sequence in the batch.
+        """
+        self.debug_vars = []
+
+        # Feeds for inputs (batch-major, laid out as in format_batch).
+        self.encoder_inputs = tf.placeholder(
+            tf.int32, shape=[None, None], name="encoder_inputs")
+        self.encoder_attn_masks = tf.placeholder(
+            tf.float32, shape=[None, None], name="encoder_attn_masks")
+        self.decoder_inputs = tf.placeholder(
+            tf.int32, shape=[None, None], name="decoder_inputs")
+        self.target_weights = tf.placeholder(
+            tf.float32, shape=[None, None], name="target_weights")
+
+        encode_decode_outputs = self.dynamic_encode_decode(
+            self.encoder_inputs, self.encoder_attn_masks,
+            self.decoder_inputs, self.target_weights)
+        self.output_symbols = encode_decode_outputs['output_symbols']
+        self.sequence_logits = encode_decode_outputs['sequence_logits']
+        self.losses = encode_decode_outputs['losses']
+        self.attn_alignments = encode_decode_outputs['attn_alignments']
+        self.encoder_hidden_states = encode_decode_outputs['encoder_hidden_states']
+        self.decoder_hidden_states = encode_decode_outputs['decoder_hidden_states']
+
+        self.define_updates()
+
+        if self.buckets:
+            # every bucket runs the same graph
+            num_buckets = len(self.buckets)
+            self.output_symbols = [self.output_symbols] * num_buckets
+            self.sequence_logits = [self.sequence_logits] * num_buckets
+            self.losses = [self.losses] * num_buckets
+            self.attn_alignments = [self.attn_alignments] * num_buckets
+            self.encoder_hidden_states = \
+                [self.encoder_hidden_states] * num_buckets
+            self.decoder_hidden_states = \
+                [self.decoder_hidden_states] * num_buckets
+            if not self.forward_only:
+                self.gradient_norms = [self.gradient_norms] * num_buckets
+                self.updates = [self.updates] * num_buckets
+
+        self.saver = tf.train.Saver(tf.global_variables())
+
+
+    def define_updates(self):
         # Gradients and SGD updates in the backward direction.
         if not self.forward_only:
             params = tf.trainable_variables()
@@ -203,7 +268,7 @@ class EncoderDecoderModel(graph_utils.NNModel):
             else:
                 raise ValueError("Unrecognized optimizer type.")
 
-            if self.buckets:
+            if self.buckets and not self.dynamic_length:
                 self.gradient_norms = []
                 self.updates = []
                 for bucket_id, _ in enumerate(self.buckets):
@@ -220,8 +285,6 @@ class EncoderDecoderModel(graph_utils.NNModel):
                 self.gradient_norms = norm
                 self.updates = opt.apply_gradients(zip(clipped_gradients, params))
 
-        self.saver = tf.train.Saver(tf.global_variables())
-
 
     def encode_decode(self, encoder_channel_inputs, encoder_attn_masks,
                       decoder_inputs, targets, target_weights,
@@ -349,6 +412,60 @@ class EncoderDecoderModel(graph_utils.NNModel):
         return O
 
 
+    def dynamic_encode_decode(self, encoder_inputs, encoder_attn_masks,
+                              decoder_inputs, target_weights):
+        """
+        Batch-major version of encode_decode (see define_dynamic_graph).
+
+        :param encoder_inputs: [batch_size, T] encoder inputs, reversed and
+            left-padded as in format_batch.
+        """
+        # The encoder reads the right-padded source and its hidden states are
+        # laid out as the encoder inputs.
+        encoder_lengths = tf.to_int32(tf.reduce_sum(encoder_attn_masks, 1))
+        reverse_lengths = tf.to_int64(encoder_lengths)
+        encoder_outputs, encoder_state = self.encoder.define_dynamic_graph(
+            tf.reverse_sequence(tf.reverse(encoder_inputs, [1]),
+                                reverse_lengths, 1, 0),
+            encoder_lengths)
+        encoder_hidden_states = tf.reverse(tf.reverse_sequence(
+            encoder_outputs, reverse_lengths, 1, 0), [1])
+
+        attention_states = encoder_hidden_states \
+            if self.tg_token_use_attention else None
+        output_symbols, sequence_logits, output_logits, decoder_hidden_states, \
+            attn_alignments = self.decoder.define_dynamic_graph(
+                encoder_state, decoder_inputs,
+                encoder_attn_masks=encoder_attn_masks,
+                attention_states=attention_states)
+
+        if not self.forward_only:
+            # Our targets are decoder inputs shifted by one.
+            targets = tf.concat(axis=1, values=[decoder_inputs[:, 1:],
+                tf.fill([tf.shape(decoder_inputs)[0], 1], data_utils.PAD_ID)])
+            crossent = tf.reshape(graph_utils.sparse_cross_entropy(
+                tf.reshape(output_logits, [-1, self.target_vocab_size]),
+                tf.reshape(targets, [-1])), tf.shape(targets))
+            with tf.variable_scope("sequence_loss"):
+                log_perps = tf.reduce_sum(crossent * target_weights, 1) / \
+                            tf.reduce_sum(target_weights, 1)
+            encoder_decoder_token_loss = tf.reduce_mean(log_perps)
+            attention_reg = self.attention_regularization(attn_alignments) \
+                if self.tg_token_use_attention else 0
+            losses = encoder_decoder_token_loss + self.beta * attention_reg
+        else:
+            losses = tf.zeros_like(decoder_inputs[:, 0])
+
+        O = {}
+        O['output_symbols'] = output_symbols
+        O['sequence_logits'] = sequence_logits
+        O['losses'] = losses
+        O['attn_alignments'] = attn_alignments
+        O['encoder_hidden_states'] = encoder_hidden_states
+        O['decoder_hidden_states'] = decoder_hidden_states
+        return O
+
+
     # Loss functions.
     def sequence_loss(self, logits, targets, target_weights, loss_function):
         assert(len(logits) == len(targets))
@@ -416,21 +533,20 @@ class EncoderDecoderModel(graph_utils.NNModel):
         def load_channel(inputs, output_length, reversed_output=True):
             """
             Convert a batch of feature vectors into a batched feature vector.
+
+            :return: [output_length, batch_size] time-major matrix.
             """
-            padded_inputs = []
-            batch_inputs = []
+            batch_inputs = np.full([batch_size, output_length],
+                                   data_utils.PAD_ID, dtype=np.int32)
             for batch_idx in xrange(batch_size):
                 input = inputs[batch_idx]
-                paddings = [data_utils.PAD_ID] * (output_length - len(input))
-                if reversed_output:
-                    padded_inputs.append(list(reversed(input + paddings)))
-                else:
-                    padded_inputs.append(input + paddings)
-            for length_idx in xrange(output_length):
-                batched_dim = np.array([padded_inputs[batch_idx][length_idx]
-                        for batch_idx in xrange(batch_size)], dtype=np.int32)
-                batch_inputs.append(batched_dim)
-            return batch_inputs
+                if len(input) > output_length:
+                    input = input[-output_length:] if reversed_output \
+                        else input[:output_length]
+                batch_inputs[batch_idx, :len(input)] = input
+            if reversed_output:
+                batch_inputs = batch_inputs[:, ::-1]
+            return np.ascontiguousarray(batch_inputs.T)
 
         if bucket_id != -1:
             encoder_size, decoder_size = self.buckets[bucket_id]
@@ -438,39 +554,46 @@ class EncoderDecoderModel(graph_utils.NNModel):
             encoder_size, decoder_size = \
                 self.max_source_length, self.max_target_length
         batch_size = len(encoder_input_channels[0])
-
-        # create batch-major vectors
-        batch_encoder_inputs = load_channel(
+        if self.dynamic_length:
+            # pad the batch to its longest sequences only
+            encoder_size = min(encoder_size,
+                max(len(input) for input in encoder_input_channels[0]))
+            decoder_size = min(decoder_size,
+                max(len(input) for input in decoder_input_channels[0]))
+
+        # create time-major matrices
+        encoder_inputs = load_channel(
             encoder_input_channels[0], encoder_size, reversed_output=True)
-        batch_decoder_inputs = load_channel(
+        decoder_inputs = load_channel(
             decoder_input_channels[0], decoder_size, reversed_output=False)
+
+        encoder_input_masks = \
+            (encoder_inputs != data_utils.PAD_ID).astype(np.float32)
+        # Create target_weights to be 0 for targets that are padding.
+        # The corresponding target is decoder_input shifted by 1 forward.
+        decoder_input_masks = np.zeros([decoder_size, batch_size],
+                                       dtype=np.float32)
+        decoder_input_masks[:-1] = decoder_inputs[1:] != data_utils.PAD_ID
+
+        if self.dynamic_length:
+            # batch-major matrices
+            E = Example()
+            E.encoder_inputs = np.ascontiguousarray(encoder_inputs.T)
+            E.encoder_attn_masks = np.ascontiguousarray(encoder_input_masks.T)
+            E.decoder_inputs = np.ascontiguousarray(decoder_inputs.T)
+            E.target_weights = np.ascontiguousarray(decoder_input_masks.T)
+            return E
+
+        # slice into per time step vectors
+        batch_encoder_inputs = list(encoder_inputs)
+        batch_decoder_inputs = list(decoder_inputs)
+        batch_encoder_input_masks = list(encoder_input_masks)
+        batch_decoder_input_masks = list(decoder_input_masks)
         if self.copynet:
-            batch_encoder_copy_inputs = load_channel(
-                encoder_input_channels[1], encoder_size, reversed_output=True)
-            batch_copy_targets = load_channel(
-                decoder_input_channels[1], decoder_size, reversed_output=False)
-
-        batch_encoder_input_masks = []
-        batch_decoder_input_masks = []
-        for length_idx in xrange(encoder_size):
-            batch_encoder_input_mask = np.ones(batch_size, dtype=np.float32)
-            for batch_idx in xrange(batch_size):
-                source = batch_encoder_inputs[length_idx][batch_idx]
-                if source == data_utils.PAD_ID:
-                    batch_encoder_input_mask[batch_idx] = 0.0
-            batch_encoder_input_masks.append(batch_encoder_input_mask)
-
-        for length_idx in xrange(decoder_size):
-            # Create target_weights to be 0 for targets that are padding.
-            batch_decoder_input_mask = np.ones(batch_size, dtype=np.float32)
-            for batch_idx in xrange(batch_size):
-                # We set weight to 0 if the corresponding target is a PAD symbol.
-                # The corresponding target is decoder_input shifted by 1 forward.
-                if length_idx < decoder_size - 1:
-                    target = batch_decoder_inputs[length_idx+1][batch_idx]
-                if length_idx == decoder_size - 1 or target == data_utils.PAD_ID:
-                    batch_decoder_input_mask[batch_idx] = 0.0
-            batch_decoder_input_masks.append(batch_decoder_input_mask)
+            batch_encoder_copy_inputs = list(load_channel(
+                encoder_input_channels[1], encoder_size, reversed_output=True))
+            batch_copy_targets = list(load_channel(
+                decoder_input_channels[1], decoder_size, reversed_output=False))
 
         E = Example()
         E.encoder_inputs = batch_encoder_inputs
@@ -525,6 +648,14 @@ class EncoderDecoderModel(graph_utils.NNModel):
         """
         Assign the data vectors to the corresponding neural network variables.
         """
+        if self.dynamic_length:
+            return {
+                self.encoder_inputs.name: E.encoder_inputs,
+                self.encoder_attn_masks.name: E.encoder_attn_masks,
+                self.decoder_inputs.name: E.decoder_inputs,
+                self.target_weights.name: E.target_weights
+            }
+
         encoder_size, decoder_size = len(E.encoder_inputs), len(E.decoder_inputs)
         input_feed = {}
         for l in xrange(encoder_size):
@@ -653,6 +784,155 @@ class EncoderDecoderModel(graph_utils.NNModel):
         return O
 
 
+    def export_inference_graph(self, session, path, checkpoint_path=None):
+        """
+        Write a frozen graph which computes the decoding outputs of every
+        bucket to path, and the names of the input and output tensors of each
+        bucket to path + '.json' (see InferenceGraphModel).
+
+        The graph is pruned to the forward computation of the decoding outputs
+        and its variables are replaced by constants holding their values in
+        the session.
+        """
+        assert(self.forward_only and self.buckets)
+        signatures = []
+        for bucket_id in xrange(len(self.buckets)):
+            outputs = {
+                'output_symbols': self.output_symbols[bucket_id],
+                'sequence_logits': self.sequence_logits[bucket_id],
+                'losses': self.losses[bucket_id],
+                'encoder_hidden_states': self.encoder_hidden_states[bucket_id],
+                'decoder_hidden_states': self.decoder_hidden_states[bucket_id]
+            }
+            if self.tg_token_use_attention:
+                outputs['attn_alignments'] = self.attn_alignments[bucket_id]
+            if self.use_copy:
+                outputs['pointers'] = self.pointers[bucket_id]
+            signatures.append({'outputs': outputs})
+        output_node_names = sorted(set(
+            tensor.op.name for signature in signatures
+            for tensor in nest.flatten(signature['outputs'])))
+
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            session, session.graph.as_graph_def(), output_node_names)
+        input_node_names = [node.name for node in graph_def.node
+                            if node.op == 'Placeholder']
+        if TransformGraph is not None:
+            graph_def = TransformGraph(graph_def, input_node_names,
+                output_node_names, ['fold_constants(ignore_errors=true)'])
+
+        inputs = {
+            'encoder_inputs': self.encoder_inputs,
+            'encoder_attn_masks': self.encoder_attn_masks,
+            'decoder_inputs': self.decoder_inputs,
+            'target_weights': self.target_weights
+        }
+        if self.copynet:
+            inputs['encoder_copy_inputs'] = self.encoder_copy_inputs
+            inputs['targets'] = self.targets
+        for signature in signatures:
+            # placeholders not read by the outputs of a bucket are pruned
+            bucket_node_names = set(node.name for node in
+                tf.graph_util.extract_sub_graph(graph_def, [
+                    tensor.op.name for tensor in
+                    nest.flatten(signature['outputs'])]).node)
+            signature['inputs'] = dict(
+                (key, [placeholder.name
+                       if placeholder.op.name in bucket_node_names else None
+                       for placeholder in (placeholders if isinstance(
+                           placeholders, list) else [placeholders])])
+                for key, placeholders in inputs.items())
+            signature['outputs'] = graph_utils.nest_map(
+                lambda tensor: tensor.name, signature['outputs'])
+
+        with tf.gfile.GFile(path, 'wb') as o_f:
+            o_f.write(graph_def.SerializeToString())
+        with open(path + '.json', 'w') as o_f:
+            json.dump({
+                'checkpoint_path': checkpoint_path,
+                'batch_size': self.batch_size,
+                'buckets': self.buckets,
+                'signatures': signatures
+            }, o_f)
+        print('Inference graph ({} nodes) saved to {}'.format(
+            len(graph_def.node), path))
+
+
+class InferenceGraphModel(EncoderDecoderModel):
+    """
+    Decoding-only model which runs a frozen graph written by
+    EncoderDecoderModel.export_inference_graph. Importing the frozen graph is
+    much faster than constructing the model graph and restoring the
+    checkpoint.
+    """
+
+    def __init__(self, hyperparams, buckets, session, path):
+        graph_utils.NNModel.__init__(self, hyperparams, buckets)
+        assert(self.forward_only)
+        with open(path + '.json') as f:
+            self.signatures = json.load(f)['signatures']
+        assert(len(self.signatures) == len(buckets))
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        with session.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+
+    def feed_input(self, E, bucket_id=-1):
+        """
+        Assign the data vectors to the input tensors read by the bucket.
+        """
+        inputs = self.signatures[bucket_id]['inputs']
+        channels = [
+            ('encoder_inputs', E.encoder_inputs),
+            ('encoder_attn_masks', E.encoder_attn_masks),
+            ('decoder_inputs', E.decoder_inputs),
+            ('target_weights', E.target_weights)
+        ]
+        if self.copynet:
+            channels.append(('encoder_copy_inputs', E.encoder_copy_inputs))
+            channels.append(('targets', E.copy_targets))
+        input_feed = {}
+        for key, values in channels:
+            if self.dynamic_length:
+                # a single batch-major matrix per channel
+                if inputs[key][0] is not None:
+                    input_feed[inputs[key][0]] = values
+                continue
+            for l, name in enumerate(inputs[key]):
+                if name is None:
+                    continue
+                if l < len(values):
+                    input_feed[name] = values[l]
+                else:
+                    # Apply dummy values to the unused time steps
+                    input_feed[name] = np.zeros(values[-1].shape,
+                                                dtype=values[-1].dtype)
+        return input_feed
+
+
+    def step(self, session, formatted_example, bucket_id=-1, forward_only=True):
+        """
+        Run the forward computation of a bucket (see EncoderDecoderModel.step).
+        """
+        assert(forward_only)
+        outputs = session.run(self.signatures[bucket_id]['outputs'],
+                              self.feed_input(formatted_example, bucket_id))
+
+        O = Output()
+        O.output_symbols = outputs['output_symbols']
+        O.sequence_logits = outputs['sequence_logits']
+        O.losses = outputs['losses']
+        O.encoder_hidden_states = outputs['encoder_hidden_states']
+        O.decoder_hidden_states = outputs['decoder_hidden_states']
+        if self.tg_token_use_attention:
+            O.attn_alignments = outputs['attn_alignments']
+        if self.use_copy:
+            O.pointers = outputs['pointers']
+        return O
+
+
 class Example(object):
     """
     Input data to the neural network (batched when mini-batch training is used).
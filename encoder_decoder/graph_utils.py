@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import json
 import os
 
 import tensorflow as tf
@@ -108,6 +109,20 @@ def define_model(FLAGS, session, model_constructor, buckets, forward_only):
     params["forward_only"] = forward_only
     params["force_reading_input"] = FLAGS.force_reading_input
 
+    params["dynamic_length"] = FLAGS.dynamic_length
+    if FLAGS.dynamic_length:
+        if forward_only and FLAGS.token_decoding_algorithm == "beam_search":
+            # Beam search is implemented over the unrolled graph only, which
+            # reads the same parameters.
+            print("Beam search decoding uses the unrolled graph.")
+            params["dynamic_length"] = False
+        elif FLAGS.decoder_topology != "rnn" or FLAGS.sc_char or \
+                FLAGS.tg_char or FLAGS.training_algorithm != "standard" or \
+                (FLAGS.use_copy and FLAGS.copy_fun == "copynet"):
+            raise ValueError("--dynamic_length requires an RNN decoder "
+                             "trained with the standard algorithm, without "
+                             "CopyNet or character channels.")
+
     # construct model directory
     model_subdir, decode_sig = get_decode_signature(FLAGS)
     FLAGS.model_dir = os.path.join(FLAGS.model_root_dir, model_subdir)
@@ -117,8 +132,8 @@ def define_model(FLAGS, session, model_constructor, buckets, forward_only):
     print("decode_sig={}".format(decode_sig))
 
     if forward_only:
-        # Set batch_size to 1 for decoding.
-        params["batch_size"] = 1
+        # Examples are decoded in batches of decode_batch_size (default 1).
+        params["batch_size"] = FLAGS.decode_batch_size
         # Reset dropout probabilities for decoding.
         params["attention_input_keep"] = 1.0
         params["attention_output_keep"] = 1.0
@@ -140,11 +155,27 @@ def define_model(FLAGS, session, model_constructor, buckets, forward_only):
     if FLAGS.explain:
         FLAGS.grammatical_only = False
 
+    if forward_only and FLAGS.use_inference_graph and \
+            not FLAGS.export_inference_graph and \
+            not FLAGS.gen_slot_filling_training_data:
+        inference_graph_path = get_inference_graph_path(FLAGS, params)
+        if is_inference_graph_current(FLAGS, inference_graph_path):
+            # imported lazily since the model classes depend on this module
+            from encoder_decoder.framework import InferenceGraphModel
+            print("Reading inference graph from %s" % inference_graph_path)
+            return InferenceGraphModel(
+                params, buckets, session, inference_graph_path)
+        print("No up-to-date inference graph found at {}, constructing the "
+              "model graph".format(inference_graph_path))
+
     model = model_constructor(params, buckets)
     if forward_only or FLAGS.gen_slot_filling_training_data or \
             not FLAGS.create_fresh_params:
-        ckpt = tf.train.get_checkpoint_state(
-            os.path.join(FLAGS.model_root_dir, FLAGS.model_dir))
+        checkpoint_dir = os.path.join(FLAGS.model_root_dir, FLAGS.model_dir)
+        ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+        if ckpt is None:
+            raise ValueError("No model checkpoint found in {}".format(
+                checkpoint_dir))
         print("Reading model parameters from %s" % ckpt.model_checkpoint_path)
         model.saver.restore(session, ckpt.model_checkpoint_path)
     else:
@@ -234,6 +265,34 @@ def get_decode_signature(FLAGS):
     return model_subdir, decode_sig
 
 
+def get_inference_graph_path(FLAGS, params):
+    """
+    The frozen inference graph depends on the decoding algorithm and the
+    batch size, which are fixed in the graph.
+    """
+    graph_sig = FLAGS.token_decoding_algorithm
+    if FLAGS.token_decoding_algorithm == 'beam_search':
+        graph_sig += ".{}".format(FLAGS.beam_size)
+    graph_sig += ".{}".format(params["batch_size"])
+    if params["dynamic_length"]:
+        graph_sig += ".dynamic"
+    return os.path.join(FLAGS.model_dir, "inference.{}.pb".format(graph_sig))
+
+
+def is_inference_graph_current(FLAGS, inference_graph_path):
+    """
+    :return: True if the inference graph exists and was exported from the
+        latest checkpoint of the model.
+    """
+    if not os.path.exists(inference_graph_path + '.json'):
+        return False
+    with open(inference_graph_path + '.json') as f:
+        checkpoint_path = json.load(f)['checkpoint_path']
+    ckpt = tf.train.get_checkpoint_state(FLAGS.model_dir)
+    return ckpt is not None and \
+        ckpt.model_checkpoint_path == checkpoint_path
+
+
 def clean_dir(dir):
     for f_name in os.listdir(dir):
         if f_name.startswith('prediction'):
@@ -585,6 +644,12 @@ class NNModel(object):
         # If set, we do not construct the backward pass in the model.
         return self.hyperparams["forward_only"]
 
+    @property
+    def dynamic_length(self):
+        # If set, the encoder and decoder are unrolled with while loops over
+        # batch-major inputs instead of once per bucket.
+        return self.hyperparams["dynamic_length"]
+
     @property
     def token_decoding_algorithm(self):
         return self.hyperparams["token_decoding_algorithm"]
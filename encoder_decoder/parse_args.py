@@ -48,6 +48,25 @@ def define_input_flags():
                                 'Set to True to perform manual evaluation in the commandline interface.')
     tf.app.flags.DEFINE_boolean('demo', False,
                                 'Set to True for interactive demo.')
+    tf.app.flags.DEFINE_boolean('serve', False,
+                                'Set to True to run the translation service (see encoder_decoder/serve.py).')
+    tf.app.flags.DEFINE_string('serve_host', '127.0.0.1', 'Host the translation service listens on.')
+    tf.app.flags.DEFINE_integer('serve_port', 8080, 'Port the translation service listens on.')
+    tf.app.flags.DEFINE_string('serve_unix_socket', '',
+                               'If set, the translation service listens on this Unix socket instead of a TCP port.')
+    tf.app.flags.DEFINE_integer('serve_batch_window', 10,
+                                'Maximum time (ms) a query waits for other queries of its bucket to fill a batch. '
+                                'The batch size is set by --decode_batch_size.')
+    tf.app.flags.DEFINE_integer('serve_max_pending', 256,
+                                'Maximum number of queries queued or being decoded; further queries are rejected.')
+    tf.app.flags.DEFINE_float('serve_request_timeout', 30.0,
+                              'Time (s) after which a query that has not been answered fails.')
+    tf.app.flags.DEFINE_integer('serve_top_k', 3, 'Default number of predictions returned per query.')
+    tf.app.flags.DEFINE_boolean('export_inference_graph', False,
+                                'Set to True to save a frozen decoding graph of the model next to its checkpoint.')
+    tf.app.flags.DEFINE_boolean('use_inference_graph', False,
+                                'If set, decoding, demo and the translation service import the frozen decoding graph '
+                                '(if it is up to date) instead of constructing the model graph.')
 
     tf.app.flags.DEFINE_boolean('gen_error_analysis_sheet', False,
                                 'Set to True to generate error analysis spreadsheet.')
@@ -64,6 +83,12 @@ def define_input_flags():
     tf.app.flags.DEFINE_boolean('gen_auto_evaluation_table', False,
                                 'Set to True to tabulate the automatic evaluation results '
                                 'for specified baseline systems in standard output.')
+    tf.app.flags.DEFINE_integer('eval_shard_size', 50,
+                                'Number of examples evaluated and checkpointed together in automatic evaluation.')
+    tf.app.flags.DEFINE_string('eval_bleu_level', 'token',
+                               'Unit of the BLEU n-grams in automatic evaluation: "token" for the bash tokens '
+                               'of the commands, or "char" for the characters of the raw commands (the score '
+                               'reported by earlier versions).')
 
     # device
     tf.app.flags.DEFINE_string('gpu', '0', 'GPU device where the computation is going to be placed.')
@@ -87,6 +112,8 @@ def define_input_flags():
     tf.app.flags.DEFINE_integer('min_vocab_frequency', 1,
                                 'Minimum frequency of token in the dataset that are not considered UNK.')
     tf.app.flags.DEFINE_integer('num_buckets', 3, 'Number of buckets to use.')
+    tf.app.flags.DEFINE_integer('num_workers', 1,
+                                'Number of processes used for data preprocessing and automatic evaluation.')
 
     # training hyperparameters
     tf.app.flags.DEFINE_string('model_root_dir', 'model', 'Directory to save trained models.')
@@ -103,6 +130,8 @@ def define_input_flags():
                               'Clip gradients to this norm.')
     tf.app.flags.DEFINE_integer('batch_size', 128,
                                 'Batch size to use during training.')
+    tf.app.flags.DEFINE_integer('prefetch_queue_size', 16,
+                                'Number of training batches prepared ahead of the training step.')
     tf.app.flags.DEFINE_integer('num_layers', 1,
                                 'Number of layers in the encoder-decoder.')
     tf.app.flags.DEFINE_integer('num_samples', -1,
@@ -132,6 +161,12 @@ def define_input_flags():
 
     tf.app.flags.DEFINE_string('encoder_topology', 'rnn', 'structure of the encoder.')
     tf.app.flags.DEFINE_string('decoder_topology', 'rnn', 'structure of the decoder.')
+    tf.app.flags.DEFINE_boolean('dynamic_length', False, 'If set, the encoder and decoder are unrolled with '
+                                'while loops over batch-major inputs padded to the longest sequence in the batch, '
+                                'instead of once per bucket (training and greedy decoding only). Greedy '
+                                'decoding stops once every sequence in the batch has produced the stop token, and '
+                                'the score of a sequence excludes the steps after its own stop token (the static '
+                                'graph scores every step of the bucket).')
 
     tf.app.flags.DEFINE_boolean('tg_token_use_attention', False, 'If set, use attention for token decoder.')
     tf.app.flags.DEFINE_boolean('tg_char_use_attention', False, 'If set, use attention for char decoder.')
@@ -156,7 +191,14 @@ def define_input_flags():
     tf.app.flags.DEFINE_integer('beam_order', -1, 'Order for beam search.')
     tf.app.flags.DEFINE_float('alpha', 0.5, 'Beam search length normalization parameter.')
     tf.app.flags.DEFINE_integer('top_k', 5, 'Top-k highest-scoring structures to output.')
+    tf.app.flags.DEFINE_integer('decode_batch_size', 1, 'Number of examples of the same bucket '
+                                'decoded together in one step of decode_set.')
     tf.app.flags.DEFINE_boolean('grammatical_only', True, 'If set, output only grammatical predictions.')
+    tf.app.flags.DEFINE_integer('template_cache_size', 0, 'Number of natural language query shapes '
+                                'whose predicted command templates are cached (0 disables the cache).')
+    tf.app.flags.DEFINE_float('template_cache_ttl', 3600.0, 'Number of seconds a template cache entry is kept.')
+    tf.app.flags.DEFINE_string('template_cache_warmup', '', 'Predictions CSV file (written by decode_set) '
+                               'used to fill the template cache at startup.')
 
     tf.app.flags.DEFINE_boolean('fill_argument_slots', False, 'If set, fill the argument slots in '
                                 'the output command with filler constants extracted from the natural language input.')
@@ -164,6 +206,14 @@ def define_input_flags():
     # slot-filling experiments
     tf.app.flags.DEFINE_integer('num_nn_slot_filling', 1, 'Number of nearest neighbors to use in '
                                 'the nearest neighbor slot-filling classifier.')
+    tf.app.flags.DEFINE_string('slot_filling_index', 'exact', 'Nearest neighbor index used by the '
+                               'slot-filling classifier ("exact" or "lsh").')
+    tf.app.flags.DEFINE_string('slot_filling_index_dtype', 'float32', 'Storage type of the slot-filling '
+                               'nearest neighbor index ("float32", "float16" or "int8").')
+    tf.app.flags.DEFINE_integer('slot_filling_lsh_bits', 16, 'Number of hash bits per table of the '
+                                'slot-filling LSH index.')
+    tf.app.flags.DEFINE_integer('slot_filling_lsh_tables', 8, 'Number of hash tables of the '
+                                'slot-filling LSH index.')
     tf.app.flags.DEFINE_boolean('gen_slot_filling_training_data', False,
                                 'Set to True to generate feature vectors for slot-filling training.')
     tf.app.flags.DEFINE_boolean('eval_slot_filling', False,
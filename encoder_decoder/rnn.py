@@ -481,23 +481,100 @@ def BiRNNModel(cell_fw, cell_bw, inputs, initial_state_fw=None,
 
   # Notice that the computation of the encoder final state uses the final state
   # of the backward RNN without reverse!!!
-  if nest.is_sequence(cell_fw.state_size):
-    output_states = [nest_map_dual(lambda x, y: tf.concat(axis=1, values=[x, y]), fw, bw)
-                     for fw, bw in zip(states_fw, tmp_states)]
-  else:
-    if num_cell_layers > 1:
-      output_states = []
-      for fw, bw in zip(states_fw, tmp_states):
-        output_states.append(tf.concat(axis=1, values=[tf.concat(axis=1, values=[l_fw, l_bw])
-          for l_fw, l_bw in zip(tf.split(axis=1, num_or_size_splits=num_cell_layers, value=fw),
-            tf.split(axis=1, num_or_size_splits=num_cell_layers, value=bw))]))
-    else:
-      output_states = [tf.concat(axis=1, values=[fw, bw])
-                       for fw, bw in zip(states_fw, tmp_states)]
+  output_states = [_concat_bidirectional_state(cell_fw, fw, bw, num_cell_layers)
+                   for fw, bw in zip(states_fw, tmp_states)]
 
   return (outputs, output_states)
 
 
+def _concat_bidirectional_state(cell_fw, state_fw, state_bw, num_cell_layers):
+  """Depth-concatenate the forward and backward states of a bidirectional RNN
+  (layer by layer for multi-layer cells)."""
+  if nest.is_sequence(cell_fw.state_size):
+    return nest_map_dual(lambda x, y: tf.concat(axis=1, values=[x, y]),
+                         state_fw, state_bw)
+  if num_cell_layers > 1:
+    return tf.concat(axis=1, values=[tf.concat(axis=1, values=[l_fw, l_bw])
+      for l_fw, l_bw in zip(
+        tf.split(axis=1, num_or_size_splits=num_cell_layers, value=state_fw),
+        tf.split(axis=1, num_or_size_splits=num_cell_layers, value=state_bw))])
+  return tf.concat(axis=1, values=[state_fw, state_bw])
+
+
+def DynamicRNNModel(cell, inputs, sequence_length, initial_state=None,
+                    dtype=None, scope=None):
+  """Creates a recurrent neural network which is unrolled with a while loop
+  over batch-major inputs (see tf.nn.dynamic_rnn). No step past the longest
+  sequence of the batch is computed and the state of each sequence is not
+  updated past its length.
+
+  The cell is called in the same variable scope as in RNNModel, hence the
+  parameters of the two models are interchangeable.
+
+  Args:
+    cell: An instance of RNNCell.
+    inputs: A tensor of shape [batch_size, T, input_size]. The sequences are
+      right-padded.
+    sequence_length: An int32 vector of size [batch_size] containing the
+      length of each sequence.
+    initial_state: (optional) An initial state for the RNN.
+    dtype: (optional) The data type for the initial state. Required if
+      initial_state is not provided.
+    scope: VariableScope for the created subgraph; defaults to "RNN".
+
+  Returns:
+    A pair (outputs, state) where:
+      - outputs is a [batch_size, T, cell.output_size] tensor, whose entries
+        past the length of each sequence are zeros
+      - state is the final state of each sequence
+  """
+  with tf.variable_scope(scope or "RNN") as varscope:
+    return tf.nn.dynamic_rnn(cell, inputs, sequence_length=sequence_length,
+                             initial_state=initial_state, dtype=dtype,
+                             scope=varscope)
+
+
+def DynamicBiRNNModel(cell_fw, cell_bw, inputs, sequence_length,
+                      initial_state_fw=None, initial_state_bw=None,
+                      dtype=None, num_cell_layers=None, scope=None):
+  """Creates a bidirectional recurrent neural network which is unrolled with
+  while loops over batch-major inputs (see BiRNNModel and DynamicRNNModel).
+
+  Args:
+    inputs: A tensor of shape [batch_size, T, input_size]. The sequences are
+      right-padded.
+    sequence_length: An int32 vector of size [batch_size] containing the
+      length of each sequence.
+
+  Returns:
+    A pair (outputs, state) where:
+      - outputs is a [batch_size, T, cell_fw.output_size +
+        cell_bw.output_size] tensor of depth-concatenated forward and
+        backward outputs
+      - state is the depth-concatenation of the final forward and backward
+        states
+  """
+  name = scope or "BiRNN"
+  reverse_length = tf.to_int64(sequence_length)
+  # Forward direction
+  with tf.variable_scope(name + "_FW") as fw_scope:
+    output_fw, state_fw = DynamicRNNModel(cell_fw, inputs, sequence_length,
+      initial_state_fw, dtype, scope=fw_scope)
+
+  # Backward direction
+  with tf.variable_scope(name + "_BW") as bw_scope:
+    tmp, state_bw = DynamicRNNModel(cell_bw,
+      tf.reverse_sequence(inputs, reverse_length, 1, 0), sequence_length,
+      initial_state_bw, dtype, scope=bw_scope)
+  output_bw = tf.reverse_sequence(tmp, reverse_length, 1, 0)
+
+  outputs = tf.concat(axis=2, values=[output_fw, output_bw])
+  output_state = _concat_bidirectional_state(
+    cell_fw, state_fw, state_bw, num_cell_layers)
+
+  return (outputs, output_state)
+
+
 def _reverse_seq(input_seq, lengths):
   """Reverse a list of Tensors up to specified lengths.
 
@@ -159,13 +159,14 @@ class RNNDecoder(decoder.Decoder):
                     attn_length = attention_states.get_shape()[1]
                     attn_dim = attention_states.get_shape()[2]
                     if i == 0:
+                        # [batch_size(*self.beam_size), max_source_length]
+                        encoder_copy_inputs_2d = tf.concat(
+                            [tf.expand_dims(x, 1) for x in encoder_copy_inputs], axis=1)
                         # Append dummy zero vector to the <START> token
                         selective_reads = tf.zeros([self.batch_size, attn_dim])
                         if bs_decoding:
                             selective_reads = beam_decoder.wrap_input(selective_reads)
                     else:
-                        encoder_copy_inputs_2d = tf.concat(
-                            [tf.expand_dims(x, 1) for x in encoder_copy_inputs], axis=1)
                         if self.forward_only:
                             copy_input = tf.where(decoder_input >= self.target_vocab_size,
                                                   tf.reduce_sum(
@@ -287,6 +288,138 @@ class RNNDecoder(decoder.Decoder):
                        states, attn_alignments, pointers
 
 
+    def define_dynamic_graph(self, encoder_state, decoder_inputs,
+                             encoder_attn_masks=None, attention_states=None,
+                             num_heads=1):
+        """
+        Batch-major version of define_graph which unrolls the decoder with a
+        while loop. Used for training and greedy decoding; greedy decoding
+        stops as soon as every sequence in the batch has produced the stop
+        token. The score of a sequence sums the steps up to and including its
+        own stop token; unlike define_graph, which scores every step of the
+        bucket, the steps after the stop token are excluded, so that a score
+        does not depend on the other sequences of the batch.
+
+        :param encoder_state: Encoder state => initial decoder state.
+        :param decoder_inputs: [batch_size, T] decoder training inputs
+            ("<START>, ... <EOS>"). Only the first column is read by greedy
+            decoding (unless force_reading_input is set).
+        :param encoder_attn_masks: [batch_size, attn_length] binary masks whose
+            entries corresponding to non-padding tokens are 1.
+        :param attention_states: [batch_size, attn_length, attn_dim] encoder
+            hidden states.
+        :param num_heads: Number of attention heads.
+        :return output_symbols: [batch_size, num_steps] output sequences
+        :return sequence_logits: [batch_size] output sequence scores
+        :return output_logits: [batch_size, num_steps, vocab_size] output
+            log-probabilities of each step
+        :return states: [batch_size, num_steps, dim] top-layer hidden states
+            of each step
+        :return attn_alignments: [batch_size, num_steps, attn_length]
+            attention masks (if attention is used)
+        """
+        assert(not self.copynet)
+        assert(not (self.forward_only and
+                    self.decoding_algorithm == "beam_search"))
+        greedy_decoding = self.forward_only and not self.force_reading_input
+
+        input_embeddings = self.embeddings()
+
+        if self.force_reading_input:
+            print("Warning: reading ground truth decoder inputs at decoding time.")
+
+        batch_size = tf.shape(decoder_inputs)[0]
+        if greedy_decoding:
+            num_steps = self.max_target_length
+        else:
+            num_steps = tf.shape(decoder_inputs)[1]
+
+        with tf.variable_scope(self.scope + "_decoder_rnn"):
+            decoder_cell = self.decoder_cell()
+            if self.use_attention:
+                decoder_cell = decoder.AttentionCellWrapper(
+                    decoder_cell,
+                    attention_states,
+                    encoder_attn_masks,
+                    self.attention_function,
+                    self.attention_input_keep,
+                    self.attention_output_keep,
+                    num_heads,
+                    self.dim,
+                    self.num_layers,
+                    self.use_copy,
+                    self.vocab_size
+                )
+            W, b = self.output_project
+            epsilon = tf.constant(1e-12)
+
+            def top_state(state):
+                if self.rnn_cell == 'lstm':
+                    return state[-1][1] if self.num_layers > 1 else state[1]
+                else:
+                    return state[:, -self.dim:]
+
+            def condition(time, input, state, finished, sequence_logits,
+                          *tensor_arrays):
+                if greedy_decoding:
+                    return tf.logical_and(time < num_steps,
+                        tf.logical_not(tf.reduce_all(finished)))
+                else:
+                    return time < num_steps
+
+            def step(time, input, state, finished, sequence_logits,
+                     symbols_ta, logits_ta, states_ta, alignments_ta):
+                input_embedding = tf.nn.embedding_lookup(input_embeddings, input)
+                if self.use_attention:
+                    output, state, alignments, attns = \
+                        decoder_cell(input_embedding, state)
+                    alignments_ta = alignments_ta.write(time, alignments[0])
+                else:
+                    output, state = decoder_cell(input_embedding, state)
+                output_logits = tf.log(
+                    tf.nn.softmax(tf.matmul(output, W) + b) + epsilon)
+                output_symbol = tf.cast(tf.argmax(output_logits, 1), tf.int32)
+                # the steps after the stop token are not scored
+                sequence_logits += tf.where(finished,
+                    tf.zeros([batch_size]), tf.reduce_max(output_logits, 1))
+                if greedy_decoding:
+                    finished = tf.logical_or(finished,
+                        tf.equal(output_symbol, data_utils.EOS_ID))
+                    next_input = output_symbol
+                else:
+                    next_input = decoder_inputs[:, tf.minimum(
+                        time + 1, num_steps - 1)]
+                return (time + 1, next_input, state, finished, sequence_logits,
+                        symbols_ta.write(time, output_symbol),
+                        logits_ta.write(time, output_logits),
+                        states_ta.write(time, top_state(state)),
+                        alignments_ta)
+
+            loop_vars = (
+                tf.constant(0),
+                decoder_inputs[:, 0],
+                encoder_state,
+                tf.zeros([batch_size], dtype=tf.bool),
+                tf.zeros([batch_size]),
+                tf.TensorArray(tf.int32, size=0, dynamic_size=True),
+                tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+                tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+                tf.TensorArray(tf.float32, size=0, dynamic_size=True)
+            )
+            _, _, _, _, sequence_logits, symbols_ta, logits_ta, states_ta, \
+                alignments_ta = tf.while_loop(condition, step, loop_vars)
+
+            # time-major --> batch-major
+            output_symbols = tf.transpose(symbols_ta.stack(), [1, 0])
+            output_logits = tf.transpose(logits_ta.stack(), [1, 0, 2])
+            states = tf.transpose(states_ta.stack(), [1, 0, 2])
+            attn_alignments = tf.transpose(alignments_ta.stack(), [1, 0, 2]) \
+                if self.use_attention else None
+
+        return output_symbols, sequence_logits, output_logits, states, \
+               attn_alignments
+
+
     def decoder_cell(self):
         if self.copynet:
             input_size = self.dim * 2
@@ -0,0 +1,340 @@
+"""
+Long-running translation service.
+
+The model, the vocabularies and the slot filling classifier are loaded once.
+Queries arrive over HTTP (on a TCP port or a Unix socket) and are coalesced
+into micro-batches: each query waits in the queue of the bucket of its source
+sequence until the bucket has a full batch (FLAGS.decode_batch_size queries)
+or its oldest query has waited FLAGS.serve_batch_window milliseconds. One
+batch is decoded at a time in a worker thread, while the event loop keeps
+accepting queries.
+
+Requires Python 3 (asyncio).
+
+API:
+    POST /translate {"query": "...", "top_k": 3}
+    GET /translate?query=...&top_k=3
+        -> {"query": ..., "predictions": [{"command": ..., "score": ...}],
+            "timing": {"queue_ms": ..., "decode_ms": ..., "total_ms": ...,
+                       "batch_size": ...}}
+    GET /stats
+        -> service counters
+
+Queries are rejected with status 503 when FLAGS.serve_max_pending queries
+are already admitted, and fail with status 504 when they are not answered
+within FLAGS.serve_request_timeout seconds.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from encoder_decoder import data_utils, decode_tools
+
+
+class ServiceOverloadedError(Exception):
+    pass
+
+
+class PendingQuery(object):
+    def __init__(self, query, encoder_features, top_k, future):
+        self.query = query
+        self.encoder_features = encoder_features
+        self.top_k = top_k
+        self.future = future
+        self.arrival_time = time.time()
+
+
+class TranslationServer(object):
+    def __init__(self, sess, model, FLAGS):
+        self.sess = sess
+        self.model = model
+        self.FLAGS = FLAGS
+        self.vocabs = data_utils.load_vocabulary(FLAGS)
+        self.slot_filling_classifier = \
+            decode_tools.get_slot_filling_classifer(FLAGS) \
+            if FLAGS.fill_argument_slots else None
+
+        self.batch_size = model.batch_size
+        self.batch_window = FLAGS.serve_batch_window / 1000.0
+        # bucket id -> queue of PendingQuery
+        self.queues = collections.defaultdict(collections.deque)
+        # number of admitted queries which are not answered yet
+        self.num_pending = 0
+        # the TensorFlow session and the tokenizer caches (spell checker,
+        # parse cache) are used by a single thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.loop = None
+        self.wakeup = None
+
+        self.stats = collections.Counter()
+
+    # --- Batching --- #
+
+    async def translate(self, query, top_k):
+        """
+        Queue a query and wait for its predictions.
+        """
+        if self.num_pending >= self.FLAGS.serve_max_pending:
+            self.stats['rejected'] += 1
+            raise ServiceOverloadedError()
+        # the query is admitted from now on, it is tokenized in the worker
+        # thread, which owns the tokenizer caches
+        self.num_pending += 1
+        try:
+            encoder_features = await self.loop.run_in_executor(
+                self.executor, decode_tools.query_to_encoder_features,
+                query, self.vocabs, self.FLAGS)
+        except BaseException:
+            self.num_pending -= 1
+            raise
+        bucket_id = decode_tools.get_bucket_id(
+            self.model, encoder_features[0][0])
+        pending = PendingQuery(query, encoder_features, top_k,
+                               self.loop.create_future())
+        self.queues[bucket_id].append(pending)
+        self.wakeup.set()
+        try:
+            return await asyncio.wait_for(
+                pending.future, self.FLAGS.serve_request_timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed_out'] += 1
+            raise
+
+    def next_batch(self):
+        """
+        :return: (bucket id, list of queries) of the bucket which is full or
+            has waited the longest beyond the batching window, None if no
+            bucket is ready.
+        """
+        now = time.time()
+        ready_bucket_id, ready_time = None, None
+        for bucket_id, queue in self.queues.items():
+            # drop queries which have timed out
+            while queue and queue[0].future.done():
+                queue.popleft()
+                self.num_pending -= 1
+            if not queue:
+                continue
+            if len(queue) >= self.batch_size or \
+                    now - queue[0].arrival_time >= self.batch_window:
+                if ready_time is None or queue[0].arrival_time < ready_time:
+                    ready_bucket_id = bucket_id
+                    ready_time = queue[0].arrival_time
+        if ready_bucket_id is None:
+            return None
+        queue = self.queues[ready_bucket_id]
+        batch = []
+        while queue and len(batch) < self.batch_size:
+            pending = queue.popleft()
+            if pending.future.done():
+                self.num_pending -= 1
+            else:
+                batch.append(pending)
+        return ready_bucket_id, batch
+
+    def next_deadline(self):
+        """
+        :return: time until the batching window of the oldest query expires,
+            None if no query is queued.
+        """
+        arrival_times = [queue[0].arrival_time
+                         for queue in self.queues.values() if queue]
+        if not arrival_times:
+            return None
+        return max(min(arrival_times) + self.batch_window - time.time(), 0)
+
+    async def dispatch(self):
+        while True:
+            ready = self.next_batch()
+            if ready is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                                           self.next_deadline())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            bucket_id, batch = ready
+            if batch:
+                await self.run_batch(bucket_id, batch)
+
+    async def run_batch(self, bucket_id, batch):
+        start_time = time.time()
+        try:
+            batch_results = await self.loop.run_in_executor(
+                self.executor, decode_tools.translate_batch,
+                [pending.query for pending in batch], self.sess, self.model,
+                self.vocabs, self.FLAGS, self.slot_filling_classifier,
+                [pending.encoder_features for pending in batch])
+        except Exception as e:
+            batch_results = None
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        end_time = time.time()
+        self.num_pending -= len(batch)
+        self.stats['batches'] += 1
+        self.stats['batched_queries'] += len(batch)
+        print('bucket {}: decoded {} queries in {:.1f}ms'.format(
+            bucket_id, len(batch), (end_time - start_time) * 1000))
+        if batch_results is None:
+            return
+        for pending, (batch_outputs, sequence_logits) in \
+                zip(batch, batch_results):
+            if pending.future.done():
+                continue
+            pending.future.set_result({
+                'query': pending.query,
+                'predictions': self.format_predictions(
+                    batch_outputs, sequence_logits, pending.top_k),
+                'timing': {
+                    'queue_ms': (start_time - pending.arrival_time) * 1000,
+                    'decode_ms': (end_time - start_time) * 1000,
+                    'total_ms': (end_time - pending.arrival_time) * 1000,
+                    'batch_size': len(batch)
+                }
+            })
+
+    def format_predictions(self, batch_outputs, sequence_logits, top_k):
+        predictions = []
+        if not batch_outputs:
+            return predictions
+        if self.FLAGS.token_decoding_algorithm == 'greedy':
+            _, pred_cmd = batch_outputs[0][:2]
+            predictions.append({'command': pred_cmd,
+                                'score': as_score(sequence_logits[0])})
+        elif self.FLAGS.token_decoding_algorithm == 'beam_search':
+            top_k_predictions = batch_outputs[0]
+            top_k_scores = sequence_logits[0]
+            for j in range(min(top_k, len(top_k_predictions))):
+                _, top_k_pred_cmd = top_k_predictions[j]
+                predictions.append({'command': top_k_pred_cmd,
+                                    'score': as_score(top_k_scores[j])})
+        return predictions
+
+    # --- HTTP front end --- #
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(
+                int(headers.get('content-length', 0)))
+            status, response = await self.route(method, target, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = 400, {'error': 'malformed request'}
+        payload = json.dumps(response).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\n'.format(
+            status, HTTP_REASONS[status]).encode('latin-1'))
+        writer.write(b'Content-Type: application/json\r\n')
+        writer.write('Content-Length: {}\r\n'.format(
+            len(payload)).encode('latin-1'))
+        writer.write(b'Connection: close\r\n\r\n')
+        writer.write(payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def route(self, method, target, body):
+        url = urlparse(target)
+        if url.path == '/stats':
+            stats = dict(self.stats)
+            stats['pending'] = self.num_pending
+            return 200, stats
+        if url.path != '/translate':
+            return 404, {'error': 'unknown path {}'.format(url.path)}
+        if method == 'POST':
+            params = json.loads(body.decode('utf-8'))
+        elif method == 'GET':
+            params = dict((key, values[0]) for key, values in
+                          parse_qs(url.query).items())
+        else:
+            return 405, {'error': 'unsupported method {}'.format(method)}
+        if not isinstance(params, dict):
+            return 400, {'error': 'request body must be a JSON object'}
+        query = params.get('query', '')
+        if not isinstance(query, str):
+            return 400, {'error': 'query must be a string'}
+        query = query.strip()
+        if not query:
+            return 400, {'error': 'empty query'}
+        try:
+            top_k = int(params.get('top_k', self.FLAGS.serve_top_k))
+        except (TypeError, ValueError):
+            return 400, {'error': 'top_k must be an integer'}
+
+        self.stats['queries'] += 1
+        try:
+            result = await self.translate(query, top_k)
+        except ServiceOverloadedError:
+            return 503, {'error': 'too many pending queries'}
+        except asyncio.TimeoutError:
+            return 504, {'error': 'query timed out'}
+        except Exception as e:
+            self.stats['failed'] += 1
+            return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+        self.stats['answered'] += 1
+        return 200, result
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.wakeup = asyncio.Event()
+        if self.FLAGS.serve_unix_socket:
+            server = self.loop.run_until_complete(asyncio.start_unix_server(
+                self.handle_connection, path=self.FLAGS.serve_unix_socket))
+            address = self.FLAGS.serve_unix_socket
+        else:
+            server = self.loop.run_until_complete(asyncio.start_server(
+                self.handle_connection, self.FLAGS.serve_host,
+                self.FLAGS.serve_port))
+            address = '{}:{}'.format(self.FLAGS.serve_host,
+                                     self.FLAGS.serve_port)
+        dispatcher = self.loop.create_task(self.dispatch())
+        print('Serving translations on {} (batch size {}, batching window '
+              '{}ms)'.format(address, self.batch_size,
+                             self.FLAGS.serve_batch_window))
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.cancel()
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown()
+            self.loop.close()
+
+
+def as_score(score):
+    # templates loaded into the template cache from a predictions file have
+    # no score
+    return None if score is None else float(score)
+
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout'
+}
@@ -10,7 +10,7 @@ import os, sys
 if sys.version_info > (3, 0):
     from six.moves import xrange
 
-import collections, copy, re
+import collections, copy, re, shutil
 import numpy as np
 from numpy.linalg import norm
 
@@ -21,26 +21,25 @@ from nlp_tools import constants, format_args, tokenizer
 # --- Classifiers for estimating likelihood of local matches --- #
 
 class KNearestNeighborModel():
-    def __init__(self, k, train_X, train_Y):
+    def __init__(self, k, train_X, train_Y, index=None):
         """
         :member k: number of neighboring examples to use
         :member train_X: [size, dim] training feature matrix
         :member train_Y: [size, label_dim] training label matrix
+        :member index: nearest neighbor index over train_X (exact search over
+            train_X if not specified)
         """
         self.k = k
         self.train_X = train_X
         self.train_Y = train_Y
+        self.index = index if index is not None else ExactIndex(train_X)
 
     def predict(self, X):
         """
         :param X: [size, dim]
         """
-        # [size, size]
-        sim_scores = np.matmul(X, self.train_X.T)
         # [size, self.k]
-        nn = np.argpartition(sim_scores, -self.k, axis=1)[:, -self.k:]
-        # [size, self.k]
-        nn_weights = np.partition(sim_scores, -self.k, axis=1)[:, -self.k:]
+        nn, nn_weights = self.index.search(X, self.k)
 
         nn_prediction = np.sum(
             np.expand_dims(nn_weights, 2) * self.train_Y[nn], axis=1)[:, 0]
@@ -63,6 +62,236 @@ class KNearestNeighborModel():
         print("Accuracy: ", num_correct / num_total)
 
 
+# --- Nearest neighbor indices over the slot filling training mappings --- #
+
+def top_k(scores, k):
+    """
+    :param scores: [size, num_candidates] similarity scores
+    :return: ([size, k] column indices, [size, k] scores) of the k highest
+        scores in each row (in no particular order)
+    """
+    if k >= scores.shape[1]:
+        nn = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    else:
+        nn = np.argpartition(scores, -k, axis=1)[:, -k:]
+    return nn, np.take_along_axis(scores, nn, axis=1)
+
+
+def quantize(X, dtype):
+    """
+    Convert a feature matrix into the storage format of an index.
+
+    :return: (data, scales), where scales is None unless dtype is 'int8', in
+        which case row i of X is approximated by data[i] * scales[i].
+    """
+    if dtype == 'float32':
+        return np.asarray(X, dtype=np.float32), None
+    elif dtype == 'float16':
+        return np.asarray(X, dtype=np.float16), None
+    elif dtype == 'int8':
+        scales = np.max(np.abs(X), axis=1).astype(np.float32) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.round(X / scales[:, None]).astype(np.int8)
+        return data, scales
+    else:
+        raise ValueError('Unrecognized index storage type: {}.'.format(dtype))
+
+
+class ExactIndex(object):
+    """
+    Exact maximum inner product search over a (possibly quantized) feature
+    matrix. The matrix is scored block by block so that the score matrix
+    never exceeds [size, block_size].
+    """
+    kind = 'exact'
+    # build parameters which change the stored index
+    build_params = ()
+
+    def __init__(self, data, scales=None, block_size=65536):
+        self.data = data
+        self.scales = scales
+        self.block_size = block_size
+
+    @classmethod
+    def build(cls, train_X, dtype='float32', **kwargs):
+        data, scales = quantize(train_X, dtype)
+        return cls(data, scales)
+
+    def arrays(self):
+        arrays = {'data': self.data}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['data'], arrays.get('scales'))
+
+    def score(self, X, rows=None):
+        """
+        :return: [size, len(rows)] inner products between X and the stored
+            rows (all rows if not specified).
+        """
+        data = self.data if rows is None else self.data[rows]
+        if self.scales is not None or data.dtype == np.float16:
+            data = data.astype(np.float32)
+        scores = np.matmul(X, data.T)
+        if self.scales is not None:
+            scales = self.scales if rows is None else self.scales[rows]
+            scores *= scales
+        return scores
+
+    def search(self, X, k):
+        nn, nn_weights = None, None
+        for start in xrange(0, len(self.data), self.block_size):
+            rows = np.arange(start, min(start + self.block_size, len(self.data)))
+            block_nn, block_weights = top_k(self.score(X, rows), k)
+            block_nn += start
+            if nn is None:
+                nn, nn_weights = block_nn, block_weights
+            else:
+                # merge the best k candidates of the current block with the
+                # best k candidates so far
+                nn = np.concatenate([nn, block_nn], axis=1)
+                nn_weights = np.concatenate([nn_weights, block_weights], axis=1)
+                merged, nn_weights = top_k(nn_weights, k)
+                nn = np.take_along_axis(nn, merged, axis=1)
+        return nn, nn_weights
+
+
+class LSHIndex(ExactIndex):
+    """
+    Approximate search with random hyperplane locality sensitive hashing.
+
+    Each of the num_tables hash tables assigns a row a num_bits code by the
+    sides of random hyperplanes it lies on. The candidates of a query are the
+    rows sharing its code in at least one table, which are then scored
+    exactly. Queries with fewer than k candidates fall back to exact search.
+    """
+    kind = 'lsh'
+    build_params = ('num_bits', 'num_tables', 'seed')
+
+    def __init__(self, data, scales, planes, sorted_codes, sorted_rows):
+        super(LSHIndex, self).__init__(data, scales)
+        # [num_tables, num_bits, dim]
+        self.planes = planes
+        # [num_tables, size]
+        self.sorted_codes = sorted_codes
+        self.sorted_rows = sorted_rows
+
+    @classmethod
+    def build(cls, train_X, dtype='float32', num_bits=16, num_tables=8,
+              seed=0, **kwargs):
+        data, scales = quantize(train_X, dtype)
+        rng = np.random.RandomState(seed)
+        planes = rng.randn(num_tables, num_bits, train_X.shape[1]) \
+            .astype(np.float32)
+        codes = cls.hash(planes, train_X)
+        sorted_rows = np.argsort(codes, axis=1, kind='mergesort')
+        sorted_codes = np.take_along_axis(codes, sorted_rows, axis=1)
+        return cls(data, scales, planes, sorted_codes, sorted_rows)
+
+    @staticmethod
+    def hash(planes, X):
+        """
+        :return: [num_tables, size] hash codes of the rows of X.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        # [num_tables, size, num_bits]
+        bits = np.matmul(X, planes.transpose(0, 2, 1)) > 0
+        weights = np.left_shift(1, np.arange(planes.shape[1], dtype=np.int64))
+        return np.sum(bits * weights, axis=2)
+
+    def arrays(self):
+        arrays = super(LSHIndex, self).arrays()
+        arrays['planes'] = self.planes
+        arrays['sorted_codes'] = self.sorted_codes
+        arrays['sorted_rows'] = self.sorted_rows
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['data'], arrays.get('scales'), arrays['planes'],
+                   arrays['sorted_codes'], arrays['sorted_rows'])
+
+    def search(self, X, k):
+        X = np.asarray(X, dtype=np.float32)
+        query_codes = self.hash(self.planes, X)
+        nn = np.zeros([len(X), k], dtype=np.int64)
+        nn_weights = np.zeros([len(X), k], dtype=np.float32)
+        for i in xrange(len(X)):
+            candidates = []
+            for t in xrange(len(self.planes)):
+                codes = self.sorted_codes[t]
+                start = np.searchsorted(codes, query_codes[t, i], side='left')
+                end = np.searchsorted(codes, query_codes[t, i], side='right')
+                candidates.append(self.sorted_rows[t, start:end])
+            candidates = np.unique(np.concatenate(candidates))
+            if len(candidates) < k:
+                row_nn, row_weights = super(LSHIndex, self).search(X[i:i+1], k)
+            else:
+                row_nn, row_weights = top_k(self.score(X[i:i+1], candidates), k)
+                row_nn = candidates[row_nn]
+            nn[i], nn_weights[i] = row_nn[0], row_weights[0]
+        return nn, nn_weights
+
+
+nn_index_types = {
+    'exact': ExactIndex,
+    'lsh': LSHIndex
+}
+
+
+def load_nn_index(mapping_path, train_X, kind='exact', dtype='float32',
+                  **kwargs):
+    """
+    Load the nearest neighbor index of a slot filling mapping file, building
+    it first if it does not exist or is older than the mapping file.
+
+    The index arrays are stored as .npy files in a directory next to the
+    mapping file and memory-mapped. The directory is named after the index
+    type, the storage type and the build parameters of the index (e.g.
+    train.mappings.index.lsh.int8.num_bits-16.num_tables-8/), so that an
+    index is rebuilt whenever one of them changes.
+
+    :param mapping_path: path to the mapping file (e.g. train.mappings.X.Y.npz)
+    :param train_X: [size, dim] training feature matrix in the mapping file
+    :param kind: index type, one of nn_index_types
+    :param dtype: storage type of the features, 'float32', 'float16' or 'int8'
+    :param kwargs: index-specific build parameters
+    """
+    if not kind in nn_index_types:
+        raise ValueError('Unrecognized nearest neighbor index: {}.'.format(kind))
+    index_class = nn_index_types[kind]
+    if kind == 'exact' and dtype == 'float32':
+        return index_class(train_X)
+
+    index_dir = '{}.index.{}.{}'.format(
+        mapping_path.rsplit('.X.Y.npz', 1)[0], kind, dtype)
+    for name in index_class.build_params:
+        if name in kwargs:
+            index_dir += '.{}-{}'.format(name, kwargs[name])
+    if not os.path.exists(index_dir) or \
+            os.path.getmtime(index_dir) < os.path.getmtime(mapping_path):
+        print('building {} nearest neighbor index {}'.format(kind, index_dir))
+        index = index_class.build(train_X, dtype=dtype, **kwargs)
+        tmp_dir = index_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, array in index.arrays().items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), array)
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.rename(tmp_dir, index_dir)
+    arrays = {}
+    for file_name in os.listdir(index_dir):
+        if file_name.endswith('.npy'):
+            arrays[file_name[:-4]] = np.load(
+                os.path.join(index_dir, file_name), mmap_mode='r')
+    return index_class.from_arrays(arrays)
+
+
 def gen_slot_filling_training_data(sess, FLAGS, model, dataset, output_file):
     print("saving slot filling mappings to {}".format(output_file))
 
@@ -71,7 +300,7 @@ def gen_slot_filling_training_data(sess, FLAGS, model, dataset, output_file):
         for i in xrange(len(dataset.data_points[bucket_id])):
             dp = dataset.data_points[bucket_id][i]
             if dp.alignments is not None:
-                source_inds, target_inds = dp.alignments.nonzero()
+                source_inds, target_inds = dp.alignments
                 mappings = list(zip(list(source_inds), list(target_inds)))
                 encoder_channel_inputs = [[dp.sc_ids]]
                 decoder_channel_inputs = [[dp.tg_ids]]
@@ -0,0 +1,146 @@
+"""
+Cache of predicted command templates.
+
+Natural language queries which differ only in the entity values abstracted
+away by the named entity recognizer (file names, sizes, timespans, etc.) are
+encoded into the same token sequence, hence the model predicts the same
+command templates for them. The cache maps the encoder token sequence of a
+query and the decode signature of the model to the predicted templates and
+their scores, so that a repeated query shape only needs its argument slots to
+be filled with the new fillers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import csv
+import time
+
+from bashlint import bash, data_tools
+
+
+class CachedTemplate(object):
+    def __init__(self, template_tokens, tg_slots, template_ast, template,
+                 score=None, decoder_outputs=None):
+        """
+        :param template_tokens: list of tokens in the command template
+        :param tg_slots: the argument slots in the command template, indexed
+            by token id
+        :param template_ast: the ast of the command template
+        :param template: the command template string
+        :param score: the score of the template assigned by the model, None
+            if unknown
+        :param decoder_outputs: [decoder_length, dim] sequence of decoder
+            hidden states of the template, None if the template was not
+            decoded in this process
+        """
+        self.template_tokens = template_tokens
+        self.tg_slots = tg_slots
+        self.template_ast = template_ast
+        self.template = template
+        self.score = score
+        self.decoder_outputs = decoder_outputs
+
+
+class TemplateCache(object):
+    """
+    A least recently used cache whose entries also expire ttl seconds after
+    they are stored.
+
+    An entry is a pair (templates, encoder_outputs) of the list of
+    CachedTemplates predicted for a query and the [encoder_length, dim]
+    encoder hidden states of the query (None if unknown).
+    """
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        # key -> (expiration time, entry)
+        self.entries = collections.OrderedDict()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries and \
+            self.entries[key][0] > time.time()
+
+    def get(self, key):
+        if key in self.entries:
+            expiration_time, entry = self.entries.pop(key)
+            if expiration_time > time.time():
+                self.entries[key] = (expiration_time, entry)
+                self.num_hits += 1
+                return entry
+        self.num_misses += 1
+        return None
+
+    def put(self, key, entry):
+        if key in self.entries:
+            self.entries.pop(key)
+        elif len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+        self.entries[key] = (time.time() + self.ttl, entry)
+
+
+def get_argument_slots(template_tokens):
+    return dict((i, (token, token)) for i, token in enumerate(template_tokens)
+                if token in bash.argument_types)
+
+
+def load_predictions_csv(input_file):
+    """
+    Read the natural language descriptions and the predictions of a
+    "predictions.*.csv" file written by decode_tools.decode_set.
+
+    :return: list of (description, list of predicted commands).
+    """
+    examples = []
+    with open(input_file) as f:
+        reader = csv.reader(f, skipinitialspace=True)
+        next(reader)
+        for row in reader:
+            if len(row) < 4:
+                continue
+            if row[1]:
+                examples.append((row[1], []))
+            if examples and row[3]:
+                examples[-1][1].append(row[3])
+    return examples
+
+
+def warm_up(cache, input_file, get_key, normalized):
+    """
+    Fill the cache with the predictions of a "predictions.*.csv" file. The
+    model scores and hidden states are not saved in these files, so the
+    templates loaded have no score and their argument slots are filled with
+    slot_filling.heuristic_slot_filling.
+
+    :param get_key: function that maps a description to its cache key.
+    :param normalized: if set, the predictions are converted to templates
+        whose argument slots are filled again for every query.
+    """
+    num_entries = 0
+    for description, pred_cmds in load_predictions_csv(input_file):
+        key = get_key(description)
+        if key in cache:
+            continue
+        templates = []
+        for pred_cmd in pred_cmds:
+            template = data_tools.cmd2template(pred_cmd, loose_constraints=True) \
+                if normalized else pred_cmd
+            template_ast = data_tools.bash_parser(template, verbose=False)
+            if template_ast is None:
+                continue
+            template_tokens = template.split()
+            templates.append(CachedTemplate(
+                template_tokens, get_argument_slots(template_tokens),
+                template_ast, template))
+        if templates:
+            cache.put(key, (templates, None))
+            num_entries += 1
+    print('{} template cache entries loaded from {}'.format(
+        num_entries, input_file))
@@ -19,7 +19,9 @@ if sys.version_info > (3, 0):
 import math
 import numpy as np
 import pickle
+import threading
 import time
+from six.moves import queue
 from tqdm import tqdm
 
 import tensorflow as tf
@@ -56,6 +58,62 @@ def define_model(session, forward_only, buckets=None):
 
 # --- Run experiments --- #
 
+class BatchPrefetcher(object):
+    """
+    Prepare training batches in a background thread so that batch sampling
+    and formatting overlap with the training step.
+
+    Buckets are sampled from the same distribution as in the original training
+    loop: bucket i is chosen with probability proportional to its size.
+    """
+    def __init__(self, model, data_points, buckets_scale, queue_size=16):
+        self.model = model
+        self.data_points = data_points
+        self.buckets_scale = buckets_scale
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample_bucket_id(self):
+        random_number_01 = np.random.random_sample()
+        return min([i for i in xrange(len(self.buckets_scale))
+                    if self.buckets_scale[i] > random_number_01])
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                bucket_id = self.sample_bucket_id()
+                formatted_example = self.model.get_batch(
+                    self.data_points, bucket_id)
+                self.put((bucket_id, formatted_example))
+        except Exception as e:
+            # Pass the error to the consumer instead of failing silently.
+            self.put(e)
+
+    def put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def next_batch(self):
+        """
+        :return: (bucket_id, formatted_example) of the next training batch.
+        """
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
 def train(train_set, test_set):
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True,
             log_device_placement=FLAGS.log_device_placement)) as sess:
@@ -79,77 +137,79 @@ def train(train_set, test_set):
         previous_losses = []
         previous_dev_losses = []
 
-        for t in xrange(FLAGS.num_epochs):
-            print("Epoch %d" % (t+1))
-
-            # progress bar
-            start_time = time.time()
-            for _ in tqdm(xrange(FLAGS.steps_per_epoch)):
-                time.sleep(0.01)
-                random_number_01 = np.random.random_sample()
-                bucket_id = min([i for i in xrange(len(train_buckets_scale))
-                                 if train_buckets_scale[i] > random_number_01])
-                formatted_example = model.get_batch(train_set.data_points, bucket_id)
-                model_outputs = model.step(
-                    sess, formatted_example, bucket_id, forward_only=False)
-                loss += model_outputs.losses
-                current_step += 1
-            epoch_time = time.time() - start_time
-
-            # Once in a while, we save checkpoint, print statistics, and run evals.
-            if t % FLAGS.epochs_per_checkpoint == 0:
-                # Print statistics for the previous epoch.
-                loss /= FLAGS.steps_per_epoch
-                if loss < 300:
-                    ppx = math.exp(loss)
-                else:
-                    print("Training loss = {} is too large.".format(loss))
-                    if t > 1:
-                        break
-                    else:
-                        raise graph_utils.InfPerplexityError
-                print("learning rate %.4f epoch-time %.4f perplexity %.2f" % (
-                    model.learning_rate.eval(), epoch_time, ppx))
-
-                # Decrease learning rate if no improvement of loss was seen
-                # over last 3 times.
-                if len(previous_losses) > 2 and loss > max(previous_losses[-3:]):
-                    sess.run(model.learning_rate_decay_op)
-                previous_losses.append(loss)
-
-                checkpoint_path = os.path.join(FLAGS.model_dir, "translate.ckpt")
-                # Save checkpoint and reset timer and loss.
-                model.saver.save(
-                    sess, checkpoint_path, global_step=t, write_meta_graph=False)
-
-                epoch_time, loss, dev_loss = 0.0, 0.0, 0.0
-                # Run evals on development set and print the metrics.
-                sample_size = 10
-                repeated_samples = list(range(len(train_set.buckets))) * sample_size
-                for bucket_id in repeated_samples:
-                    if len(test_set.data_points[bucket_id]) == 0:
-                        print("  eval: empty bucket %d" % (bucket_id))
-                        continue
-                    formatted_example = model.get_batch(test_set.data_points, bucket_id)
-                    model_outputs = model.step(
-                        sess, formatted_example, bucket_id, forward_only=True)
-                    eval_loss = model_outputs.losses
-                    dev_loss += eval_loss
-                    eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
-                    print("  eval: bucket %d perplexity %.2f" % (bucket_id, eval_ppx))
-                dev_loss = dev_loss / len(repeated_samples)
+        prefetcher = BatchPrefetcher(model, train_set.data_points,
+            train_buckets_scale, queue_size=FLAGS.prefetch_queue_size)
+
+        try:
+            for t in xrange(FLAGS.num_epochs):
+                print("Epoch %d" % (t+1))
 
-                dev_perplexity = math.exp(dev_loss) if dev_loss < 1000 else float('inf')
-                print("step %d learning rate %.4f dev_perplexity %.2f"
-                        % (t+1, model.learning_rate.eval(), dev_perplexity))
+                # progress bar
+                start_time = time.time()
+                for _ in tqdm(xrange(FLAGS.steps_per_epoch)):
+                    bucket_id, formatted_example = prefetcher.next_batch()
+                    model_outputs = model.step(
+                        sess, formatted_example, bucket_id, forward_only=False)
+                    loss += model_outputs.losses
+                    current_step += 1
+                epoch_time = time.time() - start_time
+
+                # Once in a while, we save checkpoint, print statistics, and run evals.
+                if t % FLAGS.epochs_per_checkpoint == 0:
+                    # Print statistics for the previous epoch.
+                    loss /= FLAGS.steps_per_epoch
+                    if loss < 300:
+                        ppx = math.exp(loss)
+                    else:
+                        print("Training loss = {} is too large.".format(loss))
+                        if t > 1:
+                            break
+                        else:
+                            raise graph_utils.InfPerplexityError
+                    print("learning rate %.4f epoch-time %.4f perplexity %.2f" % (
+                        model.learning_rate.eval(), epoch_time, ppx))
+
+                    # Decrease learning rate if no improvement of loss was seen
+                    # over last 3 times.
+                    if len(previous_losses) > 2 and loss > max(previous_losses[-3:]):
+                        sess.run(model.learning_rate_decay_op)
+                    previous_losses.append(loss)
+
+                    checkpoint_path = os.path.join(FLAGS.model_dir, "translate.ckpt")
+                    # Save checkpoint and reset timer and loss.
+                    model.saver.save(
+                        sess, checkpoint_path, global_step=t, write_meta_graph=False)
+
+                    epoch_time, loss, dev_loss = 0.0, 0.0, 0.0
+                    # Run evals on development set and print the metrics.
+                    sample_size = 10
+                    repeated_samples = list(range(len(train_set.buckets))) * sample_size
+                    for bucket_id in repeated_samples:
+                        if len(test_set.data_points[bucket_id]) == 0:
+                            print("  eval: empty bucket %d" % (bucket_id))
+                            continue
+                        formatted_example = model.get_batch(test_set.data_points, bucket_id)
+                        model_outputs = model.step(
+                            sess, formatted_example, bucket_id, forward_only=True)
+                        eval_loss = model_outputs.losses
+                        dev_loss += eval_loss
+                        eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
+                        print("  eval: bucket %d perplexity %.2f" % (bucket_id, eval_ppx))
+                    dev_loss = dev_loss / len(repeated_samples)
+
+                    dev_perplexity = math.exp(dev_loss) if dev_loss < 1000 else float('inf')
+                    print("step %d learning rate %.4f dev_perplexity %.2f"
+                            % (t+1, model.learning_rate.eval(), dev_perplexity))
+
+                    # Early stop if no improvement of dev loss was seen over last 3 checkpoints.
+                    if len(previous_dev_losses) > 2 and dev_loss > max(previous_dev_losses[-3:]):
+                        break
 
-                # Early stop if no improvement of dev loss was seen over last 3 checkpoints.
-                if len(previous_dev_losses) > 2 and dev_loss > max(previous_dev_losses[-3:]):
-                    break
-           
-                previous_dev_losses.append(dev_loss)
+                    previous_dev_losses.append(dev_loss)
 
-                sys.stdout.flush()
+                    sys.stdout.flush()
+        finally:
+            prefetcher.stop()
 
         return model
 
@@ -190,6 +250,31 @@ def demo(buckets=None):
         decode_tools.demo(sess, model, FLAGS)
 
 
+def serve(buckets=None):
+    # the service requires Python 3
+    from encoder_decoder.serve import TranslationServer
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True,
+        log_device_placement=FLAGS.log_device_placement)) as sess:
+        # Initialize model parameters.
+        model = define_model(sess, forward_only=True, buckets=buckets)
+        TranslationServer(sess, model, FLAGS).run()
+
+
+def export_inference_graph(buckets=None):
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True,
+        log_device_placement=FLAGS.log_device_placement)) as sess:
+        # Initialize model parameters.
+        model = define_model(sess, forward_only=True, buckets=buckets)
+        ckpt = tf.train.get_checkpoint_state(model.model_dir)
+        if ckpt is None:
+            raise ValueError("No model checkpoint found in {}, train the "
+                             "model before exporting its inference graph"
+                             .format(model.model_dir))
+        model.export_inference_graph(sess,
+            graph_utils.get_inference_graph_path(FLAGS, model.hyperparams),
+            checkpoint_path=ckpt.model_checkpoint_path)
+
+
 def save_hyperparameters():
     model_subdir, decode_sig = graph_utils.get_decode_signature(FLAGS)
     with open(os.path.join(FLAGS.model_root_dir, model_subdir, 'hyperparameters.pkl'), 'wb') as o_f:
@@ -341,6 +426,12 @@ def main(_):
         elif FLAGS.demo:
             demo(buckets=train_set.buckets)
 
+        elif FLAGS.serve:
+            serve(buckets=train_set.buckets)
+
+        elif FLAGS.export_inference_graph:
+            export_inference_graph(buckets=train_set.buckets)
+
         elif FLAGS.grid_search:
             meta_experiments.grid_search(
                 train, decode, eval, train_set, dataset, FLAGS)
@@ -8,10 +8,12 @@ from __future__ import print_function
 
 import collections
 import csv
-import nltk
+import hashlib
+import multiprocessing
 import numpy as np
 import os, sys
 import random
+import shutil
 
 if sys.version_info > (3, 0):
     from six.moves import xrange
@@ -245,8 +247,9 @@ def automatic_eval(model_dir, decode_sig, dataset, FLAGS, top_k, num_samples=-1,
         raise ValueError("ground truth and predictions length must be equal: "
                          "{} vs. {}".format(len(grouped_dataset), len(prediction_list)))
 
+    output_path = os.path.join(model_dir, 'auto_eval.{}'.format(decode_sig))
     metrics = get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, FLAGS,
-                                         top_k, num_samples, verbose)
+                                         top_k, num_samples, verbose, output_path=output_path)
     return metrics
 
 
@@ -260,8 +263,10 @@ def gen_automatic_evaluation_table(dataset, FLAGS):
     auto_eval_metrics = {}
     for model_id, model_name in enumerate(model_names):
         prediction_list = model_predictions[model_id]
+        output_path = os.path.join(FLAGS.model_root_dir, 'auto_eval.{}.{}'.format(
+            model_name, 'test' if FLAGS.test else 'dev'))
         M = get_automatic_evaluation_metrics(
-            grouped_dataset, prediction_list, vocabs, FLAGS, top_k=3)
+            grouped_dataset, prediction_list, vocabs, FLAGS, top_k=3, output_path=output_path)
         auto_eval_metrics[model_name] = [M['bleu'][0], M['bleu'][1], M['cms'][0], M['cms'][1]]
 
     metrics_names = ['BLEU1', 'BLEU3', 'TM1', 'TM3']
@@ -269,8 +274,12 @@ def gen_automatic_evaluation_table(dataset, FLAGS):
 
 
 def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, FLAGS, top_k,
-                                     num_samples=-1, verbose=False):
-    cmd_parser = data_tools.bash_parser
+                                     num_samples=-1, verbose=False, output_path=None):
+    """
+    :param output_path: If set, the per-example results are saved to
+        "output_path.npz" (see evaluate_examples) and the evaluation resumes
+        from the checkpoint of an interrupted run.
+    """
     rev_sc_vocab = vocabs.rev_sc_vocab
 
     # Load cached evaluation results
@@ -288,64 +297,43 @@ def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, F
         grouped_dataset = [grouped_dataset[i] for i in sample_ids]
         prediction_list = [prediction_list[i] for i in sample_ids]
 
-    num_eval = 0
-    top_k_temp_correct = np.zeros([len(grouped_dataset), top_k])
-    top_k_str_correct = np.zeros([len(grouped_dataset), top_k])
-    top_k_cms = np.zeros([len(grouped_dataset), top_k])
-    top_k_bleu = np.zeros([len(grouped_dataset), top_k])
-
+    examples = []
     for data_id in xrange(len(grouped_dataset)):
         _, data_group = grouped_dataset[data_id]
         sc_str = data_group[0].sc_txt.strip()
-        sc_key = get_example_nl_key(sc_str)
-        sc_tokens = [rev_sc_vocab[i] for i in data_group[0].sc_ids]
-        if FLAGS.channel == 'char':
-            sc_features = ''.join(sc_tokens)
-            sc_features = sc_features.replace(constants._SPACE, ' ')
-        else:
-            sc_features = ' '.join(sc_tokens)
         command_gts = [dp.tg_txt.strip() for dp in data_group]
-        command_gt_asts = [data_tools.bash_parser(cmd) for cmd in command_gts]
-        template_gts = [data_tools.cmd2template(cmd, loose_constraints=True) for cmd in command_gts]
-        template_gt_asts = [data_tools.bash_parser(temp) for temp in template_gts]
-        if verbose:
+        examples.append((sc_str, command_gts, prediction_list[data_id]))
+
+    columns = evaluate_examples(examples, top_k, structure_eval_cache, command_eval_cache,
+                                num_workers=FLAGS.num_workers, shard_size=FLAGS.eval_shard_size,
+                                output_path=output_path, bleu_level=FLAGS.eval_bleu_level)
+    num_eval = len(examples)
+    top_k_temp_correct = columns['temp_correct']
+    top_k_str_correct = columns['str_correct']
+    top_k_cms = columns['cms']
+    top_k_bleu = columns['bleu']
+
+    if verbose:
+        for data_id in xrange(len(grouped_dataset)):
+            _, data_group = grouped_dataset[data_id]
+            sc_str, command_gts, predictions = examples[data_id]
+            sc_tokens = [rev_sc_vocab[i] for i in data_group[0].sc_ids]
+            if FLAGS.channel == 'char':
+                sc_features = ''.join(sc_tokens)
+                sc_features = sc_features.replace(constants._SPACE, ' ')
+            else:
+                sc_features = ' '.join(sc_tokens)
             print("Example {}".format(data_id))
             print("Original Source: {}".format(sc_str))
             print("Source: {}".format(sc_features))
             for j, command_gt in enumerate(command_gts):
                 print("GT Target {}: ".format(j + 1) + command_gt.strip())
-        num_eval += 1
-        predictions = prediction_list[data_id]
-        for i in xrange(len(predictions)):
-            pred_cmd = predictions[i]
-            pred_ast = cmd_parser(pred_cmd)
-            pred_temp = data_tools.cmd2template(pred_cmd, loose_constraints=True)
-            # A) Exact match with ground truths & exisitng judgements
-            command_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_cmd)
-            structure_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_temp)
-            # B) Match ignoring flag orders
-            temp_match = tree_dist.one_match(
-                template_gt_asts, pred_ast, ignore_arg_value=True)
-            str_match = tree_dist.one_match(
-                command_gt_asts, pred_ast, ignore_arg_value=False)
-            if command_eval_cache and command_example_key in command_eval_cache:
-                str_match = normalize_judgement(command_eval_cache[command_example_key]) == 'y'
-            if structure_eval_cache and structure_example_key in structure_eval_cache:
-                temp_match = normalize_judgement(structure_eval_cache[structure_example_key]) == 'y'
-            if temp_match:
-                top_k_temp_correct[data_id, i] = 1
-            if str_match:
-                top_k_str_correct[data_id, i] = 1
-            cms = token_based.command_match_score(template_gt_asts, pred_ast)
-            bleu = nltk.translate.bleu_score.sentence_bleu(command_gts, pred_cmd)
-            top_k_cms[data_id, i] = cms
-            top_k_bleu[data_id, i] = bleu
-            if verbose:
-                print("Prediction {}: {} ({})".format(i + 1, pred_cmd, cms))
-
-        if verbose:
+            for i in xrange(len(predictions)):
+                print("Prediction {}: {} ({})".format(i + 1, predictions[i], top_k_cms[data_id, i]))
             print()
 
+    # The top-k metrics reported depend on the number of predictions per example
+    predictions = prediction_list[-1]
     top_temp_acc = [-1 for _ in [1, 3, 5, 10]]
     top_cmd_acc = [-1 for _ in [1, 3, 5, 10]]
     top_cms = [-1 for _ in [1, 3, 5, 10]]
@@ -397,6 +385,218 @@ def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, F
     return metrics
 
 
+# Version of the automatic evaluation metrics, to be increased whenever their
+# computation changes so that saved results are recomputed
+EVALUATION_METRICS_VERSION = 2
+
+# Cached manual judgements used by the automatic evaluation workers
+worker_structure_eval_cache = None
+worker_command_eval_cache = None
+
+def init_evaluation_worker(structure_eval_cache, command_eval_cache):
+    global worker_structure_eval_cache, worker_command_eval_cache
+    worker_structure_eval_cache = structure_eval_cache
+    worker_command_eval_cache = command_eval_cache
+
+
+def command_tokens(cmd, ast):
+    """
+    :return: the bash tokens of a command, or its whitespace-separated words
+        if it cannot be parsed.
+    """
+    if ast is None:
+        return cmd.split()
+    return data_tools.ast2tokens(ast, loose_constraints=True)
+
+
+def evaluate_example(sc_str, command_gts, predictions, top_k,
+                     bleu_level='token'):
+    """
+    Compute the automatic evaluation metrics of the predictions of one example.
+
+    :param bleu_level: unit of the BLEU n-grams, 'token' for the bash tokens
+        of the commands or 'char' for the characters of the raw commands.
+    :return: template match, command match, template match score and BLEU
+        of the top k predictions.
+    """
+    cmd_parser = data_tools.bash_parser
+    sc_key = get_example_nl_key(sc_str)
+    command_gt_asts = [data_tools.bash_parser(cmd) for cmd in command_gts]
+    template_gts = [data_tools.cmd2template(cmd, loose_constraints=True) for cmd in command_gts]
+    template_gt_asts = [data_tools.bash_parser(temp) for temp in template_gts]
+
+    temp_correct = np.zeros(top_k)
+    str_correct = np.zeros(top_k)
+    cms_scores = np.zeros(top_k)
+    bleu_scores = np.zeros(top_k)
+    pred_asts = [cmd_parser(pred_cmd) for pred_cmd in predictions]
+    # B) Match ignoring flag orders, each AST is templatized once
+    temp_matches = tree_dist.pairwise_eval(
+        pred_asts, template_gt_asts, metrics=['temp_match'])['temp_match']
+    str_matches = tree_dist.pairwise_eval(
+        pred_asts, command_gt_asts, metrics=['str_match'])['str_match']
+    for i in xrange(len(predictions)):
+        pred_cmd = predictions[i]
+        pred_temp = data_tools.cmd2template(pred_cmd, loose_constraints=True)
+        # A) Exact match with ground truths & exisitng judgements
+        command_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_cmd)
+        structure_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_temp)
+        temp_match = temp_matches[i].any()
+        str_match = str_matches[i].any()
+        if worker_command_eval_cache and command_example_key in worker_command_eval_cache:
+            str_match = normalize_judgement(worker_command_eval_cache[command_example_key]) == 'y'
+        if worker_structure_eval_cache and structure_example_key in worker_structure_eval_cache:
+            temp_match = normalize_judgement(worker_structure_eval_cache[structure_example_key]) == 'y'
+        if temp_match:
+            temp_correct[i] = 1
+        if str_match:
+            str_correct[i] = 1
+    cms_scores[:len(predictions)] = token_based.batch_command_match_score(template_gt_asts, pred_asts)
+    if bleu_level == 'token':
+        # the ground truths are tokenized once for all predictions
+        gt_sequences = [command_tokens(cmd, ast)
+                        for cmd, ast in zip(command_gts, command_gt_asts)]
+        pred_sequences = [command_tokens(cmd, ast)
+                          for cmd, ast in zip(predictions, pred_asts)]
+    elif bleu_level == 'char':
+        gt_sequences, pred_sequences = command_gts, predictions
+    else:
+        raise ValueError('Unrecognized BLEU level: {}.'.format(bleu_level))
+    bleu_scores[:len(predictions)] = token_based.batch_sentence_bleu(gt_sequences, pred_sequences)
+    return temp_correct, str_correct, cms_scores, bleu_scores
+
+
+def evaluate_shard(shard):
+    """
+    :param shard: (shard id, example ids, [(source, ground truths, predictions), ...], top k,
+        BLEU level)
+    :return: shard id, per-example result columns of the shard.
+    """
+    shard_id, example_ids, examples, top_k, bleu_level = shard
+    results = [evaluate_example(sc_str, command_gts, predictions, top_k, bleu_level)
+               for sc_str, command_gts, predictions in examples]
+    columns = {'example_id': np.array(example_ids, dtype=np.int64)}
+    for i, column in enumerate(['temp_correct', 'str_correct', 'cms', 'bleu']):
+        columns[column] = np.array([result[i] for result in results]).reshape([len(results), top_k])
+    return shard_id, columns
+
+
+def get_evaluation_signature(examples, top_k, structure_eval_cache,
+                             command_eval_cache, shard_size, bleu_level):
+    """
+    Fingerprint of the evaluation inputs and of the version of the metrics,
+    which is used to tell whether saved results are still valid.
+    """
+    signature = hashlib.md5()
+    for value in [EVALUATION_METRICS_VERSION, top_k, shard_size, bleu_level,
+                  examples,
+                  sorted(structure_eval_cache.items()),
+                  sorted(command_eval_cache.items())]:
+        signature.update(repr(value).encode('utf-8'))
+    return signature.hexdigest()
+
+
+def save_evaluation_columns(path, columns, signature):
+    """
+    Save result columns to an .npz file. The file is written under a temporary
+    name first so that an interrupted run never leaves a truncated file behind.
+    """
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, signature=np.array(signature), **columns)
+    os.rename(tmp_path, path)
+
+
+def load_evaluation_columns(path, signature):
+    """
+    :return: result columns saved in path, None if the file does not exist or
+        was computed from different inputs.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if str(f['signature']) != signature:
+            return None
+        return dict((key, f[key]) for key in f.files if key != 'signature')
+
+
+def evaluate_examples(examples, top_k, structure_eval_cache, command_eval_cache,
+                      num_workers=1, shard_size=50, output_path=None,
+                      bleu_level='token'):
+    """
+    Compute the automatic evaluation metrics of a list of examples with a pool
+    of processes.
+
+    The examples are split into shards of shard_size examples, which are
+    evaluated independently. If output_path is set, every evaluated shard is
+    saved to the "output_path.checkpoint" directory and the results of a run
+    with the same inputs are reused, so that an interrupted evaluation resumes
+    from the last completed shards. The merged results are saved to
+    "output_path.npz".
+
+    :param examples: list of (source, ground truth commands, predictions).
+    :param bleu_level: see evaluate_example.
+    :return: per-example result columns, i.e. a dictionary of
+        'example_id': [num_examples]
+        'temp_correct', 'str_correct', 'cms', 'bleu': [num_examples, top_k]
+    """
+    signature = get_evaluation_signature(examples, top_k,
+        structure_eval_cache, command_eval_cache, shard_size, bleu_level)
+    if output_path:
+        columns = load_evaluation_columns(output_path + '.npz', signature)
+        if columns is not None:
+            print('evaluation results loaded from {}.npz'.format(output_path))
+            return columns
+        checkpoint_dir = output_path + '.checkpoint'
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+    shard_columns = {}
+    shards = []
+    for shard_id, start in enumerate(xrange(0, len(examples), shard_size)):
+        example_ids = list(xrange(start, min(start + shard_size, len(examples))))
+        if output_path:
+            columns = load_evaluation_columns(os.path.join(
+                checkpoint_dir, 'shard-{:05d}.npz'.format(shard_id)), signature)
+            # a shard is only reused if it covers exactly the expected examples
+            if columns is not None and \
+                    list(columns['example_id']) == example_ids:
+                shard_columns[shard_id] = columns
+                continue
+        shards.append((shard_id, example_ids,
+                       [examples[i] for i in example_ids], top_k, bleu_level))
+    if shard_columns:
+        print('{} evaluated shards loaded from {}'.format(len(shard_columns), checkpoint_dir))
+
+    if num_workers > 1 and len(shards) > 1:
+        pool = multiprocessing.Pool(num_workers, init_evaluation_worker,
+                                    (structure_eval_cache, command_eval_cache))
+        results = pool.imap_unordered(evaluate_shard, shards)
+    else:
+        pool = None
+        init_evaluation_worker(structure_eval_cache, command_eval_cache)
+        results = (evaluate_shard(shard) for shard in shards)
+    try:
+        for shard_id, columns in results:
+            shard_columns[shard_id] = columns
+            if output_path:
+                save_evaluation_columns(os.path.join(
+                    checkpoint_dir, 'shard-{:05d}.npz'.format(shard_id)), columns, signature)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    columns = {}
+    for column in ['example_id', 'temp_correct', 'str_correct', 'cms', 'bleu']:
+        column_shards = [shard_columns[shard_id][column] for shard_id in sorted(shard_columns)]
+        columns[column] = np.concatenate(column_shards) if column_shards \
+            else np.zeros([0] if column == 'example_id' else [0, top_k])
+    if output_path:
+        save_evaluation_columns(output_path + '.npz', columns, signature)
+        shutil.rmtree(checkpoint_dir)
+        print('evaluation results saved to {}.npz'.format(output_path))
+    return columns
+
+
 def print_eval_table(model_names, metrics_names, model_metrics):
     # print evaluation table
     # pad model names with spaces to create alignment
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that the batched token-based metrics produce the same scores as their
+one-by-one counterparts: batch_command_match_score against
+command_match_score and batch_sentence_bleu against the sentence BLEU of
+nltk 3.2.5 (kept below as a reference).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import fractions
+import io
+import math
+import os
+
+import numpy as np
+
+from bashlint import data_tools
+from eval import token_based
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'bash')
+
+
+# --- Reference implementation --- #
+
+def nltk_sentence_bleu(references, hypothesis, max_n=4):
+    """
+    nltk.translate.bleu_score.sentence_bleu of nltk 3.2.5 with uniform weights
+    and without smoothing.
+    """
+    p_numerators, p_denominators = [], []
+    for n in range(1, max_n + 1):
+        counts = collections.Counter(token_based.get_ngrams(hypothesis, n))
+        max_counts = {}
+        for reference in references:
+            reference_counts = collections.Counter(
+                token_based.get_ngrams(reference, n))
+            for ngram in counts:
+                max_counts[ngram] = max(max_counts.get(ngram, 0),
+                                        reference_counts[ngram])
+        clipped_counts = dict((ngram, min(count, max_counts[ngram]))
+                              for ngram, count in counts.items())
+        p_numerators.append(sum(clipped_counts.values()))
+        p_denominators.append(max(1, sum(counts.values())))
+
+    # there is no higher order match without a unigram match
+    if p_numerators[0] == 0:
+        return 0
+
+    hyp_len = len(hypothesis)
+    closest_ref_len = min((len(reference) for reference in references),
+        key=lambda ref_len: (abs(ref_len - hyp_len), ref_len))
+    if hyp_len > closest_ref_len:
+        bp = 1
+    elif hyp_len == 0:
+        bp = 0
+    else:
+        bp = math.exp(1 - closest_ref_len / hyp_len)
+
+    # method0: stop at the first order without any match
+    p_n = []
+    for numerator, denominator in zip(p_numerators, p_denominators):
+        if numerator == 0:
+            break
+        p_n.append(fractions.Fraction(numerator, denominator))
+    s = (1.0 / max_n * math.log(p_i) for p_i in p_n)
+    return bp * math.exp(math.fsum(s))
+
+
+# --- Tests --- #
+
+def load_commands(num_commands):
+    commands = []
+    with io.open(os.path.join(data_dir, 'all.cm'), encoding='utf-8') as f:
+        for line in f:
+            commands.append(line.strip())
+            if len(commands) == num_commands:
+                break
+    return commands
+
+commands = load_commands(60)
+
+def check_batch_sentence_bleu(references, hypotheses):
+    bleu = token_based.batch_sentence_bleu(references, hypotheses)
+    assert bleu.shape == (len(hypotheses),)
+    for hypothesis, score in zip(hypotheses, bleu):
+        assert np.isclose(score, nltk_sentence_bleu(references, hypothesis))
+
+def test_batch_sentence_bleu():
+    for i in range(0, len(commands) - 6, 6):
+        references = commands[i:i+3]
+        hypotheses = commands[i:i+6] + [commands[i][:10], commands[i] * 2]
+        check_batch_sentence_bleu(references, hypotheses)
+
+def test_batch_sentence_bleu_empty_hypothesis():
+    check_batch_sentence_bleu(['ls -l', 'find .'], ['', 'ls'])
+    assert token_based.batch_sentence_bleu(['ls -l'], [''])[0] == 0
+
+def test_batch_sentence_bleu_tied_reference_lengths():
+    # both references are 2 characters away from the hypothesis, the
+    # shorter one is used for the brevity penalty
+    references = ['abcdefgh', 'abcdefghijkl']
+    check_batch_sentence_bleu(references, ['abcdefghij', 'abcdxfghij'])
+
+def test_batch_sentence_bleu_no_unigram_match():
+    check_batch_sentence_bleu(['abcd', 'abcdef'], ['xyz', 'xyzw', 'ab'])
+    assert token_based.batch_sentence_bleu(['abcd'], ['xyz'])[0] == 0
+
+def test_batch_sentence_bleu_no_higher_order_match():
+    # unigram matches only, the product stops after the first order
+    check_batch_sentence_bleu(['abcd'], ['dcba', 'dbca', 'adcb'])
+
+def test_batch_command_match_score():
+    asts = [data_tools.bash_parser(cmd) for cmd in commands]
+    for i in range(0, len(asts) - 6, 6):
+        gts = asts[i:i+3]
+        pred_asts = asts[i:i+6] + [None]
+        cms = token_based.batch_command_match_score(gts, pred_asts)
+        assert cms.shape == (len(pred_asts),)
+        for pred_ast, score in zip(pred_asts, cms):
+            assert np.isclose(score,
+                              token_based.command_match_score(gts, pred_ast))
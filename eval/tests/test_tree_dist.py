@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Check that the N x M matrices of tree_dist.pairwise_eval agree with the
+pairwise str_dist, temp_dist and one_match on commands of data/bash/all.cm.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+
+import numpy as np
+
+from bashlint import data_tools, nast
+from eval import tree_dist, zss
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'bash')
+
+
+def load_asts(num_asts):
+    asts = []
+    with io.open(os.path.join(data_dir, 'all.cm'), encoding='utf-8') as f:
+        for line in f:
+            ast = data_tools.bash_parser(line.strip())
+            if ast is not None:
+                asts.append(ast)
+            if len(asts) == num_asts:
+                break
+    return asts
+
+asts = load_asts(40)
+gt_asts = asts[:7]
+# include an ungrammatical prediction and predictions equal to ground truths
+pred_asts = asts[5:] + [None]
+
+
+def reference_eval(pred_asts, gt_asts):
+    shape = [len(pred_asts), len(gt_asts)]
+    result = {
+        'str_dist': np.zeros(shape, dtype=np.int64),
+        'temp_dist': np.zeros(shape, dtype=np.int64),
+        'str_match': np.zeros(shape, dtype=bool),
+        'temp_match': np.zeros(shape, dtype=bool)
+    }
+    for i, pred_ast in enumerate(pred_asts):
+        for j, gt_ast in enumerate(gt_asts):
+            result['str_dist'][i, j] = tree_dist.min_dist(
+                [gt_ast], pred_ast, ignore_arg_value=False)
+            result['temp_dist'][i, j] = tree_dist.min_dist(
+                [gt_ast], pred_ast, ignore_arg_value=True)
+            result['str_match'][i, j] = tree_dist.one_match(
+                [gt_ast], pred_ast, ignore_arg_value=False)
+            result['temp_match'][i, j] = tree_dist.one_match(
+                [gt_ast], pred_ast, ignore_arg_value=True)
+    return result
+
+reference = reference_eval(pred_asts, gt_asts)
+
+
+def check_pairwise_eval(num_workers):
+    result = tree_dist.pairwise_eval(pred_asts, gt_asts,
+                                     num_workers=num_workers, chunk_size=4)
+    assert sorted(result) == sorted(reference)
+    for name in reference:
+        assert result[name].shape == (len(pred_asts), len(gt_asts))
+        assert np.array_equal(result[name], reference[name]), name
+    assert result['str_match'].any() and result['temp_match'].any()
+
+def test_pairwise_eval():
+    check_pairwise_eval(num_workers=1)
+
+def test_pairwise_eval_multiprocessing():
+    check_pairwise_eval(num_workers=2)
+
+def test_labeled_tree_dist_non_integer_costs():
+    def label_dist(s1, s2):
+        return 0 if s1 == s2 else 1.5
+    dists = []
+    for ast1, ast2 in zip(asts, asts[1:]):
+        dist = tree_dist.labeled_tree_dist(tree_dist.LabeledTree(ast1),
+                                           tree_dist.LabeledTree(ast2),
+                                           label_dist)
+        assert dist == zss.simple_distance(ast1, ast2, nast.Node.get_children,
+                                           nast.Node.get_label, label_dist)
+        dists.append(dist)
+    assert any(dists)
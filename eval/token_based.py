@@ -1,5 +1,5 @@
 """
-Compute keyword overlap between two commands.
+Compute keyword and n-gram overlap between commands.
 """
 
 from __future__ import absolute_import
@@ -52,3 +52,127 @@ def command_match_score(gts, ast):
         if CMS(ast, gt) > max_cms:
             max_cms = CMS(ast, gt)
     return max_cms
+
+
+def content_token_vectors(content_token_dicts):
+    """
+    :param content_token_dicts: list of content token counts (see
+        get_content_tokens).
+    :return: matrix of content token counts over a shared vocabulary, one row
+        per dictionary.
+    """
+    vocab = {}
+    for token_dict in content_token_dicts:
+        for t in token_dict:
+            vocab.setdefault(t, len(vocab))
+    vectors = np.zeros([len(content_token_dicts), len(vocab)])
+    for i, token_dict in enumerate(content_token_dicts):
+        for t in token_dict:
+            vectors[i, vocab[t]] = token_dict[t]
+    return vectors
+
+
+def batch_command_match_score(gts, asts):
+    """
+    Compute command_match_score(gts, ast) for a list of ASTs in one pass: the
+    content tokens of each tree are extracted once and the CMS of all
+    (ast, gt) pairs are computed as the cosine similarities of their content
+    token vectors.
+
+    :return: numpy array of the command match scores of asts.
+    """
+    if not gts or not asts:
+        return np.zeros(len(asts))
+    vectors = content_token_vectors(
+        [get_content_tokens(ast) for ast in asts] +
+        [get_content_tokens(gt) for gt in gts])
+    ast_vectors, gt_vectors = vectors[:len(asts)], vectors[len(asts):]
+    ast_norms = np.sqrt(np.sum(ast_vectors * ast_vectors, 1))
+    gt_norms = np.sqrt(np.sum(gt_vectors * gt_vectors, 1))
+    num_overlap = np.dot(ast_vectors, gt_vectors.T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cms = num_overlap / ast_norms[:, None] / gt_norms[None, :]
+    cms[(ast_norms == 0)[:, None] | (gt_norms == 0)[None, :]] = 0
+    return np.maximum(np.max(cms, 1), 0.0)
+
+
+def get_ngrams(tokens, n):
+    return zip(*[tokens[i:] for i in range(n)])
+
+
+def batch_sentence_bleu(references, hypotheses, max_n=4):
+    """
+    Compute the sentence BLEU of each hypothesis against the same references,
+    with uniform weights and without smoothing as in
+    nltk.translate.bleu_score.sentence_bleu (nltk 3.2.5): the modified n-gram
+    precision of each order is clipped by the maximum count of the n-gram in
+    any reference and the product of the precisions stops at the first order
+    without any match.
+
+    The n-gram counts of the references are computed once and the
+    hypotheses are scored together with count matrices over a shared n-gram
+    vocabulary.
+
+    :param references: list of references, each one a sequence of tokens (a
+        string is a sequence of characters).
+    :param hypotheses: list of hypotheses, each one a sequence of tokens.
+    :return: numpy array of the BLEU scores of hypotheses.
+    """
+    if not references or not hypotheses:
+        return np.zeros(len(hypotheses))
+
+    # n-gram vocabulary, maximum reference count and order of each n-gram
+    ngram_ids = {}
+    max_ref_counts = []
+    ngram_orders = []
+
+    def ngram_id(ngram, n):
+        if ngram not in ngram_ids:
+            ngram_ids[ngram] = len(ngram_ids)
+            max_ref_counts.append(0)
+            ngram_orders.append(n - 1)
+        return ngram_ids[ngram]
+
+    for reference in references:
+        for n in range(1, max_n + 1):
+            ref_counts = collections.Counter(get_ngrams(reference, n))
+            for ngram in ref_counts:
+                i = ngram_id(ngram, n)
+                max_ref_counts[i] = max(max_ref_counts[i], ref_counts[ngram])
+
+    hyp_counts = []
+    for hypothesis in hypotheses:
+        counts = collections.Counter()
+        for n in range(1, max_n + 1):
+            for ngram in get_ngrams(hypothesis, n):
+                counts[ngram_id(ngram, n)] += 1
+        hyp_counts.append(counts)
+    counts = np.zeros([len(hypotheses), len(ngram_ids)])
+    for i, hyp_count in enumerate(hyp_counts):
+        for j in hyp_count:
+            counts[i, j] = hyp_count[j]
+
+    # [num_ngrams, max_n] one-hot n-gram orders
+    orders = np.zeros([len(ngram_ids), max_n])
+    orders[np.arange(len(ngram_ids)), ngram_orders] = 1
+    numerators = np.dot(np.minimum(counts, np.array(max_ref_counts)), orders)
+    denominators = np.maximum(np.dot(counts, orders), 1)
+
+    # brevity penalty with the closest reference length, shortest first
+    hyp_lens = np.array([len(hypothesis) for hypothesis in hypotheses])
+    ref_lens = np.array(sorted(len(reference) for reference in references))
+    closest_ref_lens = ref_lens[np.argmin(
+        np.abs(ref_lens[None, :] - hyp_lens[:, None]), 1)]
+    with np.errstate(divide='ignore'):
+        bp = np.where(hyp_lens > closest_ref_lens, 1.0, np.exp(
+            1 - closest_ref_lens / np.maximum(hyp_lens, 1)))
+    bp[hyp_lens == 0] = 0
+
+    # orders up to the first one without any match
+    matched = np.cumprod(numerators > 0, 1) > 0
+    with np.errstate(divide='ignore'):
+        log_precisions = np.where(
+            matched, np.log(numerators / denominators), 0)
+    bleu = bp * np.exp(np.sum(log_precisions, 1) / max_n)
+    bleu[numerators[:, 0] == 0] = 0
+    return bleu
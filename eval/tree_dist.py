@@ -2,6 +2,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+import numpy as np
+
 from bashlint import data_tools, nast
 from eval import zss
 
@@ -40,12 +43,133 @@ def temp_local_dist(s1, s2):
     return local_dist(s1, s2, skip_argument=True)
 
 def str_dist(ast1, ast2):
-    return zss.simple_distance(ast1, ast2, nast.Node.get_children,
-                               nast.Node.get_label, str_local_dist)
+    return zss.simple_distance(nast.get_root(ast1), nast.get_root(ast2),
+        nast.Node.get_children, nast.Node.get_label, str_local_dist)
 
 def temp_dist(ast1, ast2):
-    return zss.simple_distance(ast1, ast2, nast.Node.get_children,
-                               nast.Node.get_label, temp_local_dist)
+    return zss.simple_distance(nast.get_root(ast1), nast.get_root(ast2),
+        nast.Node.get_children, nast.Node.get_label, temp_local_dist)
+
+
+class LabeledTree(object):
+    """
+    The post-order node labels, leftmost descendants and keyroots of an AST,
+    i.e. all the tree edit distance needs to know about it. They are computed
+    once per tree and are cheap to send to worker processes.
+    """
+    def __init__(self, ast):
+        tree = zss.compare.AnnotatedTree(
+            nast.get_root(ast), nast.Node.get_children)
+        self.labels = [nast.Node.get_label(node) for node in tree.nodes]
+        self.lmds = tree.lmds
+        self.keyroots = tree.keyroots
+
+    @property
+    def nodes(self):
+        # the labels stand in for the nodes in zss.compare.annotated_distance
+        return self.labels
+
+
+def labeled_tree_dist(tree1, tree2, label_dist):
+    costs = zss.compare.label_costs(tree1.labels, tree2.labels, label_dist)
+    if costs is None:
+        # non-integer costs (see zss.compare.annotated_simple_distance)
+        return zss.compare.annotated_distance(tree1, tree2,
+            insert_cost=lambda label: label_dist('', label),
+            remove_cost=lambda label: label_dist(label, ''),
+            update_cost=lambda a, b: label_dist(a, b))
+    return zss.compare.fast_distance(tree1, tree2, *costs)
+
+
+# ground truth trees of the pairwise distance workers
+pairwise_gt_trees = None
+
+def init_pairwise_worker(gt_trees):
+    global pairwise_gt_trees
+    pairwise_gt_trees = gt_trees
+
+def pairwise_dist_rows(pred_trees):
+    """
+    :return: [str_dist rows, temp_dist rows] of pred_trees against
+        pairwise_gt_trees.
+    """
+    return [[[labeled_tree_dist(gt_tree, pred_tree, label_dist)
+              for gt_tree in pairwise_gt_trees] for pred_tree in pred_trees]
+            for label_dist in (str_local_dist, temp_local_dist)]
+
+
+pairwise_metrics = ('str_dist', 'temp_dist', 'str_match', 'temp_match')
+
+def pairwise_eval(pred_asts, gt_asts, num_workers=1, chunk_size=16,
+                  metrics=pairwise_metrics):
+    """
+    Compare N predicted ASTs against M ground truth ASTs. Each AST is
+        annotated and templatized exactly once.
+    :param pred_asts: list of predicted ASTs (ungrammatical predictions can
+        be None).
+    :param gt_asts: list of ground truth ASTs.
+    :param num_workers: number of processes computing the tree edit
+        distances.
+    :param chunk_size: number of predictions sent to a worker at a time.
+    :param metrics: names of the matrices to compute. The tree edit
+        distances are skipped if neither is requested.
+    :return: a dictionary of N x M matrices:
+        'str_dist': str_dist(gt_ast, pred_ast);
+        'temp_dist': temp_dist(gt_ast, pred_ast);
+        'str_match': one_match([gt_ast], pred_ast, ignore_arg_value=False);
+        'temp_match': one_match([gt_ast], pred_ast, ignore_arg_value=True).
+    """
+    def templates(asts, arg_type_only):
+        return [data_tools.ast2template(ast, loose_constraints=True,
+                                        arg_type_only=arg_type_only)
+                for ast in asts]
+
+    def match(pred_templates, gt_templates):
+        return np.array([[pred_temp == gt_temp for gt_temp in gt_templates]
+                         for pred_temp in pred_templates], dtype=bool
+                        ).reshape([len(pred_templates), len(gt_templates)])
+
+    for name in metrics:
+        if not name in pairwise_metrics:
+            raise ValueError('Unrecognized pairwise metric: {}.'.format(name))
+    result = {}
+    if 'str_match' in metrics:
+        result['str_match'] = match(templates(pred_asts, False),
+                                    templates(gt_asts, False))
+    if 'temp_match' in metrics:
+        result['temp_match'] = match(templates(pred_asts, True),
+                                     templates(gt_asts, True))
+    if not 'str_dist' in metrics and not 'temp_dist' in metrics:
+        return result
+
+    # tolerate ungrammatical predictions (see min_dist)
+    find_tree = LabeledTree(data_tools.bash_parser("find"))
+    pred_trees = [LabeledTree(ast) if ast else find_tree for ast in pred_asts]
+    gt_trees = [LabeledTree(ast) for ast in gt_asts]
+    chunks = [pred_trees[i:i+chunk_size]
+              for i in range(0, len(pred_trees), chunk_size)]
+    if num_workers > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(num_workers, init_pairwise_worker,
+                                    (gt_trees,))
+        try:
+            chunk_dists = pool.map(pairwise_dist_rows, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        init_pairwise_worker(gt_trees)
+        chunk_dists = [pairwise_dist_rows(chunk) for chunk in chunks]
+
+    shape = [len(pred_asts), len(gt_asts)]
+    if 'str_dist' in metrics:
+        result['str_dist'] = np.array(
+            [row for chunk_dist in chunk_dists for row in chunk_dist[0]],
+            dtype=np.int64).reshape(shape)
+    if 'temp_dist' in metrics:
+        result['temp_dist'] = np.array(
+            [row for chunk_dist in chunk_dists for row in chunk_dist[1]],
+            dtype=np.int64).reshape(shape)
+    return result
 
 
 def min_dist(asts, ast2, rewrite=False, ignore_arg_value=False):
@@ -8,6 +8,7 @@ from __future__ import absolute_import
 from six.moves import range
 
 import collections
+import itertools
 
 try:
     import numpy as np
@@ -117,12 +118,136 @@ def simple_distance(A, B, get_children=Node.get_children,
 
     :return: An integer distance [0, inf+)
     """
-    return distance(
-        A, B, get_children,
-        insert_cost=lambda node: label_dist('', get_label(node)),
-        remove_cost=lambda node: label_dist(get_label(node), ''),
-        update_cost=lambda a, b: label_dist(get_label(a), get_label(b)),
-    )
+    A, B = AnnotatedTree(A, get_children), AnnotatedTree(B, get_children)
+    return annotated_simple_distance(A, B, get_label, label_dist)
+
+
+def annotated_simple_distance(A, B, get_label, label_dist):
+    """Computes the exact tree edit distance between two annotated trees with
+    the costs of :py:func:`zss.simple_distance`.
+
+    :param A: An :py:class:`AnnotatedTree`.
+    :param B: An :py:class:`AnnotatedTree`.
+
+    :return: An integer distance [0, inf+)
+    """
+    costs = label_costs([get_label(n) for n in A.nodes],
+                        [get_label(n) for n in B.nodes], label_dist)
+    if costs is None:
+        return annotated_distance(
+            A, B,
+            insert_cost=lambda node: label_dist('', get_label(node)),
+            remove_cost=lambda node: label_dist(get_label(node), ''),
+            update_cost=lambda a, b: label_dist(get_label(a), get_label(b)),
+        )
+    return fast_distance(A, B, *costs)
+
+
+def label_costs(A_labels, B_labels, label_dist):
+    """Precomputes the edit costs of two trees for
+    :py:func:`zss.compare.fast_distance`.
+
+    The labels of each tree are mapped to integer ids and ``label_dist`` is
+    evaluated once per pair of distinct labels.
+
+    :param A_labels: The labels of the nodes of a tree in post-order.
+    :param B_labels: The labels of the nodes of a tree in post-order.
+
+    :return: A tuple ``(A_ids, B_ids, remove, insert, update)`` where
+        ``A_ids[i]`` (``B_ids[j]``) is the label id of the i-th (j-th) node of
+        ``A`` (``B``) in post-order, ``remove[a]`` is the cost to remove a
+        node with label id ``a`` from ``A``, ``insert[b]`` is the cost to
+        insert a node with label id ``b`` of ``B`` and ``update[a][b]`` is
+        the cost to change label ``a`` into label ``b``. ``None`` if some cost
+        is not an integer.
+    """
+    A_vocab, B_vocab = dict(), dict()
+    A_ids = [A_vocab.setdefault(label, len(A_vocab)) for label in A_labels]
+    B_ids = [B_vocab.setdefault(label, len(B_vocab)) for label in B_labels]
+    A_labels = sorted(A_vocab, key=A_vocab.get)
+    B_labels = sorted(B_vocab, key=B_vocab.get)
+
+    remove = [label_dist(a, '') for a in A_labels]
+    insert = [label_dist('', b) for b in B_labels]
+    update = [[label_dist(a, b) for b in B_labels] for a in A_labels]
+
+    # the generic engine stores distances in integer matrices, fractional
+    # costs have to go through it to get the same results
+    for cost in itertools.chain(remove, insert, *update):
+        if cost != int(cost):
+            return None
+    remove = [int(cost) for cost in remove]
+    insert = [int(cost) for cost in insert]
+    update = [[int(cost) for cost in row] for row in update]
+    return A_ids, B_ids, remove, insert, update
+
+
+def fast_distance(A, B, A_ids, B_ids, remove, insert, update):
+    """Computes the exact tree edit distance between two annotated trees
+    with precomputed integer label ids and costs (see
+    :py:func:`zss.compare.label_costs`).
+
+    Same algorithm as :py:func:`zss.distance`, but the forest distances of all
+    keyroot pairs are computed in a single scratch matrix preallocated for the
+    tree pair, with plain lists and without calling back into Python cost
+    functions.
+
+    :param A: An :py:class:`AnnotatedTree`, or any object with the ``lmds``
+        and ``keyroots`` of one.
+    :param B: Same as ``A``.
+
+    :return: An integer distance [0, inf+)
+    """
+    Al = A.lmds
+    Bl = B.lmds
+    # costs of the nodes in post-order
+    remove = [remove[a] for a in A_ids]
+    insert = [insert[b] for b in B_ids]
+    update = [update[a] for a in A_ids]
+
+    treedists = [[0] * len(Bl) for _ in range(len(Al))]
+    fd = [[0] * (len(Bl) + 1) for _ in range(len(Al) + 1)]
+
+    for i in A.keyroots:
+        m = i - Al[i] + 2
+        ioff = Al[i] - 1
+        for j in B.keyroots:
+            n = j - Bl[j] + 2
+            joff = Bl[j] - 1
+
+            fd0 = fd[0]
+            for y in range(1, n):
+                fd0[y] = fd0[y-1] + insert[y+joff]
+
+            for x in range(1, m):
+                u = x + ioff
+                prev = fd[x-1]
+                row = fd[x]
+                remove_u = remove[u]
+                update_u = update[u]
+                treedists_u = treedists[u]
+                # row p holds the forest distance up to l(u)-1
+                p = Al[u] - 1 - ioff
+                fd_p = fd[p]
+                left = row[0] = prev[0] + remove_u
+                for y in range(1, n):
+                    v = y + joff
+                    # only need to check if u is an ancestor of i
+                    # and v is an ancestor of j
+                    on_path = p == 0 and Bl[v] == Bl[j]
+                    if on_path:
+                        d = prev[y-1] + update_u[B_ids[v]]
+                    else:
+                        d = fd_p[Bl[v]-1-joff] + treedists_u[v]
+                    if prev[y] + remove_u < d:
+                        d = prev[y] + remove_u
+                    if left + insert[v] < d:
+                        d = left + insert[v]
+                    if on_path:
+                        treedists_u[v] = d
+                    row[y] = left = d
+
+    return treedists[-1][-1]
 
 
 def distance(A, B, get_children, insert_cost, remove_cost, update_cost):
@@ -157,6 +282,18 @@ def distance(A, B, get_children, insert_cost, remove_cost, update_cost):
     :return: An integer distance [0, inf+)
     '''
     A, B = AnnotatedTree(A, get_children), AnnotatedTree(B, get_children)
+    return annotated_distance(A, B, insert_cost, remove_cost, update_cost)
+
+
+def annotated_distance(A, B, insert_cost, remove_cost, update_cost):
+    """Computes the exact tree edit distance between two annotated trees with
+    the cost functions of :py:func:`zss.distance`.
+
+    :param A: An :py:class:`AnnotatedTree`.
+    :param B: An :py:class:`AnnotatedTree`.
+
+    :return: An integer distance [0, inf+)
+    """
     treedists = zeros((len(A.nodes), len(B.nodes)), int)
 
     def treedist(i, j):
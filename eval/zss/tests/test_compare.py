@@ -5,9 +5,14 @@
 #For licensing see the LICENSE file in the top level directory.
 
 from __future__ import absolute_import
+from six.moves import range
+
+import random
 
 from zss import (
     compare,
+    distance,
+    simple_distance,
     Node,
 )
 
@@ -58,3 +63,41 @@ def test_keyroots():
     A, B = [compare.AnnotatedTree(t, t.get_children) for t in simple_trees()]
     assert A.keyroots == [2, 4, 5]
     assert B.keyroots == [1, 4, 5]
+
+
+def random_tree(size, labels):
+    nodes = [Node(random.choice(labels))]
+    for _ in range(size - 1):
+        node = Node(random.choice(labels))
+        random.choice(nodes).addkid(node)
+        nodes.append(node)
+    return nodes[0]
+
+def test_fast_distance():
+    label_dist = lambda a, b: 0 if a == b else (2 if a and b else 1)
+    random.seed(17)
+    for _ in range(200):
+        A = random_tree(random.randint(1, 20), 'abcd')
+        B = random_tree(random.randint(1, 20), 'abcd')
+        assert simple_distance(A, B, label_dist=label_dist) == distance(
+            A, B, Node.get_children,
+            insert_cost=lambda node: label_dist('', Node.get_label(node)),
+            remove_cost=lambda node: label_dist(Node.get_label(node), ''),
+            update_cost=lambda a, b: label_dist(Node.get_label(a),
+                                                Node.get_label(b)))
+
+def test_label_costs():
+    A, B = [compare.AnnotatedTree(t, t.get_children) for t in simple_trees()]
+    label_dist = lambda a, b: 0 if a == b else 1
+    A_labels = [Node.get_label(n) for n in A.nodes]
+    B_labels = [Node.get_label(n) for n in B.nodes]
+    A_ids, B_ids, remove, insert, update = compare.label_costs(
+        A_labels, B_labels, label_dist)
+    assert sorted(A_ids) == sorted(B_ids) == list(range(6))
+    assert remove == [1] * 6
+    assert insert == [1] * 6
+    assert update[A_ids[0]][B_ids[0]] == 0
+    assert update[A_ids[0]][B_ids[1]] == 1
+    # fractional costs are left to the generic engine
+    assert compare.label_costs(
+        A_labels, B_labels, lambda a, b: 0.5 * label_dist(a, b)) is None
@@ -8,6 +8,7 @@ MIT license: www.opensource.org/licenses/mit-license.php
 
 import os, re, collections
 from collections import Counter
+from six.moves import cPickle as pickle
 
 
 current_folder = os.path.dirname(__file__)
@@ -36,17 +37,33 @@ def extract_top_frequent_words(input, top_k):
             if count >= top_k:
                 break
 
-def P(word, N=sum(WORDS.values())):
+N_WORDS = sum(WORDS.values())
+
+def P(word, N=N_WORDS):
     "Probability of `word`."
     return WORDS[word] / (N+0.0)
 
+CORRECTION_CACHE_SIZE = 100000
+correction_cache = collections.OrderedDict()
+
 def correction(word):
     "Most probable spelling correction for word."
-    return max(candidates(word), key=P)
+    if word in correction_cache:
+        result = correction_cache.pop(word)
+    else:
+        # sort the candidates so that ties are broken the same way every run
+        result = max(sorted(candidates(word)), key=P)
+        if len(correction_cache) >= CORRECTION_CACHE_SIZE:
+            correction_cache.popitem(last=False)
+    correction_cache[word] = result
+    return result
 
 def candidates(word):
     "Generate possible spelling corrections for word."
-    return (known([word]) or known(edits1(word)) or known(edits2(word)) or [word])
+    if word in WORDS:
+        return [word]
+    candidates_by_distance = index_candidates(word)
+    return (candidates_by_distance[1] or candidates_by_distance[2] or [word])
 
 def known(words):
     "The subset of `words` that appear in the dictionary of WORDS."
@@ -66,6 +83,129 @@ def edits2(word):
     "All edits that are two edits away from `word`."
     return (e2 for e1 in edits1(word) for e2 in edits1(e1))
 
+################ Symmetric delete index
+
+# Instead of generating all strings within two edits of a word and looking
+# them up in WORDS, the dictionary words are indexed by the strings obtained
+# by deleting up to two characters from their first PREFIX_LENGTH characters.
+# Two words within two edits of each other share such a deletion string, so
+# the index yields a small candidate set, which is then filtered by the exact
+# edit distance (see http://wolfgarbe.github.io/symspell).
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+INDEX_VERSION = 1
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+index_path = os.path.join(current_folder, 'most_common.index.pickle')
+_delete_index = None
+
+def deletes(word, max_distance=MAX_EDIT_DISTANCE):
+    "All strings obtained by deleting up to `max_distance` characters from `word`."
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = set(w[:i] + w[i+1:] for w in frontier for i in range(len(w)))
+        results |= frontier
+    return results
+
+def build_delete_index():
+    "Map each deletion string of the dictionary word prefixes to the words."
+    index = collections.defaultdict(list)
+    for word in sorted(WORDS):
+        for d in deletes(word[:PREFIX_LENGTH]):
+            index[d].append(word)
+    return dict(index)
+
+def words_signature():
+    path = os.path.join(current_folder, 'most_common.txt')
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (INDEX_VERSION, MAX_EDIT_DISTANCE, PREFIX_LENGTH, stat.st_size,
+            int(stat.st_mtime))
+
+def get_delete_index():
+    "Load the delete index from disk, building and saving it if it is stale."
+    global _delete_index
+    if _delete_index is None:
+        signature = words_signature()
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'rb') as f:
+                    cached_signature, index = pickle.load(f)
+                if cached_signature == signature:
+                    _delete_index = index
+            except Exception:
+                pass
+        if _delete_index is None:
+            _delete_index = build_delete_index()
+            try:
+                with open(index_path, 'wb') as o_f:
+                    pickle.dump((signature, _delete_index), o_f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+            except IOError:
+                pass
+    return _delete_index
+
+def index_candidates(word):
+    "Dictionary words one and two edits away from `word`."
+    index = get_delete_index()
+    candidate_words = set()
+    for d in deletes(word[:PREFIX_LENGTH]):
+        if d in index:
+            candidate_words.update(index[d])
+    candidates_by_distance = {1: set(), 2: set()}
+    for w in candidate_words:
+        distance = edit_distance(word, w)
+        if 0 < distance <= MAX_EDIT_DISTANCE:
+            candidates_by_distance[distance].add(w)
+    return candidates_by_distance
+
+def edit_distance(source, target):
+    """
+    Minimum number of deletes, adjacent transposes, replaces and inserts
+    (as in `edits1`) that turn source into target (Damerau-Levenshtein
+    distance). As in `edits1`, replaces and inserts only produce lowercase
+    letters.
+    """
+    inf = len(source) + len(target) + 1
+    if abs(len(source) - len(target)) > MAX_EDIT_DISTANCE:
+        return inf
+    # d[i+1][j+1] is the distance between source[:i] and target[:j]
+    d = [[inf] * (len(target) + 2) for _ in range(len(source) + 2)]
+    # number of letters in target[:j]
+    num_letters = [0]
+    for c in target:
+        num_letters.append(num_letters[-1] + (c in LETTERS))
+    for i in range(len(source) + 1):
+        d[i+1][1] = i
+    for j in range(len(target) + 1):
+        d[1][j+1] = j if num_letters[j] == j else inf
+    last_row = {}
+    for i in range(1, len(source) + 1):
+        last_match_col = 0
+        for j in range(1, len(target) + 1):
+            k = last_row.get(target[j-1], 0)
+            l = last_match_col
+            if source[i-1] == target[j-1]:
+                cost = 0
+                last_match_col = j
+            else:
+                cost = 1 if target[j-1] in LETTERS else inf
+            insert_cost = 1 if target[j-1] in LETTERS else inf
+            # characters inserted between a transposed pair must be letters
+            if num_letters[j-1] - num_letters[l] == (j - 1 - l):
+                transpose = d[k][l] + (i - k - 1) + 1 + (j - l - 1)
+            else:
+                transpose = inf
+            d[i+1][j+1] = min(d[i][j] + cost,
+                              d[i+1][j] + insert_cost,
+                              d[i][j+1] + 1,
+                              transpose)
+        last_row[source[i-1]] = i
+    return d[len(source)+1][len(target)+1]
+
 ################ Test Code
 
 def unit_tests():